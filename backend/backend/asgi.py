@@ -2,6 +2,7 @@
 ASGI config for backend project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+HTTP is served by Django and websockets by Channels.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.0/howto/deployment/asgi/
@@ -13,4 +14,17 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
 
-application = get_asgi_application()
+# Initialize Django before importing code that uses the ORM
+django_asgi_app = get_asgi_application()
+
+from channels.routing import ProtocolTypeRouter, URLRouter  # noqa: E402
+
+from medical_record.routing import websocket_urlpatterns  # noqa: E402
+from userauth.middleware import TokenAuthMiddleware  # noqa: E402
+
+application = ProtocolTypeRouter({
+    "http": django_asgi_app,
+    # Token-only authentication: without session cookies there is no cross-site
+    # websocket hijacking to guard against, and native apps send no Origin header
+    "websocket": TokenAuthMiddleware(URLRouter(websocket_urlpatterns)),
+})
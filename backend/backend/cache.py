@@ -0,0 +1,30 @@
+"""
+Django cache backend for python-memcached, which is pinned in requirements.txt.
+Django 4.1 dropped its own binding for this library, so it lives here.
+"""
+import pickle
+
+from django.core.cache.backends.memcached import BaseMemcachedCache
+
+
+class MemcachedCache(BaseMemcachedCache):
+    "An implementation of a cache binding using python-memcached"
+
+    def __init__(self, server, params):
+        import memcache
+
+        super().__init__(server, params, library=memcache, value_not_found_exception=ValueError)
+        self._options = {"pickleProtocol": pickle.HIGHEST_PROTOCOL, **self._options}
+
+    def get(self, key, default=None, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        val = self._cache.get(key)
+        # python-memcached doesn't support default values in get()
+        if val is None:
+            return default
+        return val
+
+    def delete(self, key, version=None):
+        # python-memcached's delete() returns True when the key doesn't exist
+        key = self.make_and_validate_key(key, version=version)
+        return bool(self._cache._deletetouch([b"DELETED"], "delete", key))
@@ -35,12 +35,14 @@ CORS_ORIGIN_ALLOW_ALL = True
 # Application definition
 
 INSTALLED_APPS = [
+    'daphne',
     'django.contrib.admin',
     'django.contrib.auth',
     'django.contrib.contenttypes',
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'channels',
     'rest_framework',
     'rest_framework_simplejwt',
     'rest_framework.authtoken',
@@ -57,6 +59,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'userauth.middleware.RoleContextMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'corsheaders.middleware.CorsMiddleware', #corsheaders
@@ -91,6 +94,25 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'backend.wsgi.application'
+ASGI_APPLICATION = 'backend.asgi.application'
+
+# Channel layer for websocket pushes: Redis when CHANNEL_LAYER_REDIS_URL is set, in-memory otherwise.
+# The in-memory layer only reaches sockets of the same process, so it is for development and tests.
+CHANNEL_LAYER_REDIS_URL = config('CHANNEL_LAYER_REDIS_URL', default='')
+
+if CHANNEL_LAYER_REDIS_URL:
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels_redis.core.RedisChannelLayer',
+            'CONFIG': {'hosts': [CHANNEL_LAYER_REDIS_URL]},
+        }
+    }
+else:
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels.layers.InMemoryChannelLayer',
+        }
+    }
 
 
 # Database
@@ -104,6 +126,40 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+# Memcached (python-memcached) when MEMCACHED_LOCATION is set, local memory otherwise
+
+MEMCACHED_LOCATION = config('MEMCACHED_LOCATION', default='')
+
+if MEMCACHED_LOCATION:
+    CACHES = {
+        'default': {
+            'BACKEND': 'backend.cache.MemcachedCache',
+            'LOCATION': [location.strip() for location in MEMCACHED_LOCATION.split(',')],
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'moler-health',
+        }
+    }
+
+# Account activation codes: valid for OTP_TTL_SECONDS and kept in the cache, which must then
+# be shared with the Celery workers, or in the OTP table ('database')
+OTP_TTL_SECONDS = config('OTP_TTL_SECONDS', default=300, cast=int)
+OTP_STORE = config('OTP_STORE', default='cache' if MEMCACHED_LOCATION else 'database')
+
+# Seconds a rendered medical record stays cached; entries are also replaced on every save.
+# Saves only reach the cache of their own process unless it is shared, so 0 (off) by default then
+MEDICAL_RECORD_CACHE_TIMEOUT = config('MEDICAL_RECORD_CACHE_TIMEOUT', default=3600 if MEMCACHED_LOCATION else 0, cast=int)
+
+# Historical versions never change; each process keeps this many rendered versions in memory
+MEDICAL_RECORD_VERSION_LRU_SIZE = config('MEDICAL_RECORD_VERSION_LRU_SIZE', default=1024, cast=int)
+
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
@@ -165,10 +221,39 @@ REST_FRAMEWORK = {
    ],
    'DEFAULT_AUTHENTICATION_CLASSES': (
        'rest_framework.authentication.SessionAuthentication',
-       'rest_framework.authentication.TokenAuthentication',
+       'userauth.authentication.CachedTokenAuthentication',
    )
 }
 
+# Token authentication caches token -> user in the shared cache and, for a few seconds,
+# in a per-process LRU; the LRU TTL bounds how long other processes may see a stale user.
+# A local-memory cache is not shared, so only the LRU is used (0) unless memcached is
+TOKEN_AUTH_CACHE_TIMEOUT = config('TOKEN_AUTH_CACHE_TIMEOUT', default=3600 if MEMCACHED_LOCATION else 0, cast=int)
+TOKEN_AUTH_LRU_SIZE = config('TOKEN_AUTH_LRU_SIZE', default=10000, cast=int)
+TOKEN_AUTH_LRU_TTL = config('TOKEN_AUTH_LRU_TTL', default=30, cast=int)
+
+# JWTs carry role claims (see userauth.authentication.role_claims); the medical record API
+# authenticates them statelessly, so role changes apply at the next login (refreshed access
+# tokens copy the claims of their refresh token)
+SIMPLE_JWT = {
+    'TOKEN_OBTAIN_SERIALIZER': 'userauth.serializers.RoleTokenObtainPairSerializer',
+    'TOKEN_USER_CLASS': 'userauth.authentication.RoleTokenUser',
+}
+
+# Every Nth version of a medical record is stored in full, the others as JSON Patch deltas
+MEDICAL_RECORD_HISTORY_SNAPSHOT_INTERVAL = config('MEDICAL_RECORD_HISTORY_SNAPSHOT_INTERVAL', default=10, cast=int)
+
+# The sync endpoint only hands out changes older than this many seconds, so that
+# transactions still in flight when a client syncs are not skipped by its cursor
+MEDICAL_RECORD_SYNC_SETTLE_SECONDS = config('MEDICAL_RECORD_SYNC_SETTLE_SECONDS', default=5, cast=int)
+
+# Seconds a doctor's edit grant on a medical record stays cached
+MEDICAL_RECORD_GRANT_CACHE_TIMEOUT = config('MEDICAL_RECORD_GRANT_CACHE_TIMEOUT', default=60, cast=int)
+
+# Days an approved permission request grants access before the sweeper expires it
+PERMISSION_GRANT_LIFETIME_DAYS = config('PERMISSION_GRANT_LIFETIME_DAYS', default=30, cast=int)
+PERMISSION_GRANT_SWEEP_BATCH_SIZE = config('PERMISSION_GRANT_SWEEP_BATCH_SIZE', default=500, cast=int)
+
 # Email sending 
 EMAIL_BACKEND = config('EMAIL_BACKEND', default='django.core.mail.backends.smtp.EmailBackend')
 EMAIL_HOST = config('EMAIL_HOST', default='smtp.gmail.com')
@@ -177,9 +262,25 @@ EMAIL_HOST_USER = config('EMAIL_HOST_USER', default='')
 EMAIL_HOST_PASSWORD = config('EMAIL_HOST_PASSWORD', default='')
 EMAIL_USE_TLS = True 
 
+# Bulk registration (userauth.bulk): rows per IN query, bulk_create transaction and Celery
+# task, and processes hashing passwords in the register_users command
+BULK_REGISTRATION_CHUNK_SIZE = config('BULK_REGISTRATION_CHUNK_SIZE', default=500, cast=int)
+BULK_REGISTRATION_HASH_WORKERS = config('BULK_REGISTRATION_HASH_WORKERS', default=os.cpu_count() or 1, cast=int)
+
+# Email outbox (userauth.emails): emails per SMTP connection, drain tasks sending at once,
+# seconds before a worker's batch lease and sending slot lapse, and seconds a scheduled drain
+# may take to start before queuing schedules another
+EMAIL_OUTBOX_BATCH_SIZE = config('EMAIL_OUTBOX_BATCH_SIZE', default=100, cast=int)
+EMAIL_OUTBOX_CONCURRENCY = config('EMAIL_OUTBOX_CONCURRENCY', default=2, cast=int)
+EMAIL_OUTBOX_SLOT_TIMEOUT = config('EMAIL_OUTBOX_SLOT_TIMEOUT', default=300, cast=int)
+EMAIL_OUTBOX_KICK_TIMEOUT = config('EMAIL_OUTBOX_KICK_TIMEOUT', default=60, cast=int)
+EMAIL_OUTBOX_MAX_ATTEMPTS = config('EMAIL_OUTBOX_MAX_ATTEMPTS', default=6, cast=int)
+EMAIL_OUTBOX_RETRY_BASE_SECONDS = config('EMAIL_OUTBOX_RETRY_BASE_SECONDS', default=60, cast=int)
+EMAIL_OUTBOX_RETRY_MAX_SECONDS = config('EMAIL_OUTBOX_RETRY_MAX_SECONDS', default=60 * 60, cast=int)
+
 
 # Celery settings
-CELERY_IMPORTS =  ('userauth.tasks',)
+CELERY_IMPORTS =  ('userauth.tasks', 'medical_record.tasks')
 CELERY_BROKER_URL = "redis://localhost:6379"
 CELERY_RESULT_BACKEND = "redis://localhost:6379"
 CELERY_ACCEPT_CONTENT = ['application/json']
@@ -187,4 +288,34 @@ CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = 'UTC'
-CELERY_RESULT_BACKEND = 'django-db'
\ No newline at end of file
+CELERY_RESULT_BACKEND = 'django-db'
+
+CELERY_BEAT_SCHEDULE = {
+    'expire-permission-grants': {
+        'task': 'expire_permission_grants_task',
+        'schedule': 15 * 60,  # every 15 minutes
+    },
+    'dispatch-outbox-events': {
+        'task': 'dispatch_outbox_events_task',
+        'schedule': 30,  # every 30 seconds
+    },
+    'deliver-webhooks': {
+        'task': 'deliver_webhooks_task',
+        'schedule': 60,  # retries that are due; fresh events are sent by the dispatcher
+    },
+    'send-queued-emails': {
+        'task': 'send_queued_emails_task',
+        'schedule': 30,  # retries that are due; new emails start a drain when queued
+    },
+    'purge-expired-otps': {
+        'task': 'purge_expired_otps_task',
+        'schedule': 60 * 60,  # hourly
+    },
+}
+
+# Hospital webhooks fed by the medical record outbox
+WEBHOOK_BATCH_SIZE = config('WEBHOOK_BATCH_SIZE', default=200, cast=int)
+WEBHOOK_TIMEOUT_SECONDS = config('WEBHOOK_TIMEOUT_SECONDS', default=10, cast=int)
+WEBHOOK_MAX_ATTEMPTS = config('WEBHOOK_MAX_ATTEMPTS', default=8, cast=int)
+WEBHOOK_RETRY_BASE_SECONDS = config('WEBHOOK_RETRY_BASE_SECONDS', default=30, cast=int)
+WEBHOOK_RETRY_MAX_SECONDS = config('WEBHOOK_RETRY_MAX_SECONDS', default=6 * 60 * 60, cast=int)
@@ -1,5 +1,14 @@
 from django.contrib import admin
-from .models import MedicalRecord, PermissionRequest
+from .models import (
+    MedicalRecord,
+    PermissionRequest,
+    ArchivedPermissionRequest,
+    HospitalWebhook,
+    WebhookDelivery,
+)
 
 admin.site.register(MedicalRecord)
 admin.site.register(PermissionRequest)
+admin.site.register(ArchivedPermissionRequest)
+admin.site.register(HospitalWebhook)
+admin.site.register(WebhookDelivery)
@@ -0,0 +1,229 @@
+"""
+ASGI-native read path for medical records.
+
+The REST framework only has synchronous views, so under daphne each read holds a worker
+thread for as long as its queries take. These views answer GET with the async ORM on the
+event loop instead, and hand any other method to the REST framework view of the same URL.
+Errors are rendered as the REST framework would.
+"""
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.utils.http import parse_etags
+from django.views import View
+from rest_framework import status
+from rest_framework.exceptions import (
+    APIException,
+    AuthenticationFailed,
+    NotAuthenticated,
+    NotFound,
+    PermissionDenied,
+    ValidationError,
+)
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+
+from userauth.authentication import aauthenticate
+from userauth.roles import aget_role_context
+
+from .history import materialize_versions
+from .models import MedicalRecord
+from .pagination import MedicalRecordHistoryPagination
+from .record_cache import (
+    acache_history_version,
+    acache_record,
+    aget_cached_history_version,
+    aget_cached_record,
+)
+from .serializers import (
+    MedicalRecordHistorySerializer,
+    MedicalRecordHistorySummarySerializer,
+    MedicalRecordSerializer,
+)
+from .views import MedicalRecordUpdateView
+
+
+class AsyncReadView(View):
+    """
+    Base for the async views: renders JSON like the REST framework and turns its exceptions
+    into the same error responses.
+    """
+    renderer = JSONRenderer()
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        view = super().as_view(**initkwargs)
+        # As with REST framework views, CSRF is enforced by SessionAuthentication on writes
+        view.csrf_exempt = True
+        return view
+
+    async def dispatch(self, request, *args, **kwargs):
+        try:
+            return await super().dispatch(request, *args, **kwargs)
+        except APIException as exc:
+            status_code = exc.status_code
+            if isinstance(exc, (NotAuthenticated, AuthenticationFailed)):
+                # SessionAuthentication comes first and sends no WWW-Authenticate header
+                status_code = status.HTTP_403_FORBIDDEN
+            detail = exc.detail if isinstance(exc.detail, (list, dict)) else {"detail": exc.detail}
+            return self.render(detail, status=status_code)
+
+    def render(self, data, status=status.HTTP_200_OK, headers=None):
+        response = HttpResponse(self.renderer.render(data), content_type="application/json", status=status)
+        for name, value in (headers or {}).items():
+            response[name] = value
+        return response
+
+    def not_modified(self, headers):
+        response = HttpResponse(status=status.HTTP_304_NOT_MODIFIED)
+        for name, value in headers.items():
+            response[name] = value
+        return response
+
+    async def require_visible(self, user, record_id, message):
+        """
+        Raise PermissionDenied unless the user may read the record now: its patient, a doctor
+        holding an approved grant for it, or staff. Its past versions follow the same rule.
+        """
+        await aget_role_context(user)  # Loaded here so that visible_to() does not query for it
+        if not await MedicalRecord.objects.visible_to(user).filter(pk=record_id).aexists():
+            if not await MedicalRecord.objects.filter(pk=record_id).aexists():
+                raise NotFound(f"MedicalRecord with id {record_id} not found.")
+            raise PermissionDenied(message)
+
+
+class AsyncMedicalRecordDetailView(AsyncReadView):
+    """
+    GET: Retrieve a specific medical record, or the version that was current at `?as_of=<iso8601>`,
+         for those who may read the record (see `require_visible`).
+         The current record carries an ETag; a matching If-None-Match returns 304.
+    PUT, PATCH: Handled by MedicalRecordUpdateView.
+    """
+    write_view = staticmethod(MedicalRecordUpdateView.as_view())
+
+    async def get(self, request, pk):
+        user = await aauthenticate(request)
+
+        as_of = request.GET.get("as_of")
+        if as_of is not None:
+            versions = self.as_of_queryset(pk, as_of)
+            await self.require_visible(user, pk, "You don't have permission to view the history of this medical record.")
+            version = await versions.afirst()
+            if version is None or version.history_type == "-":
+                raise NotFound(f"MedicalRecord with id {pk} did not exist at {as_of}.")
+            version = (await sync_to_async(materialize_versions)([version]))[0]
+            return self.render(MedicalRecordSerializer(version.instance).data)
+
+        await self.require_visible(user, pk, "You don't have permission to view this medical record.")
+        if_none_match = parse_etags(request.headers.get("If-None-Match", ""))
+
+        # Hot reads are answered from the cache without loading the record or serializing it
+        version, payload = await aget_cached_record(pk)
+        if payload is not None:
+            etag = MedicalRecord.make_etag(pk, version)
+            if etag in if_none_match:
+                return self.not_modified({"ETag": etag})
+            return self.render(payload, headers={"ETag": etag})
+
+        try:
+            instance = await MedicalRecord.objects.aget(pk=pk)
+        except MedicalRecord.DoesNotExist:
+            raise NotFound()
+        # Polling clients revalidate with If-None-Match and skip serialization entirely
+        if instance.etag in if_none_match:
+            return self.not_modified({"ETag": instance.etag})
+        payload = MedicalRecordSerializer(instance).data
+        await acache_record(instance.pk, instance.version, payload)
+        return self.render(payload, headers={"ETag": instance.etag})
+
+    @staticmethod
+    def as_of_queryset(record_id, as_of):
+        """
+        The version of a record that was current at the `as_of` timestamp, as a queryset to take
+        the first row of. A single seek on the (id, history_date) index.
+        """
+        try:
+            timestamp = parse_datetime(as_of)
+        except ValueError:
+            timestamp = None
+        if timestamp is None:
+            raise ValidationError({"as_of": "Enter a valid ISO 8601 date and time."})
+        if timezone.is_naive(timestamp):
+            timestamp = timezone.make_aware(timestamp)
+
+        return (
+            MedicalRecord.history.filter(id=record_id, history_date__lte=timestamp)
+            .order_by("-history_date", "-history_id")
+        )
+
+    async def put(self, request, *args, **kwargs):
+        return await sync_to_async(self.write_view)(request, *args, **kwargs)
+
+    async def patch(self, request, *args, **kwargs):
+        return await sync_to_async(self.write_view)(request, *args, **kwargs)
+
+
+class AsyncMedicalRecordVersionsView(AsyncReadView):
+    """
+    GET: List the historical versions of a specific medical record, newest first, one cursor page at a time.
+         Versions are summarized by default; `?full=1` returns the complete body of every version.
+    """
+    pagination_class = MedicalRecordHistoryPagination
+    summary_fields = ['id', 'history_id', 'history_date', 'history_type', 'history_user', 'history_changed_fields']
+
+    @classmethod
+    def versions_queryset(cls, record_id, full):
+        versions = MedicalRecord.history.filter(id=record_id).select_related('history_user')
+        if full:
+            return versions
+        # Keep the JSON blobs in the database when only a summary is asked for
+        return versions.only(*cls.summary_fields, 'history_user__first_name', 'history_user__last_name')
+
+    async def get(self, request, pk):
+        user = await aauthenticate(request)
+        await self.require_visible(user, pk, "You don't have permission to view medical record versions.")
+
+        full = request.GET.get('full') in ('1', 'true')
+        paginator = self.pagination_class()
+        page = await paginator.apaginate_queryset(
+            self.versions_queryset(pk, full), Request(request)
+        )
+        if full:
+            page = await sync_to_async(materialize_versions)(page)
+            data = MedicalRecordHistorySerializer(page, many=True).data
+        else:
+            data = MedicalRecordHistorySummarySerializer(page, many=True).data
+        return self.render(paginator.get_paginated_response(data).data)
+
+
+class AsyncMedicalRecordSpecificVersionView(AsyncReadView):
+    """
+    GET: Retrieve a specific historical version of a medical record by history_id.
+    Versions never change, so the payload is cached for good and clients may keep it too.
+    """
+    # Private: the payload is patient data and must not be stored by shared proxies
+    cache_control = "private, max-age=31536000, immutable"
+
+    async def get(self, request, pk, history_id):
+        user = await aauthenticate(request)
+        await self.require_visible(user, pk, "You don't have permission to view this version of the medical record.")
+
+        # A cached payload also proves that the version exists, which a 304 must not skip
+        payload = await aget_cached_history_version(pk, history_id)
+        if payload is None:
+            try:
+                version = await MedicalRecord.history.select_related('history_user').aget(id=pk, history_id=history_id)
+            except MedicalRecord.history.model.DoesNotExist:
+                raise NotFound(f"Version with history_id {history_id} for MedicalRecord with id {pk} not found.")
+            version = (await sync_to_async(materialize_versions)([version]))[0]
+            payload = MedicalRecordHistorySerializer(version).data
+            await acache_history_version(pk, history_id, payload)
+
+        headers = {
+            "ETag": f'"{pk}-h{history_id}"',
+            "Cache-Control": self.cache_control,
+        }
+        if headers["ETag"] in parse_etags(request.headers.get("If-None-Match", "")):
+            return self.not_modified(headers)
+        return self.render(payload, headers=headers)
@@ -0,0 +1,26 @@
+from channels.generic.websocket import AsyncJsonWebsocketConsumer
+
+from .notifications import user_group_name
+
+
+class UserEventsConsumer(AsyncJsonWebsocketConsumer):
+    """
+    Websocket pushing the events of the connected user, e.g. permission requests made to a
+    patient and the responses to a doctor's requests. The socket is receive-only.
+    """
+
+    async def connect(self):
+        user = self.scope.get("user")
+        if user is None or not user.is_authenticated:
+            await self.close(code=4401)
+            return
+        self.group_name = user_group_name(user.pk)
+        await self.channel_layer.group_add(self.group_name, self.channel_name)
+        await self.accept()
+
+    async def disconnect(self, code):
+        if hasattr(self, "group_name"):
+            await self.channel_layer.group_discard(self.group_name, self.channel_name)
+
+    async def user_event(self, message):
+        await self.send_json({"event": message["event"], "payload": message["payload"]})
@@ -0,0 +1,68 @@
+"""
+Cached answers to "may doctor D edit medical record R".
+
+Entries are short-lived and keyed by a generation token per (doctor, record) pair.
+`invalidate_grants` replaces the token once a transaction that changes the underlying
+permission requests commits, so entries written for an older generation, including those
+of readers whose query ran before the commit, are never read again.
+"""
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from .models import PermissionRequest
+
+
+def grant_timeout():
+    return getattr(settings, 'MEDICAL_RECORD_GRANT_CACHE_TIMEOUT', 60)
+
+
+def grant_generation_key(doctor_id, medical_record_id):
+    return f"medical_record:{medical_record_id}:edit_grant:{doctor_id}:generation"
+
+
+def grant_cache_key(doctor_id, medical_record_id, generation):
+    return f"medical_record:{medical_record_id}:edit_grant:{doctor_id}:{generation}"
+
+
+def grant_generation(doctor_id, medical_record_id):
+    """
+    The current generation of a pair. Generations are random, so one lost to eviction is
+    replaced by a new one rather than by a value some stale entry was written under.
+    """
+    key = grant_generation_key(doctor_id, medical_record_id)
+    generation = uuid4().hex
+    if not cache.add(key, generation, timeout=None):
+        generation = cache.get(key) or generation
+    return generation
+
+
+def can_edit(doctor_id, medical_record_id):
+    # The generation is read before the query, so an answer is only cached under the
+    # generation that was current when the query started
+    key = grant_cache_key(doctor_id, medical_record_id, grant_generation(doctor_id, medical_record_id))
+    allowed = cache.get(key)
+    if allowed is None:
+        allowed = PermissionRequest.objects.filter(
+            medical_record_id=medical_record_id,
+            doctor_id=doctor_id,
+            status="approved",
+            edit_permission=True,
+            expiration_time__gt=timezone.now(),
+        ).exists()
+        cache.set(key, allowed, timeout=grant_timeout())
+    return allowed
+
+
+def invalidate_grants(doctor_and_record_ids):
+    """
+    Start a new generation for the given (doctor_id, medical_record_id) pairs once the current
+    transaction commits. Answers cached before then, or by queries that started before then,
+    belong to the old generation and expire unread.
+    """
+    keys = [grant_generation_key(doctor_id, record_id) for doctor_id, record_id in doctor_and_record_ids]
+    if keys:
+        transaction.on_commit(lambda: cache.set_many({key: uuid4().hex for key in keys}, timeout=None))
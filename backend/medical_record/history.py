@@ -0,0 +1,201 @@
+"""
+Delta-compressed storage for the history of medical records.
+
+Every `snapshot_interval()`-th version of a record is stored in full. The versions in
+between keep their scalar columns but store the JSON fields as a JSON Patch (`delta`)
+against the previous version, so history grows with the size of each edit.
+Rows read from the history table must go through `materialize_versions` before their
+JSON fields are used.
+
+Delta rows are marked by `is_snapshot=False` and hold `{}` in the JSON columns, so raw
+readers (`history.all()`, the admin, SQL) do not see their content. Their `instance` and
+`history_object` raise `UnmaterializedVersionError` until the row has been materialized.
+
+History written before delta storage existed stays in full until the
+`compress_medical_record_history` management command is run. It is a command rather than
+a migration because it rewrites every history row of every record, which should not hold
+up a deploy; the readers handle compressed and uncompressed history alike.
+"""
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import models
+from django.db.models import Subquery
+from simple_history.models import HistoricalRecords
+
+from .json_patch import apply_patch, make_patch
+
+JSON_FIELDS = ('medical_history', 'vitals', 'current_visit_details', 'treatment_plan', 'referral_info')
+SCALAR_FIELDS = ('date', 'doctor_name', 'hospital_name', 'hospital_address')
+
+
+class UnmaterializedVersionError(Exception):
+    pass
+
+
+def snapshot_interval():
+    return getattr(settings, 'MEDICAL_RECORD_HISTORY_SNAPSHOT_INTERVAL', 10)
+
+
+class HistoricalDeltaModel(models.Model):
+    """
+    Abstract base for the historical model, see `HistoricalRecords(bases=...)`.
+    """
+    is_snapshot = models.BooleanField(default=True)
+    delta = models.JSONField(null=True, blank=True)
+    # Names of the fields that differ from the previous version, for cheap summaries
+    history_changed_fields = models.JSONField(default=list, blank=True)
+
+    class Meta:
+        abstract = True
+
+
+def is_materialized(version):
+    return version.is_snapshot or getattr(version, '_materialized', False)
+
+
+def _require_materialized(accessor):
+    def guarded(self):
+        if not is_materialized(self):
+            raise UnmaterializedVersionError(
+                f"History row {self.history_id} stores a delta; pass it through materialize_versions first."
+            )
+        return accessor(self)
+    return guarded
+
+
+class IndexedHistoricalRecords(HistoricalRecords):
+    """
+    HistoricalRecords that also declares `indexes` on the generated historical model and
+    keeps the content of unmaterialized delta rows from being read as if it were complete.
+    """
+    def __init__(self, *args, indexes=(), **kwargs):
+        self.indexes = tuple(indexes)
+        super().__init__(*args, **kwargs)
+
+    def get_meta_options(self, model):
+        meta_fields = super().get_meta_options(model)
+        meta_fields['indexes'] = tuple(meta_fields.get('indexes', ())) + self.indexes
+        return meta_fields
+
+    def get_extra_fields(self, model, fields):
+        extra_fields = super().get_extra_fields(model, fields)
+        history_object = extra_fields['history_object']
+        extra_fields['instance'] = property(_require_materialized(extra_fields['instance'].fget))
+        extra_fields['history_object'] = property(_require_materialized(lambda version: history_object.__get__(version, type(version))))
+        extra_fields['__str__'] = lambda version: (
+            f"{model._meta.object_name} {version.id} as of {version.history_date}"
+            + ("" if is_materialized(version) else " (delta)")
+        )
+        return extra_fields
+
+
+def json_document(version):
+    return {field: getattr(version, field) for field in JSON_FIELDS}
+
+
+def _set_document(version, document):
+    for field in JSON_FIELDS:
+        setattr(version, field, document[field])
+    version._materialized = True
+
+
+def _chain_queryset(history_model, record_id, oldest_history_id=None, newest_history_id=None):
+    """
+    Rows of one record from the last snapshot at or before `oldest_history_id` up to
+    `newest_history_id`, oldest first, in a single query.
+    """
+    rows = history_model.objects.filter(id=record_id)
+    snapshots = rows.filter(is_snapshot=True)
+    if oldest_history_id is not None:
+        snapshots = snapshots.filter(history_id__lte=oldest_history_id)
+    if newest_history_id is not None:
+        rows = rows.filter(history_id__lte=newest_history_id)
+    last_snapshot = snapshots.order_by('-history_id').values('history_id')[:1]
+    return rows.filter(history_id__gte=Subquery(last_snapshot)).order_by('history_id')
+
+
+def _walk_chain(chain):
+    """
+    Fill in the JSON fields of every row of a chain that starts with a snapshot.
+    """
+    document = None
+    for version in chain:
+        if version.is_snapshot or document is None:
+            document = json_document(version)
+        else:
+            document = apply_patch(document, version.delta)
+            _set_document(version, document)
+    return chain
+
+
+def latest_chain(history_model, record_id):
+    """
+    The materialized rows since the latest snapshot of a record, oldest first.
+    """
+    return _walk_chain(list(_chain_queryset(history_model, record_id)))
+
+
+def materialize_versions(versions):
+    """
+    Rebuild the JSON fields of delta rows in place and return the versions.
+    Costs one query per record that has delta rows among `versions`.
+    """
+    versions = list(versions)
+    pending = defaultdict(list)
+    for version in versions:
+        if not version.is_snapshot:
+            pending[version.id].append(version)
+
+    for record_id, record_versions in pending.items():
+        history_ids = [version.history_id for version in record_versions]
+        chain = _chain_queryset(
+            type(record_versions[0]),
+            record_id,
+            oldest_history_id=min(history_ids),
+            newest_history_id=max(history_ids),
+        )
+        documents = {version.history_id: json_document(version) for version in _walk_chain(list(chain))}
+        for version in record_versions:
+            _set_document(version, documents[version.history_id])
+    return versions
+
+
+def diff_versions(version_a, version_b):
+    """
+    JSON Patch turning the content (scalar and JSON fields) of `version_a` into `version_b`.
+    Both versions must be materialized.
+    """
+    fields = SCALAR_FIELDS + JSON_FIELDS
+    return make_patch(
+        {field: getattr(version_a, field) for field in fields},
+        {field: getattr(version_b, field) for field in fields},
+    )
+
+
+def changed_fields(previous, version):
+    return [
+        field for field in SCALAR_FIELDS + JSON_FIELDS
+        if getattr(previous, field) != getattr(version, field)
+    ]
+
+
+def compress_version(history_instance, chain):
+    """
+    Store `history_instance` as a delta against the last row of `chain`, unless the chain
+    is empty or long enough that the next version must be a snapshot.
+    `chain` holds the materialized rows since the latest snapshot, oldest first.
+    """
+    history_instance.history_changed_fields = changed_fields(chain[-1], history_instance) if chain else []
+
+    if not chain or len(chain) >= snapshot_interval():
+        history_instance.is_snapshot = True
+        history_instance.delta = None
+        return history_instance
+
+    history_instance.delta = make_patch(json_document(chain[-1]), json_document(history_instance))
+    history_instance.is_snapshot = False
+    for field in JSON_FIELDS:
+        setattr(history_instance, field, {})
+    history_instance._materialized = False
+    return history_instance
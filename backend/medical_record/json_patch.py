@@ -0,0 +1,159 @@
+"""
+Minimal RFC 6902 JSON Patch support for the JSON fields of medical records.
+"""
+import copy
+
+
+class JSONPatchError(ValueError):
+    pass
+
+
+def escape_pointer_token(token):
+    return str(token).replace('~', '~0').replace('/', '~1')
+
+
+def parse_pointer(pointer):
+    """
+    Split a JSON Pointer ("/vitals/blood~1pressure") into its unescaped tokens.
+    """
+    if pointer == '':
+        return []
+    if not isinstance(pointer, str) or not pointer.startswith('/'):
+        raise JSONPatchError(f"Invalid JSON pointer '{pointer}'.")
+    return [token.replace('~1', '/').replace('~0', '~') for token in pointer[1:].split('/')]
+
+
+def make_patch(source, target, path=''):
+    """
+    Return the operations turning `source` into `target`.
+    Objects are diffed key by key; any other change replaces the value at that path.
+    """
+    if isinstance(source, dict) and isinstance(target, dict):
+        operations = []
+        for key in source:
+            if key not in target:
+                operations.append({'op': 'remove', 'path': f'{path}/{escape_pointer_token(key)}'})
+        for key, value in target.items():
+            child_path = f'{path}/{escape_pointer_token(key)}'
+            if key not in source:
+                operations.append({'op': 'add', 'path': child_path, 'value': value})
+            else:
+                operations.extend(make_patch(source[key], value, child_path))
+        return operations
+
+    # bool is an int subclass, so compare types as well as values
+    if type(source) is type(target) and source == target:
+        return []
+    return [{'op': 'replace', 'path': path, 'value': target}]
+
+
+def _resolve_parent(document, tokens, pointer):
+    parent = document
+    for token in tokens[:-1]:
+        parent = _child(parent, token, pointer)
+    return parent
+
+
+def _child(container, token, pointer):
+    try:
+        if isinstance(container, list):
+            return container[_list_index(container, token, pointer)]
+        return container[token]
+    except (KeyError, IndexError, TypeError):
+        raise JSONPatchError(f"Path '{pointer}' does not exist.")
+
+
+def _list_index(container, token, pointer, allow_end=False):
+    if allow_end and token == '-':
+        return len(container)
+    if not token.isdigit() or (len(token) > 1 and token.startswith('0')):
+        raise JSONPatchError(f"Invalid array index in path '{pointer}'.")
+    index = int(token)
+    if index > len(container) or (index == len(container) and not allow_end):
+        raise JSONPatchError(f"Array index out of range in path '{pointer}'.")
+    return index
+
+
+def _add(document, pointer, value):
+    tokens = parse_pointer(pointer)
+    if not tokens:
+        return value
+    parent = _resolve_parent(document, tokens, pointer)
+    if isinstance(parent, list):
+        parent.insert(_list_index(parent, tokens[-1], pointer, allow_end=True), value)
+    elif isinstance(parent, dict):
+        parent[tokens[-1]] = value
+    else:
+        raise JSONPatchError(f"Path '{pointer}' does not exist.")
+    return document
+
+
+def _remove(document, pointer):
+    tokens = parse_pointer(pointer)
+    if not tokens:
+        raise JSONPatchError("The document root cannot be removed.")
+    parent = _resolve_parent(document, tokens, pointer)
+    if isinstance(parent, list):
+        del parent[_list_index(parent, tokens[-1], pointer)]
+    elif isinstance(parent, dict) and tokens[-1] in parent:
+        del parent[tokens[-1]]
+    else:
+        raise JSONPatchError(f"Path '{pointer}' does not exist.")
+    return document
+
+
+def _replace(document, pointer, value):
+    tokens = parse_pointer(pointer)
+    if not tokens:
+        return value
+    document = _remove(document, pointer)
+    return _add(document, pointer, value)
+
+
+def _get(document, pointer):
+    value = document
+    for token in parse_pointer(pointer):
+        value = _child(value, token, pointer)
+    return value
+
+
+def apply_patch(document, operations):
+    """
+    Apply `operations` to a copy of `document` and return the result.
+    """
+    document = copy.deepcopy(document)
+    if not isinstance(operations, list):
+        raise JSONPatchError("A JSON Patch must be a list of operations.")
+
+    for operation in operations:
+        if not isinstance(operation, dict) or 'path' not in operation:
+            raise JSONPatchError("Each operation needs an 'op' and a 'path'.")
+        op = operation.get('op')
+        path = operation['path']
+
+        if op in ('add', 'replace', 'test') and 'value' not in operation:
+            raise JSONPatchError(f"Operation '{op}' needs a 'value'.")
+        if op in ('move', 'copy') and 'from' not in operation:
+            raise JSONPatchError(f"Operation '{op}' needs a 'from'.")
+
+        if op == 'add':
+            document = _add(document, path, copy.deepcopy(operation['value']))
+        elif op == 'remove':
+            document = _remove(document, path)
+        elif op == 'replace':
+            document = _replace(document, path, copy.deepcopy(operation['value']))
+        elif op == 'move':
+            source = operation['from']
+            if path.startswith(source + '/'):
+                raise JSONPatchError(f"Cannot move '{source}' into one of its children.")
+            value = _get(document, source)
+            document = _add(_remove(document, source), path, value)
+        elif op == 'copy':
+            document = _add(document, path, copy.deepcopy(_get(document, operation['from'])))
+        elif op == 'test':
+            value = _get(document, path)
+            if type(value) is not type(operation['value']) or value != operation['value']:
+                raise JSONPatchError(f"Test failed for path '{path}'.")
+        else:
+            raise JSONPatchError(f"Unsupported operation '{op}'.")
+    return document
@@ -0,0 +1,126 @@
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+
+import requests
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+
+class Command(BaseCommand):
+    help = (
+        "Load a medical record read endpoint on the async read path and on the synchronous REST framework "
+        "views it replaced, at increasing concurrency, and compare throughput, latency and server memory. "
+        "The synchronous views only exist before the async views were added, so serve them from a checkout "
+        "of that commit with its own database, seeded with the same data and token, e.g. "
+        "`git worktree add ../baseline <commit>` and `gunicorn -w 1 --threads 8 -b :8002 backend.wsgi:application` "
+        "there, next to `daphne -p 8001 backend.asgi:application` in this tree."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--asgi-url', default='http://127.0.0.1:8001', help="Base URL of the ASGI server running this tree.")
+        parser.add_argument('--wsgi-url', default='http://127.0.0.1:8002', help="Base URL of the WSGI server running the baseline checkout.")
+        parser.add_argument('--asgi-pid', type=int, help="Process id of the ASGI server, to sample its memory.")
+        parser.add_argument('--wsgi-pid', type=int, help="Process id of the WSGI server, to sample its memory.")
+        parser.add_argument('--token', required=True, help="API token of a doctor allowed to read the record, on both servers.")
+        parser.add_argument('--record-id', type=int, required=True)
+        parser.add_argument(
+            '--endpoint', choices=['detail', 'versions', 'version'], default='detail',
+            help="Read endpoint to load; 'version' needs --history-id.",
+        )
+        parser.add_argument('--history-id', type=int)
+        parser.add_argument(
+            '--no-cache', action='store_true',
+            help="Read the detail endpoint with ?as_of=now so every request reaches the database.",
+        )
+        parser.add_argument('--concurrency', default='1,8,32,128', help="Comma separated in-flight request counts.")
+        parser.add_argument('--duration', type=float, default=10.0, help="Seconds per concurrency level.")
+
+    def handle(self, *args, **options):
+        path = self.get_path(options)
+        levels = [int(level) for level in options['concurrency'].split(',')]
+        servers = [
+            ('asgi', options['asgi_url'], options['asgi_pid']),
+            ('wsgi', options['wsgi_url'], options['wsgi_pid']),
+        ]
+
+        self.stdout.write(f"{'server':<6} {'conc':>5} {'req/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7} {'rss MB':>8}")
+        for name, base_url, pid in servers:
+            for concurrency in levels:
+                result = self.run_level(base_url.rstrip('/') + path, options['token'], concurrency, options['duration'], pid)
+                self.stdout.write(
+                    f"{name:<6} {concurrency:>5} {result['throughput']:>9.1f} {result['p50']:>8.1f} "
+                    f"{result['p95']:>8.1f} {result['p99']:>8.1f} {result['errors']:>7} {result['rss']:>8}"
+                )
+
+    def get_path(self, options):
+        record_id = options['record_id']
+        if options['endpoint'] == 'versions':
+            return f'/api/medical-record/medical-records/{record_id}/versions/'
+        if options['endpoint'] == 'version':
+            if options['history_id'] is None:
+                raise CommandError("--history-id is required for the 'version' endpoint.")
+            return f"/api/medical-record/medical-records/{record_id}/version/{options['history_id']}/"
+        if options['no_cache']:
+            return f'/api/medical-record/medical-records/{record_id}/?as_of={quote(timezone.now().isoformat())}'
+        return f'/api/medical-record/medical-records/{record_id}/'
+
+    def run_level(self, url, token, concurrency, duration, pid):
+        latencies = []
+        errors = 0
+        lock = threading.Lock()
+        deadline = time.monotonic() + duration
+
+        def worker():
+            nonlocal errors
+            own_latencies, own_errors = [], 0
+            with requests.Session() as session:
+                session.headers['Authorization'] = f'Token {token}'
+                while time.monotonic() < deadline:
+                    started = time.perf_counter()
+                    try:
+                        ok = session.get(url, timeout=30).status_code == 200
+                    except requests.RequestException:
+                        ok = False
+                    if ok:
+                        own_latencies.append((time.perf_counter() - started) * 1000)
+                    else:
+                        own_errors += 1
+            with lock:
+                latencies.extend(own_latencies)
+                errors += own_errors
+
+        peak_rss = 0
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            futures = [executor.submit(worker) for _ in range(concurrency)]
+            while not all(future.done() for future in futures):
+                peak_rss = max(peak_rss, self.rss_megabytes(pid))
+                time.sleep(0.2)
+
+        latencies.sort()
+        return {
+            'throughput': len(latencies) / duration,
+            'p50': statistics.median(latencies) if latencies else 0.0,
+            'p95': latencies[int(len(latencies) * 0.95)] if latencies else 0.0,
+            'p99': latencies[int(len(latencies) * 0.99)] if latencies else 0.0,
+            'errors': errors,
+            'rss': peak_rss or '-',
+        }
+
+    @staticmethod
+    def rss_megabytes(pid):
+        """
+        Resident memory of a local server process, read from /proc (Linux only).
+        """
+        if pid is None:
+            return 0
+        try:
+            with open(f'/proc/{pid}/status') as status_file:
+                for line in status_file:
+                    if line.startswith('VmRSS:'):
+                        return int(line.split()[1]) // 1024
+        except OSError:
+            pass
+        return 0
@@ -0,0 +1,39 @@
+import copy
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from medical_record.history import compress_version, materialize_versions, JSON_FIELDS
+from medical_record.models import MedicalRecord
+
+
+class Command(BaseCommand):
+    help = "Rewrite existing medical record history into periodic snapshots plus JSON Patch deltas and record the changed fields of every version."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help="Rows written per bulk update.")
+
+    def handle(self, *args, **options):
+        history_model = MedicalRecord.history.model
+        record_ids = history_model.objects.values_list('id', flat=True).distinct().order_by('id')
+        compressed = 0
+
+        for record_id in record_ids.iterator():
+            with transaction.atomic():
+                versions = materialize_versions(
+                    history_model.objects.select_for_update().filter(id=record_id).order_by('history_id')
+                )
+                chain = []
+                for version in versions:
+                    full_version = copy.copy(version)
+                    compress_version(version, chain)
+                    chain = [full_version] if version.is_snapshot else chain + [full_version]
+                    compressed += not version.is_snapshot
+
+                history_model.objects.bulk_update(
+                    versions,
+                    ['is_snapshot', 'delta', 'history_changed_fields', *JSON_FIELDS],
+                    batch_size=options['batch_size'],
+                )
+
+        self.stdout.write(self.style.SUCCESS(f"Stored {compressed} historical version(s) as deltas."))
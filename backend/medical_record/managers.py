@@ -0,0 +1,27 @@
+from django.db import models
+from django.utils import timezone
+
+
+class MedicalRecordQuerySet(models.QuerySet):
+    def visible_to(self, user):
+        """
+        Restrict the queryset to the records the given user may read.
+        Patients see their own records, doctors see the records they hold an approved
+        permission request for and staff see everything.
+        """
+        from userauth.roles import is_doctor, is_patient
+
+        from .models import PermissionRequest
+
+        if user.is_staff:
+            return self
+        if is_patient(user):
+            return self.filter(user_id=user.pk)
+        if is_doctor(user):
+            approved_records = PermissionRequest.objects.filter(
+                doctor_id=user.pk,
+                status="approved",
+                expiration_time__gt=timezone.now(),
+            ).values('medical_record_id')
+            return self.filter(id__in=approved_records)
+        return self.none()
@@ -0,0 +1,21 @@
+# Generated by Django 4.2.7 on 2026-10-18 03:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('medical_record', '0012_alter_permissionrequest_unique_together_and_more'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='medicalrecord',
+            index=models.Index(fields=['user', 'id'], name='medical_record_user_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='permissionrequest',
+            index=models.Index(fields=['doctor', 'status', 'medical_record'], name='permission_doctor_status_idx'),
+        ),
+    ]
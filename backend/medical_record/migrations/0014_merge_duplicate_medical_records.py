@@ -0,0 +1,76 @@
+# Generated by Django 4.2.7 on 2026-10-18 03:32
+
+from django.db import migrations
+from django.db.models import Count
+
+# Fields carried over from the most recent duplicate onto the surviving record
+CONTENT_FIELDS = [
+    'date',
+    'doctor_name',
+    'hospital_name',
+    'hospital_address',
+    'medical_history',
+    'vitals',
+    'current_visit_details',
+    'treatment_plan',
+    'referral_info',
+    'updated_at',
+]
+
+
+def merge_duplicate_records(apps, schema_editor):
+    """
+    Updates used to insert a new MedicalRecord row per edit. Fold every patient's rows into
+    the oldest one: it takes the content of the newest row, inherits the history and the
+    permission requests of the others, and the others are deleted.
+    """
+    MedicalRecord = apps.get_model('medical_record', 'MedicalRecord')
+    HistoricalMedicalRecord = apps.get_model('medical_record', 'HistoricalMedicalRecord')
+    PermissionRequest = apps.get_model('medical_record', 'PermissionRequest')
+
+    duplicated_users = (
+        MedicalRecord.objects.values('user_id')
+        .annotate(record_count=Count('id'))
+        .filter(record_count__gt=1)
+        .values_list('user_id', flat=True)
+    )
+
+    for user_id in list(duplicated_users):
+        records = list(MedicalRecord.objects.filter(user_id=user_id).order_by('id'))
+        keeper, latest = records[0], records[-1]
+        duplicate_ids = [record.id for record in records[1:]]
+
+        MedicalRecord.objects.filter(pk=keeper.pk).update(
+            **{field: getattr(latest, field) for field in CONTENT_FIELDS}
+        )
+
+        # The duplicates' creation entries are edits of the surviving record
+        HistoricalMedicalRecord.objects.filter(id__in=duplicate_ids, history_type='+').update(history_type='~')
+        HistoricalMedicalRecord.objects.filter(id__in=duplicate_ids).update(id=keeper.id)
+
+        # Keep a single pending request per doctor so the partial unique constraint holds
+        seen_doctors = set()
+        redundant_pending = []
+        pending_requests = PermissionRequest.objects.filter(
+            medical_record_id__in=[keeper.id] + duplicate_ids,
+            status='pending',
+        ).order_by('id')
+        for permission_request in pending_requests:
+            if permission_request.doctor_id in seen_doctors:
+                redundant_pending.append(permission_request.id)
+            seen_doctors.add(permission_request.doctor_id)
+        PermissionRequest.objects.filter(id__in=redundant_pending).delete()
+        PermissionRequest.objects.filter(medical_record_id__in=duplicate_ids).update(medical_record_id=keeper.id)
+
+        MedicalRecord.objects.filter(id__in=duplicate_ids).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('medical_record', '0013_medicalrecord_user_id_idx'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_records, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.7 on 2026-10-18 03:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('medical_record', '0014_merge_duplicate_medical_records'),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='medicalrecord',
+            constraint=models.UniqueConstraint(fields=('user',), name='unique_medical_record_per_user'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.7 on 2026-10-18 03:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('medical_record', '0015_medicalrecord_unique_per_user'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='historicalmedicalrecord',
+            name='delta',
+            field=models.JSONField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='historicalmedicalrecord',
+            name='is_snapshot',
+            field=models.BooleanField(default=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-18 03:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('medical_record', '0016_historicalmedicalrecord_delta'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='historicalmedicalrecord',
+            name='history_changed_fields',
+            field=models.JSONField(blank=True, default=list),
+        ),
+    ]
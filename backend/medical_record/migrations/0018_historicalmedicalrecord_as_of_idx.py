@@ -0,0 +1,17 @@
+# Generated by Django 4.2.7 on 2026-10-18 03:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('medical_record', '0017_historicalmedicalrecord_changed_fields'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='historicalmedicalrecord',
+            index=models.Index(fields=['id', 'history_date'], name='historical_record_as_of_idx'),
+        ),
+    ]
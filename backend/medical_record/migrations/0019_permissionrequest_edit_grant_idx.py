@@ -0,0 +1,17 @@
+# Generated by Django 4.2.7 on 2026-10-18 03:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('medical_record', '0018_historicalmedicalrecord_as_of_idx'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='permissionrequest',
+            index=models.Index(fields=['medical_record', 'doctor', 'status', 'edit_permission'], name='permission_edit_grant_idx'),
+        ),
+    ]
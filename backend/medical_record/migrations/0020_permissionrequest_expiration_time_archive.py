@@ -0,0 +1,53 @@
+# Generated by Django 4.2.7 on 2026-10-18 03:37
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('medical_record', '0019_permissionrequest_edit_grant_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedPermissionRequest',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('original_id', models.BigIntegerField(unique=True)),
+                ('status', models.CharField(default='expired', max_length=20)),
+                ('request_date', models.DateTimeField()),
+                ('response_date', models.DateTimeField(blank=True, null=True)),
+                ('edit_permission', models.BooleanField(default=False)),
+                ('expiration_time', models.DateTimeField(blank=True, null=True)),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='permissionrequest',
+            name='expiration_time',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='permissionrequest',
+            index=models.Index(fields=['status', 'expiration_time', 'id'], name='permission_expiry_idx'),
+        ),
+        migrations.AddField(
+            model_name='archivedpermissionrequest',
+            name='doctor',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_requests_made', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='archivedpermissionrequest',
+            name='medical_record',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_permission_requests', to='medical_record.medicalrecord'),
+        ),
+        migrations.AddField(
+            model_name='archivedpermissionrequest',
+            name='patient',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_requests_received', to=settings.AUTH_USER_MODEL),
+        ),
+    ]
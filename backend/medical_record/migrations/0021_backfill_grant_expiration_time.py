@@ -0,0 +1,32 @@
+# Generated by Django 4.2.7 on 2026-10-18 03:37
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import migrations
+from django.db.models import F
+from django.utils import timezone
+
+
+def backfill_expiration_time(apps, schema_editor):
+    """
+    Grants approved before expiry existed get the standard lifetime from their response date,
+    so the sweeper eventually picks them up instead of letting them live forever.
+    """
+    PermissionRequest = apps.get_model('medical_record', 'PermissionRequest')
+    lifetime = timedelta(days=settings.PERMISSION_GRANT_LIFETIME_DAYS)
+
+    approved = PermissionRequest.objects.filter(status='approved', expiration_time__isnull=True)
+    approved.filter(response_date__isnull=False).update(expiration_time=F('response_date') + lifetime)
+    approved.filter(response_date__isnull=True).update(expiration_time=timezone.now() + lifetime)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('medical_record', '0020_permissionrequest_expiration_time_archive'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_expiration_time, migrations.RunPython.noop),
+    ]
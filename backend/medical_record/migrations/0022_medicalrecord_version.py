@@ -0,0 +1,23 @@
+# Generated by Django 4.2.7 on 2026-10-18 03:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('medical_record', '0021_backfill_grant_expiration_time'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='historicalmedicalrecord',
+            name='version',
+            field=models.PositiveIntegerField(default=1),
+        ),
+        migrations.AddField(
+            model_name='medicalrecord',
+            name='version',
+            field=models.PositiveIntegerField(default=1),
+        ),
+    ]
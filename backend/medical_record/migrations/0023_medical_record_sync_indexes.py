@@ -0,0 +1,21 @@
+# Generated by Django 4.2.7 on 2026-10-18 03:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('medical_record', '0022_medicalrecord_version'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='historicalmedicalrecord',
+            index=models.Index(fields=['history_type', 'history_date', 'history_id'], name='historical_record_sync_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='medicalrecord',
+            index=models.Index(fields=['updated_at', 'id'], name='medical_record_updated_idx'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 4.2.7 on 2026-10-18 04:18
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('medical_record', '0024_webhook_outbox'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='archivedpermissionrequest',
+            name='medical_record',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='archived_permission_requests', to='medical_record.medicalrecord'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.7 on 2026-10-18 04:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('medical_record', '0025_archived_grants_outlive_records'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='permissionrequest',
+            index=models.Index(fields=['doctor', 'status', 'response_date', 'medical_record'], name='permission_doctor_granted_idx'),
+        ),
+    ]
@@ -1,7 +1,18 @@
-from django.db import models
+import secrets
+from datetime import timedelta
+from django.conf import settings
+from django.db import models, transaction
+from django.utils import timezone
 from backend.settings import AUTH_USER_MODEL
-from simple_history.models import HistoricalRecords
 from django.db.models import Q
+from .managers import MedicalRecordQuerySet
+from .history import HistoricalDeltaModel, IndexedHistoricalRecords
+
+class StaleVersionError(Exception):
+    """
+    Raised when a medical record changed in the database since it was loaded.
+    """
+
 
 class MedicalRecord(models.Model):
     user = models.ForeignKey(AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='medical_records')
@@ -16,13 +27,73 @@ class MedicalRecord(models.Model):
     referral_info = models.JSONField(default=dict, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    version = models.PositiveIntegerField(default=1)  # Bumped by every update, exposed as the ETag
+
+    objects = MedicalRecordQuerySet.as_manager()
 
-    # Adding Django Simple History
-    history = HistoricalRecords()
+    # Adding Django Simple History, storing most versions as deltas (see history.py)
+    history = IndexedHistoricalRecords(
+        bases=[HistoricalDeltaModel],
+        indexes=[
+            # Point-in-time lookups seek the latest version of a record before a timestamp
+            models.Index(fields=["id", "history_date"], name="historical_record_as_of_idx"),
+            # The sync endpoint reads deletions in (history_date, history_id) order
+            models.Index(fields=["history_type", "history_date", "history_id"], name="historical_record_sync_idx"),
+        ],
+    )
+
+    class Meta:
+        constraints = [
+            # One live record per patient; earlier versions live in the history table
+            models.UniqueConstraint(fields=["user"], name="unique_medical_record_per_user"),
+        ]
+        indexes = [
+            # Keyset pagination of the list endpoint walks (user_id, id)
+            models.Index(fields=["user", "id"], name="medical_record_user_id_idx"),
+            # The sync endpoint reads changed records in (updated_at, id) order
+            models.Index(fields=["updated_at", "id"], name="medical_record_updated_idx"),
+        ]
 
     def __str__(self):
         return f'{self.user.username} - {self.date}'
 
+    @staticmethod
+    def make_etag(record_id, version):
+        return f'"{record_id}-{version}"'
+
+    @property
+    def etag(self):
+        return self.make_etag(self.pk, self.version)
+
+    def save(self, *args, **kwargs):
+        """
+        Updates are optimistic: the UPDATE only matches the row while it still holds the version
+        this instance was loaded with, and bumps it. StaleVersionError is raised otherwise.
+        """
+        if self._state.adding:
+            # Atomic so the outbox event written by post_save commits with the record
+            with transaction.atomic(using=kwargs.get('using')):
+                return super().save(*args, **kwargs)
+
+        if kwargs.get('update_fields') is not None:
+            kwargs['update_fields'] = {*kwargs['update_fields'], 'version'}
+        self.version += 1
+        try:
+            # Own atomic block so a conflict only rolls back this save, even inside a transaction
+            with transaction.atomic(using=kwargs.get('using')):
+                super().save(*args, **kwargs)
+        except StaleVersionError:
+            self.version -= 1
+            raise
+
+    def _do_update(self, base_qs, using, pk_val, values, update_fields, forced_update):
+        updated = super()._do_update(
+            base_qs.filter(version=self.version - 1), using, pk_val, values, update_fields, forced_update
+        )
+        if not updated and base_qs.filter(pk=pk_val).exists():
+            raise StaleVersionError(f"MedicalRecord {pk_val} is no longer at version {self.version - 1}.")
+        return updated
+
 class PermissionRequest(models.Model):
     doctor = models.ForeignKey(AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="requests_made")
     patient = models.ForeignKey(AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="requests_received")
@@ -31,6 +102,7 @@ class PermissionRequest(models.Model):
     request_date = models.DateTimeField(auto_now_add=True)
     response_date = models.DateTimeField(null=True, blank=True)
     edit_permission = models.BooleanField(default=False)
+    expiration_time = models.DateTimeField(null=True, blank=True)  # Approved grants are time-boxed
 
     class Meta:
         constraints = [
@@ -40,3 +112,100 @@ class PermissionRequest(models.Model):
                 name="unique_pending_request_per_doctor_and_record"
             )
         ]
+        indexes = [
+            # Resolves the records a doctor has been granted access to
+            models.Index(fields=["doctor", "status", "medical_record"], name="permission_doctor_status_idx"),
+            # Backs the edit-permission check when the grant cache misses
+            models.Index(fields=["medical_record", "doctor", "status", "edit_permission"], name="permission_edit_grant_idx"),
+            # Lets the expiry sweeper find stale grants without scanning the table
+            models.Index(fields=["status", "expiration_time", "id"], name="permission_expiry_idx"),
+            # The sync endpoint reads a doctor's grants in (response_date, medical_record) order
+            models.Index(fields=["doctor", "status", "response_date", "medical_record"], name="permission_doctor_granted_idx"),
+        ]
+
+    @staticmethod
+    def grant_expiration_time(now=None):
+        return (now or timezone.now()) + timedelta(days=settings.PERMISSION_GRANT_LIFETIME_DAYS)
+
+
+class ArchivedPermissionRequest(models.Model):
+    """
+    Expired grants moved out of PermissionRequest by the expiry sweeper, and the grants
+    still held on a medical record when it is deleted ("deleted"). They outlive the record
+    so that the sync endpoint can tell its former doctors about the deletion.
+    """
+    original_id = models.BigIntegerField(unique=True)
+    doctor = models.ForeignKey(AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="archived_requests_made")
+    patient = models.ForeignKey(AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="archived_requests_received")
+    medical_record = models.ForeignKey(
+        MedicalRecord, on_delete=models.DO_NOTHING, db_constraint=False, related_name="archived_permission_requests",
+    )
+    status = models.CharField(max_length=20, default="expired")
+    request_date = models.DateTimeField()
+    response_date = models.DateTimeField(null=True, blank=True)
+    edit_permission = models.BooleanField(default=False)
+    expiration_time = models.DateTimeField(null=True, blank=True)
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    @classmethod
+    def from_grant(cls, grant, status="expired"):
+        return cls(
+            original_id=grant.id,
+            doctor_id=grant.doctor_id,
+            patient_id=grant.patient_id,
+            medical_record_id=grant.medical_record_id,
+            status=status,
+            request_date=grant.request_date,
+            response_date=grant.response_date,
+            edit_permission=grant.edit_permission,
+            expiration_time=grant.expiration_time,
+        )
+
+
+class OutboxEvent(models.Model):
+    """
+    Change to a medical record or to a permission request on it, written in the same
+    transaction as the change and drained into webhook deliveries by the dispatcher.
+    """
+    # Plain ids rather than foreign keys: events must outlive a deleted record
+    medical_record_id = models.BigIntegerField()
+    patient_id = models.BigIntegerField()
+    event_type = models.CharField(max_length=50)
+    payload = models.JSONField(default=dict, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+
+def generate_webhook_secret():
+    return secrets.token_hex(32)
+
+
+class HospitalWebhook(models.Model):
+    """
+    Endpoint of a partner hospital notified about changes to the records of its patients.
+    """
+    hospital = models.ForeignKey('userauth.Hospital', on_delete=models.CASCADE, related_name="webhooks")
+    url = models.URLField()
+    secret = models.CharField(max_length=128, default=generate_webhook_secret)  # Signs every delivery
+    is_active = models.BooleanField(default=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f'{self.hospital} - {self.url}'
+
+
+class WebhookDelivery(models.Model):
+    webhook = models.ForeignKey(HospitalWebhook, on_delete=models.CASCADE, related_name="deliveries")
+    medical_record_id = models.BigIntegerField()
+    payload = models.JSONField()
+    status = models.CharField(max_length=20, choices=[("pending", "Pending"), ("delivered", "Delivered"), ("failed", "Failed")], default="pending")
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True, default="")
+    created_at = models.DateTimeField(auto_now_add=True)
+    delivered_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # Lets the dispatcher find the deliveries that are due
+            models.Index(fields=["status", "next_attempt_at"], name="webhook_delivery_due_idx"),
+        ]
@@ -0,0 +1,55 @@
+"""
+Real-time notifications pushed to users over the websocket route (see consumers.py).
+
+Every authenticated connection joins the group of its user, and events are sent to that
+group once the transaction that produced them commits. Pushing is best effort: clients
+still read the REST endpoints for the authoritative state.
+"""
+import logging
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.db import transaction
+
+logger = logging.getLogger(__name__)
+
+
+def user_group_name(user_id):
+    return f"user.{user_id}"
+
+
+def _send(messages):
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+    for user_id, event_type, payload in messages:
+        try:
+            async_to_sync(channel_layer.group_send)(
+                user_group_name(user_id),
+                {"type": "user.event", "event": event_type, "payload": payload},
+            )
+        except Exception:
+            logger.exception("Could not push %s to user %s.", event_type, user_id)
+
+
+def notify_users(messages):
+    """
+    Push (user_id, event_type, payload) messages after the current transaction commits.
+    Payloads must be JSON serializable.
+    """
+    messages = list(messages)
+    if messages:
+        transaction.on_commit(lambda: _send(messages))
+
+
+def permission_request_payload(permission_request_id, medical_record_id, doctor_id, patient_id, status,
+                               edit_permission=False, expiration_time=None):
+    return {
+        "id": permission_request_id,
+        "medical_record_id": medical_record_id,
+        "doctor_id": doctor_id,
+        "patient_id": patient_id,
+        "status": status,
+        "edit_permission": edit_permission,
+        "expiration_time": expiration_time.isoformat() if expiration_time else None,
+    }
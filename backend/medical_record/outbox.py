@@ -0,0 +1,136 @@
+"""
+Transactional outbox for change notifications to partner hospitals.
+
+Changes write an OutboxEvent in their own transaction, so an event exists if and only if
+the change committed. `dispatch_outbox_events_task` turns batches of events into one
+WebhookDelivery per (record, hospital webhook), coalescing the events of a record, and
+`deliver_webhooks_task` POSTs them with an HMAC signature, retrying with backoff.
+
+Deliveries only carry ids, event types and the record version: receivers fetch the
+record through the API, so no patient data leaves in a webhook body.
+"""
+import hashlib
+import hmac
+import json
+import random
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from userauth.models import Patient
+
+from .models import HospitalWebhook, OutboxEvent, PermissionRequest
+
+SIGNATURE_HEADER = "X-Webhook-Signature"
+
+
+def make_event(medical_record_id, patient_id, event_type, **payload):
+    return OutboxEvent(
+        medical_record_id=medical_record_id,
+        patient_id=patient_id,
+        event_type=event_type,
+        payload=payload,
+    )
+
+
+def record_event(medical_record_id, patient_id, event_type, **payload):
+    """
+    Write an event; call it inside the transaction making the change.
+    """
+    return make_event(medical_record_id, patient_id, event_type, **payload).save()
+
+
+def record_events(events):
+    OutboxEvent.objects.bulk_create(events)
+
+
+def coalesce(events):
+    """
+    Group events by record into one notification each, oldest event first.
+    """
+    notifications = {}
+    for event in sorted(events, key=lambda event: event.id):
+        notification = notifications.setdefault(event.medical_record_id, {
+            "medical_record_id": event.medical_record_id,
+            "patient_id": event.patient_id,
+            "events": [],
+        })
+        notification["events"].append({
+            "type": event.event_type,
+            "occurred_at": event.created_at.isoformat(),
+            **event.payload,
+        })
+        if "version" in event.payload:
+            notification["version"] = event.payload["version"]
+    return list(notifications.values())
+
+
+def webhooks_by_record(notifications, now=None):
+    """
+    Map each record id to the active webhooks of the hospitals concerned: those of the
+    patient's doctors and those of the doctors holding a live grant on the record.
+    """
+    now = now or timezone.now()
+    record_ids = [notification["medical_record_id"] for notification in notifications]
+    patient_ids = {notification["patient_id"] for notification in notifications}
+
+    hospitals_by_patient = defaultdict(set)
+    for patient_id, hospital_id in Patient.doctors.through.objects.filter(
+        patient__user_id__in=patient_ids, doctor__hospital__isnull=False,
+    ).values_list("patient__user_id", "doctor__hospital_id"):
+        hospitals_by_patient[patient_id].add(hospital_id)
+
+    hospitals_by_record = defaultdict(set)
+    for record_id, hospital_id in PermissionRequest.objects.filter(
+        medical_record_id__in=record_ids,
+        status="approved",
+        expiration_time__gt=now,
+        doctor__doctor_profile__hospital__isnull=False,
+    ).values_list("medical_record_id", "doctor__doctor_profile__hospital_id"):
+        hospitals_by_record[record_id].add(hospital_id)
+
+    for notification in notifications:
+        hospitals_by_record[notification["medical_record_id"]] |= hospitals_by_patient[notification["patient_id"]]
+
+    webhooks_by_hospital = defaultdict(list)
+    all_hospitals = set().union(*hospitals_by_record.values()) if hospitals_by_record else set()
+    for webhook in HospitalWebhook.objects.filter(hospital_id__in=all_hospitals, is_active=True):
+        webhooks_by_hospital[webhook.hospital_id].append(webhook)
+
+    return {
+        record_id: [webhook for hospital_id in hospital_ids for webhook in webhooks_by_hospital[hospital_id]]
+        for record_id, hospital_ids in hospitals_by_record.items()
+    }
+
+
+def sign(secret, timestamp, body):
+    """
+    Hex HMAC-SHA256 of "<timestamp>.<body>"; receivers recompute it and reject stale timestamps.
+    """
+    message = f"{timestamp}.".encode("utf-8") + body
+    return hmac.new(secret.encode("utf-8"), message, hashlib.sha256).hexdigest()
+
+
+def signed_request(delivery, now=None):
+    """
+    Return (body, headers) for a delivery.
+    """
+    timestamp = int((now or timezone.now()).timestamp())
+    body = json.dumps(delivery.payload, separators=(",", ":"), sort_keys=True).encode("utf-8")
+    headers = {
+        "Content-Type": "application/json",
+        "X-Webhook-Delivery": str(delivery.id),
+        SIGNATURE_HEADER: f"t={timestamp},v1={sign(delivery.webhook.secret, timestamp, body)}",
+    }
+    return body, headers
+
+
+def retry_delay(attempts):
+    """
+    Exponential backoff with jitter after the given number of failed attempts.
+    """
+    base = settings.WEBHOOK_RETRY_BASE_SECONDS * 2 ** (attempts - 1)
+    delay = min(base, settings.WEBHOOK_RETRY_MAX_SECONDS)
+    return timedelta(seconds=delay * random.uniform(0.5, 1.0))
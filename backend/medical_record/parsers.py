@@ -0,0 +1,8 @@
+from rest_framework.parsers import JSONParser
+
+
+class JSONPatchParser(JSONParser):
+    """
+    Parses RFC 6902 JSON Patch documents (`application/json-patch+json`).
+    """
+    media_type = 'application/json-patch+json'
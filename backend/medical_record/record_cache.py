@@ -0,0 +1,83 @@
+"""
+Cache-aside storage of rendered medical records.
+
+A pointer key holds the current version of each record and the rendered
+`MedicalRecordSerializer` payload is stored under (record id, version). Saves move the
+pointer once their transaction commits, and readers only ever `add` the pointer, so a
+slow reader can never put back a version older than the one a writer published.
+A `MEDICAL_RECORD_CACHE_TIMEOUT` of 0 turns this off, which is the default unless the
+cache is shared by every process that saves records.
+
+Historical versions are immutable, so their payloads are cached without a timeout, in a
+bounded per-process LRU in front of the shared cache.
+"""
+from django.conf import settings
+from django.core.cache import cache
+
+from backend.lru import LRUCache
+
+
+_version_payloads = LRUCache(getattr(settings, 'MEDICAL_RECORD_VERSION_LRU_SIZE', 1024))
+
+
+def record_timeout():
+    return getattr(settings, 'MEDICAL_RECORD_CACHE_TIMEOUT', 0)
+
+
+def version_key(record_id):
+    return f"medical_record:{record_id}:version"
+
+
+def payload_key(record_id, version):
+    return f"medical_record:{record_id}:payload:{version}"
+
+
+async def aget_cached_record(record_id):
+    """
+    Return (version, payload) for a record, either of which may be None on a miss.
+    """
+    if not record_timeout():
+        return None, None
+    version = await cache.aget(version_key(record_id))
+    if version is None:
+        return None, None
+    return version, await cache.aget(payload_key(record_id, version))
+
+
+async def acache_record(record_id, version, payload):
+    if not record_timeout():
+        return
+    await cache.aset(payload_key(record_id, version), payload, timeout=record_timeout())
+    await cache.aadd(version_key(record_id), version, timeout=record_timeout())
+
+
+def publish_version(record_id, version):
+    if not record_timeout():
+        return
+    cache.set(version_key(record_id), version, timeout=record_timeout())
+
+
+def forget_record(record_id):
+    if not record_timeout():
+        return
+    cache.delete(version_key(record_id))
+
+
+def history_payload_key(record_id, history_id):
+    return f"medical_record:{record_id}:history:{history_id}"
+
+
+async def aget_cached_history_version(record_id, history_id):
+    key = history_payload_key(record_id, history_id)
+    payload = _version_payloads.get(key)
+    if payload is None:
+        payload = await cache.aget(key)
+        if payload is not None:
+            _version_payloads.set(key, payload)
+    return payload
+
+
+async def acache_history_version(record_id, history_id, payload):
+    key = history_payload_key(record_id, history_id)
+    _version_payloads.set(key, payload)
+    await cache.aset(key, payload, timeout=None)
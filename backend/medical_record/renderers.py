@@ -0,0 +1,28 @@
+import json
+
+from rest_framework.renderers import BaseRenderer
+from rest_framework.utils import encoders
+
+
+class NDJSONRenderer(BaseRenderer):
+    """
+    Renders newline-delimited JSON, one document per line.
+    Streaming views write lines themselves; this renderer covers the non-streamed
+    responses (errors, empty results) so `Accept: application/x-ndjson` negotiates.
+    """
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return self.render_line(data)
+
+    @staticmethod
+    def encode(data):
+        return json.dumps(data, cls=encoders.JSONEncoder, ensure_ascii=False).encode('utf-8')
+
+    @classmethod
+    def render_line(cls, data):
+        return cls.encode(data) + b'\n'
@@ -0,0 +1,7 @@
+from django.urls import path
+
+from .consumers import UserEventsConsumer
+
+websocket_urlpatterns = [
+    path('ws/events/', UserEventsConsumer.as_asgi(), name='user-events'),  # Push of the connected user's events
+]
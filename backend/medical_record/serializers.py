@@ -1,4 +1,7 @@
+from collections import Counter
+
 from rest_framework import serializers
+from .history import JSON_FIELDS
 from .models import MedicalRecord, PermissionRequest
 from userauth.models import User, Patient
 
@@ -9,7 +12,18 @@ class MedicalRecordSerializer(serializers.ModelSerializer):
     class Meta:
         model = MedicalRecord
         fields = '__all__'
-        read_only_fields = ["created_at", "updated_at", "User"]
+        read_only_fields = ["created_at", "updated_at", "User", "version"]
+
+    def validate(self, attrs):
+        # The JSON fields hold documents, which JSON Patch paths address, never bare values
+        errors = {
+            field: "Must be a JSON object or array."
+            for field in JSON_FIELDS
+            if field in attrs and not isinstance(attrs[field], (dict, list))
+        }
+        if errors:
+            raise serializers.ValidationError(errors)
+        return attrs
 
     
 class MedicalRecordHistorySerializer(serializers.ModelSerializer):
@@ -23,7 +37,19 @@ class MedicalRecordHistorySerializer(serializers.ModelSerializer):
 
     class Meta:
         model = MedicalRecord.history.model  # Access the historical model created by Simple History
-        fields = '__all__'
+        exclude = ['is_snapshot', 'delta', 'history_changed_fields']  # Storage details, versions are materialized before serializing
+
+
+class MedicalRecordHistorySummarySerializer(serializers.ModelSerializer):
+    """
+    Lightweight listing of a historical version without any of the JSON fields.
+    """
+    history_user = serializers.StringRelatedField()
+    changed_fields = serializers.ListField(source='history_changed_fields', child=serializers.CharField())
+
+    class Meta:
+        model = MedicalRecord.history.model
+        fields = ['history_id', 'history_date', 'history_user', 'history_type', 'changed_fields']
         read_only_fields = fields
         
         
@@ -53,3 +79,35 @@ class PermissionResponseSerializer(serializers.ModelSerializer):
         model = PermissionRequest
         fields = ["status"]
 
+
+
+class PermissionDecisionSerializer(serializers.Serializer):
+    """
+    One entry of a bulk response to permission requests.
+    """
+    permission_request_id = serializers.IntegerField()
+    status = serializers.ChoiceField(choices=["approved", "denied"])
+
+
+class BulkPermissionDecisionSerializer(serializers.Serializer):
+    """
+    A bulk response to permission requests. Entries are validated one by one so that a
+    malformed entry is reported next to the others rather than failing the batch;
+    `validated_data["decisions"]` holds a PermissionDecisionSerializer per entry, in order.
+    The same request may only be decided once per batch.
+    """
+    decisions = serializers.ListField(child=serializers.JSONField(), allow_empty=False)
+
+    def validate_decisions(self, decisions):
+        max_batch_size = self.context["max_batch_size"]
+        if len(decisions) > max_batch_size:
+            raise serializers.ValidationError(f"At most {max_batch_size} decisions can be sent at once.")
+
+        entries = [PermissionDecisionSerializer(data=decision) for decision in decisions]
+        counts = Counter(entry.validated_data["permission_request_id"] for entry in entries if entry.is_valid())
+        duplicates = sorted(permission_request_id for permission_request_id, count in counts.items() if count > 1)
+        if duplicates:
+            raise serializers.ValidationError(
+                f"Each permission request can only be decided once; repeated: {', '.join(map(str, duplicates))}."
+            )
+        return entries
@@ -0,0 +1,58 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+from simple_history.signals import pre_create_historical_record
+
+from .history import compress_version, latest_chain
+from .models import ArchivedPermissionRequest, MedicalRecord, PermissionRequest
+from .outbox import record_event
+from .record_cache import forget_record, publish_version
+
+
+@receiver(pre_create_historical_record, sender=MedicalRecord.history.model)
+def compress_medical_record_history(sender, instance, history_instance, **kwargs):
+    """
+    Store the new historical row as a delta against the previous version when possible.
+    """
+    compress_version(history_instance, latest_chain(sender, instance.pk))
+
+
+@receiver(post_save, sender=MedicalRecord)
+def record_medical_record_saved(sender, instance, created, **kwargs):
+    """
+    MedicalRecord.save() is atomic, so the outbox event commits together with the record.
+    """
+    event_type = "medical_record.created" if created else "medical_record.updated"
+    record_event(instance.pk, instance.user_id, event_type, version=instance.version)
+
+
+@receiver(pre_delete, sender=MedicalRecord)
+def archive_medical_record_grants(sender, instance, **kwargs):
+    """
+    Keep the approved grants of a record being deleted, which would be deleted with it, so
+    that its deletion is only synced to the doctors who could read it.
+    """
+    ArchivedPermissionRequest.objects.bulk_create([
+        ArchivedPermissionRequest.from_grant(grant, status="deleted")
+        for grant in PermissionRequest.objects.filter(medical_record_id=instance.pk, status="approved")
+    ], ignore_conflicts=True)
+
+
+@receiver(post_delete, sender=MedicalRecord)
+def record_medical_record_deleted(sender, instance, **kwargs):
+    record_event(instance.pk, instance.user_id, "medical_record.deleted", version=instance.version)
+
+
+@receiver(post_save, sender=MedicalRecord)
+def publish_medical_record_version(sender, instance, **kwargs):
+    """
+    Point the record cache at the saved version once it is visible to other connections.
+    """
+    record_id, version = instance.pk, instance.version
+    transaction.on_commit(lambda: publish_version(record_id, version))
+
+
+@receiver(post_delete, sender=MedicalRecord)
+def forget_medical_record(sender, instance, **kwargs):
+    record_id = instance.pk
+    transaction.on_commit(lambda: forget_record(record_id))
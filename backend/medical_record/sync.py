@@ -0,0 +1,173 @@
+"""
+Incremental sync of medical records for offline clients.
+
+A sync cursor holds two keyset positions: (synced_at, id) over the records visible to the
+caller and (history_date, history_id) over the deletion rows of the history table. Only
+changes older than the settle window are handed out, so a transaction that commits late
+with an earlier timestamp is still picked up by the next sync instead of being skipped.
+"""
+import base64
+import binascii
+import json
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import F, Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from userauth.roles import is_doctor, is_patient
+
+from .models import ArchivedPermissionRequest, MedicalRecord, PermissionRequest
+
+
+class InvalidSyncCursor(ValueError):
+    pass
+
+
+def settle_window():
+    return timedelta(seconds=getattr(settings, 'MEDICAL_RECORD_SYNC_SETTLE_SECONDS', 5))
+
+
+def encode_cursor(changes_position, deletions_position):
+    cursor = {
+        'changes': [changes_position[0].isoformat(), changes_position[1]],
+        'deletions': [deletions_position[0].isoformat(), deletions_position[1]],
+    }
+    return base64.urlsafe_b64encode(json.dumps(cursor).encode('utf-8')).decode('ascii')
+
+
+def _decode_position(position):
+    if not isinstance(position, list) or len(position) != 2 or not isinstance(position[1], int):
+        raise InvalidSyncCursor("Invalid cursor.")
+    timestamp = parse_datetime(position[0]) if isinstance(position[0], str) else None
+    if timestamp is None:
+        raise InvalidSyncCursor("Invalid cursor.")
+    return timestamp, position[1]
+
+
+def decode_cursor(encoded):
+    try:
+        cursor = json.loads(base64.urlsafe_b64decode(encoded.encode('ascii')))
+    except (binascii.Error, UnicodeError, ValueError):
+        raise InvalidSyncCursor("Invalid cursor.")
+    if not isinstance(cursor, dict):
+        raise InvalidSyncCursor("Invalid cursor.")
+    return _decode_position(cursor.get('changes')), _decode_position(cursor.get('deletions'))
+
+
+def _after(position, time_field, id_field):
+    if position is None:
+        return Q()
+    timestamp, last_id = position
+    return Q(**{f'{time_field}__gt': timestamp}) | Q(**{time_field: timestamp, f'{id_field}__gt': last_id})
+
+
+def _advance(position, rows, limit, horizon):
+    """
+    Move a position past the rows just sent, and up to the horizon once the stream is drained.
+    """
+    if rows:
+        position = rows[-1]
+    if len(rows) < limit:
+        position = max(position or (horizon, 0), (horizon, 0))
+    return position
+
+
+def changed_records(user, now, position, horizon, limit):
+    """
+    Up to `limit + 1` (synced_at, id, record) entries for the records visible to `user` that
+    changed after `position` and at or before `horizon`, in (synced_at, id) order.
+    `synced_at` is when a record last changed for this user. For doctors that includes the
+    approval of their grant, so a record they were just given access to is sent even if its
+    content is old. Record updates and grant approvals are each read with a range query on
+    their own index, each keeping only the changes the other does not supersede, and merged here.
+    """
+    records = MedicalRecord.objects.visible_to(user).filter(
+        _after(position, 'updated_at', 'id'), updated_at__lte=horizon,
+    )
+    if not is_doctor(user) or user.is_staff:
+        return [
+            (record.updated_at, record.id, record)
+            for record in records.order_by('updated_at', 'id')[:limit + 1]
+        ]
+
+    grants = PermissionRequest.objects.filter(doctor_id=user.pk, status="approved", expiration_time__gt=now)
+    updates = records.exclude(
+        id__in=grants.filter(response_date__gt=F('medical_record__updated_at')).values('medical_record_id')
+    )
+    changes = [
+        (record.updated_at, record.id, record)
+        for record in updates.order_by('updated_at', 'id')[:limit + 1]
+    ]
+    granted = list(
+        grants.filter(
+            _after(position, 'response_date', 'medical_record_id'),
+            response_date__lte=horizon,
+            response_date__gt=F('medical_record__updated_at'),
+        )
+        .order_by('response_date', 'medical_record_id')
+        .values_list('response_date', 'medical_record_id')[:limit + 1]
+    )
+    granted_records = MedicalRecord.objects.in_bulk([record_id for _, record_id in granted])
+    changes += [
+        (granted_at, record_id, granted_records[record_id])
+        for granted_at, record_id in granted
+        if record_id in granted_records
+    ]
+    changes.sort(key=lambda change: change[:2])
+    return changes[:limit + 1]
+
+
+def deleted_records(user):
+    """
+    Deletion rows of the history table the user should hear about. Patients learn about
+    their own record and doctors about the records they held a grant for, which are
+    archived when they expire or when the record is deleted.
+    """
+    deletions = MedicalRecord.history.filter(history_type='-')
+    if user.is_staff:
+        return deletions
+    if is_doctor(user):
+        return deletions.filter(
+            id__in=ArchivedPermissionRequest.objects.filter(doctor_id=user.pk).values('medical_record_id')
+        )
+    if is_patient(user):
+        return deletions.filter(user_id=user.pk)
+    return deletions.none()
+
+
+def changes_since(user, cursor, limit):
+    """
+    Return (records, deleted_ids, next_cursor, has_more) for the changes after `cursor`,
+    at most `limit` records and `limit` deletions at a time. Without a cursor every visible
+    record is sent and deletions start from now.
+    """
+    now = timezone.now()
+    horizon = now - settle_window()
+    if cursor is None:
+        changes_position, deletions_position = None, (horizon, 0)
+    else:
+        changes_position, deletions_position = cursor
+
+    changes = changed_records(user, now, changes_position, horizon, limit)
+    deletions = list(
+        deleted_records(user)
+        .filter(_after(deletions_position, 'history_date', 'history_id'), history_date__lte=horizon)
+        .order_by('history_date', 'history_id')
+        .values_list('history_date', 'history_id', 'id')[:limit + 1]
+    )
+
+    has_more = len(changes) > limit or len(deletions) > limit
+    changes, deletions = changes[:limit], deletions[:limit]
+
+    changes_position = _advance(
+        changes_position, [(synced_at, record_id) for synced_at, record_id, _ in changes], limit, horizon
+    )
+    deletions_position = _advance(
+        deletions_position, [(history_date, history_id) for history_date, history_id, _ in deletions], limit, horizon
+    )
+    # A record approved more than once since the cursor is sent once
+    records = list({record.id: record for _, _, record in changes}.values())
+    deleted_ids = list(dict.fromkeys(record_id for _, _, record_id in deletions))
+    return records, deleted_ids, encode_cursor(changes_position, deletions_position), has_more
@@ -0,0 +1,144 @@
+import logging
+from datetime import timedelta
+
+import requests
+from celery import shared_task
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .grants import invalidate_grants
+from .models import ArchivedPermissionRequest, OutboxEvent, PermissionRequest, WebhookDelivery
+from .outbox import coalesce, make_event, record_events, retry_delay, signed_request, webhooks_by_record
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task(serializer='json', name="expire_permission_grants_task")
+def expire_permission_grants(batch_size=None):
+    """
+    Move approved permission requests past their expiration time into ArchivedPermissionRequest.
+    Works through the stale grants in keyset order, one short transaction per batch, so the
+    permission table is never locked by a single large UPDATE. Returns the number of rows processed.
+    """
+    batch_size = batch_size or settings.PERMISSION_GRANT_SWEEP_BATCH_SIZE
+    now = timezone.now()
+    last_id = 0
+    processed = 0
+
+    while True:
+        with transaction.atomic():
+            batch = list(
+                PermissionRequest.objects.select_for_update(skip_locked=True)
+                .filter(status="approved", expiration_time__lte=now, id__gt=last_id)
+                .order_by("id")[:batch_size]
+            )
+            if not batch:
+                break
+
+            ArchivedPermissionRequest.objects.bulk_create([
+                ArchivedPermissionRequest.from_grant(grant) for grant in batch
+            ], ignore_conflicts=True)
+            PermissionRequest.objects.filter(id__in=[grant.id for grant in batch]).delete()
+            record_events([
+                make_event(grant.medical_record_id, grant.patient_id, "permission_request.expired",
+                           permission_request_id=grant.id, doctor_id=grant.doctor_id)
+                for grant in batch
+            ])
+            invalidate_grants((grant.doctor_id, grant.medical_record_id) for grant in batch)
+
+        last_id = batch[-1].id
+        processed += len(batch)
+
+    logger.info("Expired and archived %d permission grant(s).", processed)
+    return processed
+
+
+@shared_task(serializer='json', name="dispatch_outbox_events_task")
+def dispatch_outbox_events(batch_size=None):
+    """
+    Drain the outbox in batches: the events of a batch are coalesced per record and queued as
+    one WebhookDelivery per interested hospital webhook, then deleted, in one transaction.
+    Returns the number of events processed.
+    """
+    batch_size = batch_size or settings.WEBHOOK_BATCH_SIZE
+    processed = 0
+
+    while True:
+        with transaction.atomic():
+            events = list(OutboxEvent.objects.select_for_update(skip_locked=True).order_by("id")[:batch_size])
+            if not events:
+                break
+
+            notifications = coalesce(events)
+            webhooks = webhooks_by_record(notifications)
+            WebhookDelivery.objects.bulk_create([
+                WebhookDelivery(webhook=webhook, medical_record_id=notification["medical_record_id"], payload=notification)
+                for notification in notifications
+                for webhook in webhooks.get(notification["medical_record_id"], [])
+            ])
+            OutboxEvent.objects.filter(id__in=[event.id for event in events]).delete()
+
+        processed += len(events)
+
+    if processed:
+        deliver_webhooks.delay()
+    logger.info("Dispatched %d outbox event(s).", processed)
+    return processed
+
+
+@shared_task(serializer='json', name="deliver_webhooks_task")
+def deliver_webhooks(batch_size=None):
+    """
+    POST the due webhook deliveries, retrying failures with exponential backoff until
+    WEBHOOK_MAX_ATTEMPTS is reached. Each batch is leased by pushing its next attempt back,
+    so concurrent workers never send the same delivery twice. Returns the number delivered.
+    """
+    batch_size = batch_size or settings.WEBHOOK_BATCH_SIZE
+    timeout = settings.WEBHOOK_TIMEOUT_SECONDS
+    delivered = 0
+
+    # One session so deliveries to the same hospital reuse their connection
+    with requests.Session() as session:
+        while True:
+            now = timezone.now()
+            with transaction.atomic():
+                batch = list(
+                    WebhookDelivery.objects.select_for_update(skip_locked=True)
+                    .select_related("webhook")
+                    .filter(status="pending", next_attempt_at__lte=now)
+                    .order_by("next_attempt_at", "id")[:batch_size]
+                )
+                if not batch:
+                    break
+                WebhookDelivery.objects.filter(id__in=[delivery.id for delivery in batch]).update(
+                    next_attempt_at=now + timedelta(seconds=timeout * len(batch))
+                )
+
+            for delivery in batch:
+                body, headers = signed_request(delivery)
+                try:
+                    response = session.post(
+                        delivery.webhook.url, data=body, headers=headers, timeout=timeout, allow_redirects=False,
+                    )
+                    error = "" if 200 <= response.status_code < 300 else f"HTTP {response.status_code}"
+                except requests.RequestException as e:
+                    error = str(e) or e.__class__.__name__
+
+                delivery.attempts += 1
+                delivery.last_error = error[:1000]
+                if not error:
+                    delivery.status = "delivered"
+                    delivery.delivered_at = timezone.now()
+                    delivered += 1
+                elif delivery.attempts >= settings.WEBHOOK_MAX_ATTEMPTS:
+                    delivery.status = "failed"
+                else:
+                    delivery.next_attempt_at = timezone.now() + retry_delay(delivery.attempts)
+
+            WebhookDelivery.objects.bulk_update(
+                batch, ["status", "attempts", "last_error", "delivered_at", "next_attempt_at"]
+            )
+
+    logger.info("Delivered %d webhook(s).", delivered)
+    return delivered
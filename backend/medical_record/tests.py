@@ -1,3 +1,1192 @@
-from django.test import TestCase
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from io import StringIO
+from unittest import mock
+from urllib.parse import urlencode
+from datetime import timedelta
 
-# Create your tests here.
+from django.core.cache import cache
+from django.db import connection
+from asgiref.sync import async_to_sync, sync_to_async
+from channels.testing import WebsocketCommunicator
+from django.test.utils import CaptureQueriesContext
+from django.db.migrations.executor import MigrationExecutor
+from django.core.management import call_command
+from django.test import AsyncClient, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from backend.lru import LRUCache
+from userauth import authentication
+from userauth.models import Doctor, Hospital, Patient, User
+
+from . import grants, record_cache
+from .history import UnmaterializedVersionError, json_document, materialize_versions
+from .json_patch import JSONPatchError, apply_patch, make_patch
+from .models import (
+    ArchivedPermissionRequest,
+    HospitalWebhook,
+    MedicalRecord,
+    OutboxEvent,
+    PermissionRequest,
+    StaleVersionError,
+    WebhookDelivery,
+)
+from .outbox import SIGNATURE_HEADER, sign
+from .tasks import deliver_webhooks, dispatch_outbox_events, expire_permission_grants
+
+LIST_URL = '/api/medical-record/medical-records/'
+
+
+def create_doctor(email, **fields):
+    user = User.objects.create_user(email=email, username=email, is_doctor=True, first_name="Gregory", last_name="House", **fields)
+    hospital, _ = Hospital.objects.get_or_create(name="Hospital", address="Address")
+    Doctor.objects.create(user=user, hospital=hospital)
+    return user
+
+
+def create_patient(email, **fields):
+    user = User.objects.create_user(email=email, username=email, is_patient=True, **fields)
+    Patient.objects.create(user=user)
+    return user
+
+
+def create_record(patient, **fields):
+    return MedicalRecord.objects.create(
+        user=patient, doctor_name="Doctor", hospital_name="Hospital", hospital_address="Address", **fields
+    )
+
+
+def grant(doctor, record, status="approved", edit_permission=True, **fields):
+    if status == "approved":
+        fields.setdefault("expiration_time", timezone.now() + timedelta(days=1))
+        fields.setdefault("response_date", timezone.now())
+    return PermissionRequest.objects.create(
+        doctor=doctor, patient=record.user, medical_record=record, status=status, edit_permission=edit_permission, **fields
+    )
+
+
+def record_url(record, suffix=''):
+    return f'{LIST_URL}{record.pk}/{suffix}'
+
+
+class MedicalRecordTestCase(TestCase):
+    """
+    Clears the caches the views read through, which outlive a test's transaction.
+    """
+
+    def setUp(self):
+        cache.clear()
+        record_cache._version_payloads.clear()
+        authentication._local.clear()
+
+    def client_for(self, user):
+        """
+        A client authenticated with a DRF token, which both the REST framework and the async
+        views accept.
+        """
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f"Token {Token.objects.get_or_create(user=user)[0].key}")
+        return client
+
+
+class MedicalRecordListTests(MedicalRecordTestCase):
+    def setUp(self):
+        super().setUp()
+        self.doctor = create_doctor("doctor@example.com")
+        self.patients = [create_patient(f"patient{i}@example.com") for i in range(5)]
+        self.records = [create_record(patient) for patient in self.patients]
+        grant(self.doctor, self.records[1])
+        grant(self.doctor, self.records[2])
+        grant(self.doctor, self.records[3], status="pending")
+        grant(self.doctor, self.records[4], expiration_time=timezone.now() - timedelta(minutes=1))
+
+    def test_doctor_pages_through_granted_records(self):
+        client = self.client_for(self.doctor)
+        response = client.get(LIST_URL, {'page_size': 1})
+        self.assertEqual(list(response.data['results']), ["patient1@example.com"])
+
+        response = client.get(response.data['next'])
+        self.assertEqual(list(response.data['results']), ["patient2@example.com"])
+        self.assertIsNone(response.data['next'])
+
+    def test_patient_sees_own_record(self):
+        response = self.client_for(self.patients[0]).get(LIST_URL)
+        self.assertEqual(list(response.data['results']), ["patient0@example.com"])
+
+    def test_staff_sees_every_record(self):
+        staff = User.objects.create_user(email="staff@example.com", username="staff", is_staff=True)
+        response = self.client_for(staff).get(LIST_URL, {'page_size': 500})
+        self.assertEqual(len(response.data['results']), 5)
+
+    def test_invalid_cursor(self):
+        self.assertEqual(self.client_for(self.doctor).get(LIST_URL, {'cursor': 'garbage'}).status_code, 404)
+
+
+class MedicalRecordStreamTests(MedicalRecordTestCase):
+    def setUp(self):
+        super().setUp()
+        self.staff = User.objects.create_user(email="staff@example.com", username="staff", is_staff=True)
+        for i in range(3):
+            create_record(create_patient(f"patient{i}@example.com"), vitals={"note": "é"})
+
+    def test_stream_json(self):
+        response = self.client_for(self.staff).get(LIST_URL, {'stream': 1})
+        body = json.loads(b''.join(response.streaming_content))
+        self.assertEqual(sorted(body), ["patient0@example.com", "patient1@example.com", "patient2@example.com"])
+        self.assertEqual(body["patient0@example.com"][0]["vitals"], {"note": "é"})
+
+    def test_stream_ndjson(self):
+        response = self.client_for(self.staff).get(LIST_URL, HTTP_ACCEPT='application/x-ndjson')
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual([line['email'] for line in lines], ["patient0@example.com", "patient1@example.com", "patient2@example.com"])
+
+
+class MedicalRecordUpdateTests(MedicalRecordTestCase):
+    def setUp(self):
+        super().setUp()
+        self.doctor = create_doctor("doctor@example.com")
+        self.patient = create_patient("patient@example.com")
+        self.record = create_record(self.patient, vitals={"pulse": 60})
+        grant(self.doctor, self.record)
+
+    def test_update_in_place(self):
+        response = self.client_for(self.doctor).put(record_url(self.record), {"vitals": {"pulse": 72}}, format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(response.data["changed_fields"], ["vitals"])
+
+        self.assertEqual(MedicalRecord.objects.count(), 1)
+        self.record.refresh_from_db()
+        self.assertEqual(self.record.vitals, {"pulse": 72})
+        self.assertEqual(self.record.doctor_name, "Gregory House")
+        self.assertEqual(self.record.history.count(), 2)
+        self.assertEqual(self.record.history.latest().history_user, self.doctor)
+
+    def test_unchanged_values_are_not_saved(self):
+        response = self.client_for(self.doctor).put(record_url(self.record), {"vitals": {"pulse": 60}}, format='json')
+        self.assertEqual(response.data["message"], "No changes were made to the medical record.")
+        self.assertEqual(self.record.history.count(), 1)
+
+    def test_doctor_without_grant(self):
+        other = create_doctor("other@example.com")
+        response = self.client_for(other).put(record_url(self.record), {"vitals": {"pulse": 72}}, format='json')
+        self.assertEqual(response.status_code, 403)
+
+
+class MergeDuplicateRecordsMigrationTests(TransactionTestCase):
+    migrate_from = [('medical_record', '0013_medicalrecord_user_id_idx')]
+    migrate_to = [('medical_record', '0015_medicalrecord_unique_per_user')]
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+    def test_duplicates_are_folded_into_the_oldest_record(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.migrate_from)
+        # The state of the apps the migration touches, userauth included
+        apps = executor.loader.project_state(
+            self.migrate_from + [('userauth', '0003_hospital_user_is_patient_doctor_patient')]
+        ).apps
+        User = apps.get_model('userauth', 'User')
+        Record = apps.get_model('medical_record', 'MedicalRecord')
+        HistoricalRecord = apps.get_model('medical_record', 'HistoricalMedicalRecord')
+        Request = apps.get_model('medical_record', 'PermissionRequest')
+
+        now = timezone.now()
+        patient = User.objects.create(email="patient@example.com", username="patient", is_patient=True, date_joined=now)
+        doctor = User.objects.create(email="doctor@example.com", username="doctor", is_doctor=True, date_joined=now)
+        records = []
+        for i in range(3):
+            record = Record.objects.create(
+                user=patient, date=now, doctor_name=f"Doctor {i}", hospital_name="Hospital",
+                hospital_address="Address", vitals={"visit": i},
+            )
+            HistoricalRecord.objects.create(
+                id=record.id, user=patient, date=now, doctor_name=record.doctor_name, hospital_name="Hospital",
+                hospital_address="Address", created_at=record.created_at, updated_at=record.updated_at,
+                history_date=now, history_type='+',
+            )
+            records.append(record)
+        Request.objects.create(doctor=doctor, patient=patient, medical_record=records[0], status="pending")
+        Request.objects.create(doctor=doctor, patient=patient, medical_record=records[2], status="pending")
+        Request.objects.create(doctor=doctor, patient=patient, medical_record=records[1], status="approved")
+
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(self.migrate_to)
+
+        self.assertEqual(
+            list(MedicalRecord.objects.values_list('id', 'doctor_name', 'vitals')),
+            [(records[0].id, "Doctor 2", {"visit": 2})],
+        )
+        self.assertEqual(MedicalRecord.history.filter(id=records[0].id).count(), 3)
+        self.assertEqual(MedicalRecord.history.filter(history_type='+').count(), 1)
+        self.assertEqual(PermissionRequest.objects.filter(medical_record_id=records[0].id).count(), 2)
+
+
+@override_settings(MEDICAL_RECORD_HISTORY_SNAPSHOT_INTERVAL=3)
+class HistoryMaterializationTests(MedicalRecordTestCase):
+    def edit(self, record, times):
+        documents = [json_document(record)]
+        for pulse in range(61, 61 + times):
+            record.vitals = {"pulse": pulse, "history": list(range(60, pulse))}
+            record.treatment_plan = {"dose": pulse % 2}
+            record.save()
+            documents.append(json_document(MedicalRecord.objects.get(pk=record.pk)))
+        return documents
+
+    def test_versions_match_the_record_across_snapshots(self):
+        record = create_record(create_patient("patient@example.com"), vitals={"pulse": 60})
+        documents = self.edit(record, 7)
+
+        versions = list(MedicalRecord.history.filter(id=record.pk).order_by("history_id"))
+        self.assertEqual([version.is_snapshot for version in versions], [True, False, False] * 2 + [True, False])
+
+        # Materialize newest first and a few at a time, as paginated reads do
+        newest_first = versions[::-1]
+        materialized = []
+        for start in range(0, len(newest_first), 3):
+            materialized.extend(materialize_versions(newest_first[start:start + 3]))
+        self.assertEqual([json_document(version) for version in materialized[::-1]], documents)
+        self.assertEqual(json_document(materialized[0]), json_document(MedicalRecord.objects.get(pk=record.pk)))
+
+    def test_delta_rows_are_unreadable_until_materialized(self):
+        record = create_record(create_patient("patient@example.com"), vitals={"pulse": 60})
+        self.edit(record, 1)
+        delta = MedicalRecord.history.filter(id=record.pk).latest()
+
+        self.assertFalse(delta.is_snapshot)
+        self.assertEqual(delta.vitals, {})
+        self.assertTrue(str(delta).endswith("(delta)"))
+        with self.assertRaises(UnmaterializedVersionError):
+            delta.instance
+        with self.assertRaises(UnmaterializedVersionError):
+            delta.history_object
+
+        materialize_versions([delta])
+        self.assertEqual(delta.instance.vitals, {"pulse": 61, "history": [60]})
+
+    def test_command_compresses_existing_history(self):
+        record = create_record(create_patient("patient@example.com"), vitals={"pulse": 60})
+        documents = self.edit(record, 4)
+        # History written before delta storage existed is stored in full
+        MedicalRecord.history.filter(id=record.pk).update(is_snapshot=True, delta=None)
+        for version, document in zip(MedicalRecord.history.filter(id=record.pk).order_by("history_id"), documents):
+            MedicalRecord.history.filter(history_id=version.history_id).update(**document)
+
+        call_command("compress_medical_record_history", stdout=StringIO())
+
+        versions = materialize_versions(MedicalRecord.history.filter(id=record.pk).order_by("history_id"))
+        self.assertEqual([version.is_snapshot for version in versions], [True, False, False, True, False])
+        self.assertEqual([json_document(version) for version in versions], documents)
+
+
+class MedicalRecordVersionsTests(MedicalRecordTestCase):
+    def setUp(self):
+        super().setUp()
+        self.doctor = create_doctor("doctor@example.com")
+        self.record = create_record(create_patient("patient@example.com"))
+        grant(self.doctor, self.record)
+        self.client = self.client_for(self.doctor)
+        for visit in range(4):
+            self.client.put(record_url(self.record), {"vitals": {"visit": visit}}, format='json')
+
+    def test_summary_pages_skip_the_json_fields(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(record_url(self.record, 'versions/'), {'page_size': 3})
+        self.assertEqual(response.status_code, 200)
+        history_sql = [query['sql'] for query in queries.captured_queries if 'historical' in query['sql']]
+        self.assertNotIn('vitals', history_sql[0])
+
+        first = response.json()['results'][0]
+        self.assertEqual(set(first), {'history_id', 'history_date', 'history_user', 'history_type', 'changed_fields'})
+        self.assertEqual(first['changed_fields'], ['vitals'])
+        self.assertEqual(first['history_user'], "Gregory House")
+        self.assertEqual(len(response.json()['results']), 3)
+
+        response = self.client.get(response.json()['next'])
+        self.assertEqual(len(response.json()['results']), 2)
+        self.assertIsNone(response.json()['next'])
+
+    def test_full_versions(self):
+        response = self.client.get(record_url(self.record, 'versions/'), {'full': 1})
+        self.assertEqual(
+            [version['vitals'] for version in response.json()['results']],
+            [{"visit": 3}, {"visit": 2}, {"visit": 1}, {"visit": 0}, {}],
+        )
+
+
+class MedicalRecordVersionDiffTests(MedicalRecordTestCase):
+    def setUp(self):
+        super().setUp()
+        self.doctor = create_doctor("doctor@example.com")
+        self.record = create_record(create_patient("patient@example.com"), vitals={"pulse": 60})
+        grant(self.doctor, self.record)
+        self.record.vitals = {"pulse": 72, "bp": "120/80"}
+        self.record.doctor_name = "Other Doctor"
+        self.record.save()
+        self.history_ids = sorted(self.record.history.values_list('history_id', flat=True))
+
+    def diff_url(self, history_id_a, history_id_b):
+        return record_url(self.record, f'versions/{history_id_a}/diff/{history_id_b}/')
+
+    def test_diff_is_computed_once(self):
+        client = self.client_for(self.doctor)
+        response = client.get(self.diff_url(*self.history_ids))
+        self.assertEqual(response.status_code, 200)
+        expected = [
+            {"op": "replace", "path": "/doctor_name", "value": "Other Doctor"},
+            {"op": "replace", "path": "/vitals/pulse", "value": 72},
+            {"op": "add", "path": "/vitals/bp", "value": "120/80"},
+        ]
+        self.assertEqual(response.data['patch'], expected)
+
+        # Versions never change, so the cached diff is served without reading them again
+        MedicalRecord.history.all().delete()
+        self.assertEqual(client.get(self.diff_url(*self.history_ids)).data['patch'], expected)
+
+    def test_missing_version(self):
+        response = self.client_for(self.doctor).get(self.diff_url(self.history_ids[0], 0))
+        self.assertEqual(response.status_code, 404)
+
+
+class MedicalRecordReadAccessTests(MedicalRecordTestCase):
+    def setUp(self):
+        super().setUp()
+        self.doctor = create_doctor("doctor@example.com")
+        self.patient = create_patient("patient@example.com")
+        self.record = create_record(self.patient, vitals={"pulse": 60})
+        self.before_edit = timezone.now()
+        self.record.vitals = {"pulse": 72}
+        self.record.save()
+        self.history_ids = sorted(self.record.history.values_list('history_id', flat=True))
+
+    def read_urls(self):
+        return [
+            record_url(self.record),
+            record_url(self.record) + '?' + urlencode({'as_of': self.before_edit.isoformat()}),
+            record_url(self.record, 'versions/'),
+            record_url(self.record, 'versions/?full=1'),
+            record_url(self.record, f'version/{self.history_ids[0]}/'),
+            record_url(self.record, f'versions/{self.history_ids[0]}/diff/{self.history_ids[1]}/'),
+        ]
+
+    def test_reads_need_a_grant(self):
+        client = self.client_for(self.doctor)
+        for url in self.read_urls():
+            self.assertEqual(client.get(url).status_code, 403, url)
+
+        grant(self.doctor, self.record)
+        for url in self.read_urls():
+            self.assertEqual(client.get(url).status_code, 200, url)
+
+    def test_patients_read_only_their_own_record(self):
+        for url in self.read_urls():
+            self.assertEqual(self.client_for(self.patient).get(url).status_code, 200, url)
+        stranger = create_patient("stranger@example.com")
+        for url in self.read_urls():
+            self.assertEqual(self.client_for(stranger).get(url).status_code, 403, url)
+
+    def test_as_of(self):
+        grant(self.doctor, self.record)
+        client = self.client_for(self.doctor)
+        current = client.get(record_url(self.record)).json()
+        previous = client.get(record_url(self.record), {'as_of': self.before_edit.isoformat()}).json()
+        self.assertEqual(previous['vitals'], {"pulse": 60})
+        self.assertEqual(set(previous), set(current))
+
+        earlier = (self.before_edit - timedelta(days=1)).isoformat()
+        self.assertEqual(client.get(record_url(self.record), {'as_of': earlier}).status_code, 404)
+        self.assertEqual(client.get(record_url(self.record), {'as_of': 'garbage'}).status_code, 400)
+        self.assertEqual(client.get(record_url(self.record), {'as_of': '2020-13-45T00:00:00'}).status_code, 400)
+
+    def test_missing_version_is_not_answered_with_304(self):
+        grant(self.doctor, self.record)
+        response = self.client_for(self.doctor).get(
+            record_url(self.record, 'version/0/'), HTTP_IF_NONE_MATCH=f'"{self.record.pk}-h0"'
+        )
+        self.assertEqual(response.status_code, 404)
+
+    def test_unchanged_version_is_answered_with_304(self):
+        grant(self.doctor, self.record)
+        client = self.client_for(self.doctor)
+        url = record_url(self.record, f'version/{self.history_ids[0]}/')
+        etag = client.get(url)['ETag']
+        self.assertEqual(client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+
+class GrantCacheTests(MedicalRecordTestCase):
+    def setUp(self):
+        super().setUp()
+        self.doctor = create_doctor("doctor@example.com")
+        self.patient = create_patient("patient@example.com")
+        self.record = create_record(self.patient)
+
+    def test_cached_answers_follow_grant_changes(self):
+        permission_request = grant(self.doctor, self.record, status="pending")
+        doctor_client, patient_client = self.client_for(self.doctor), self.client_for(self.patient)
+        self.assertEqual(doctor_client.put(record_url(self.record), {"vitals": {"pulse": 60}}, format='json').status_code, 403)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = patient_client.put(
+                '/api/medical-record/medical-record/permission-request/respond/',
+                {"permission_request_id": permission_request.pk, "status": "approved"}, format='json',
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(doctor_client.put(record_url(self.record), {"vitals": {"pulse": 60}}, format='json').status_code, 200)
+        with self.assertNumQueries(0):
+            self.assertTrue(grants.can_edit(self.doctor.pk, self.record.pk))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            patient_client.delete('/api/medical-record/medical-record/delete-requests-to-patient/')
+        self.assertEqual(doctor_client.put(record_url(self.record), {"vitals": {"pulse": 72}}, format='json').status_code, 403)
+
+    def test_stale_answer_is_not_read_after_invalidation(self):
+        self.assertFalse(grants.can_edit(self.doctor.pk, self.record.pk))
+        # A reader whose query ran before the grant was committed...
+        old_generation = grants.grant_generation(self.doctor.pk, self.record.pk)
+        grant(self.doctor, self.record)
+        with self.captureOnCommitCallbacks(execute=True):
+            grants.invalidate_grants([(self.doctor.pk, self.record.pk)])
+        # ...writes its answer after the invalidation
+        cache.set(grants.grant_cache_key(self.doctor.pk, self.record.pk, old_generation), False)
+        self.assertTrue(grants.can_edit(self.doctor.pk, self.record.pk))
+
+
+class BulkRequestPermissionTests(MedicalRecordTestCase):
+    url = '/api/medical-record/medical-record/request-permission/bulk/'
+
+    def setUp(self):
+        super().setUp()
+        self.doctor = create_doctor("doctor@example.com")
+        self.records = [create_record(create_patient(f"patient{i}@example.com")) for i in range(4)]
+        grant(self.doctor, self.records[0], status="pending")
+
+    def test_one_result_per_pair(self):
+        pairs = [{"patient_email": f"patient{i}@example.com", "medical_record_id": record.pk} for i, record in enumerate(self.records)]
+        body = {"requests": pairs + [
+            {"patient_email": "patient1@example.com", "medical_record_id": self.records[2].pk},
+            {"patient_email": "patient1@example.com"},
+            pairs[1],
+        ]}
+        response = self.client_for(self.doctor).post(self.url, body, format='json')
+        self.assertEqual(response.status_code, 200)
+
+        results = response.data["results"]
+        self.assertEqual(
+            [result["status"] for result in results],
+            ["already_pending", "created", "created", "created", "not_found", "invalid", "duplicate"],
+        )
+        self.assertTrue(all(result["permission_request_id"] for result in results[:4]))
+        self.assertNotIn("permission_request_id", results[-1])
+        self.assertEqual(response.data["message"], "Created 3 permission request(s).")
+        self.assertEqual(PermissionRequest.objects.filter(status="pending").count(), 4)
+
+    def test_patients_cannot_request(self):
+        patient = self.records[0].user
+        response = self.client_for(patient).post(self.url, {"requests": []}, format='json')
+        self.assertEqual(response.status_code, 403)
+
+
+class BulkRespondToPermissionRequestTests(MedicalRecordTestCase):
+    url = '/api/medical-record/medical-record/permission-request/respond/bulk/'
+
+    def setUp(self):
+        super().setUp()
+        self.patient = create_patient("patient@example.com")
+        record = create_record(self.patient)
+        self.doctors = [create_doctor(f"doctor{i}@example.com") for i in range(3)]
+        self.requests = [grant(doctor, record, status="pending", edit_permission=False) for doctor in self.doctors]
+        self.client = self.client_for(self.patient)
+
+    def test_decisions(self):
+        other = grant(self.doctors[0], create_record(create_patient("other@example.com")), status="pending", edit_permission=False)
+        decisions = [
+            {"permission_request_id": self.requests[0].pk, "status": "approved"},
+            {"permission_request_id": self.requests[1].pk, "status": "approved"},
+            {"permission_request_id": self.requests[2].pk, "status": "denied"},
+            {"permission_request_id": other.pk, "status": "approved"},
+            {"permission_request_id": 999, "status": "maybe"},
+        ]
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.put(self.url, {"decisions": decisions}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [(result["id"], result["status"]) for result in response.data["results"]],
+            [(self.requests[0].pk, "approved"), (self.requests[1].pk, "approved"), (self.requests[2].pk, "denied"),
+             (other.pk, "not_found"), (999, "invalid")],
+        )
+        self.assertEqual(
+            list(PermissionRequest.objects.order_by("id").values_list("status", "edit_permission")),
+            [("approved", True), ("approved", True), ("denied", False), ("pending", False)],
+        )
+
+    def test_malformed_decisions_are_reported(self):
+        decisions = [
+            {"status": "approved"},
+            "approved",
+            {"permission_request_id": "abc", "status": "approved"},
+            {"permission_request_id": self.requests[0].pk, "status": "approved"},
+        ]
+        response = self.client.put(self.url, {"decisions": decisions}, format='json')
+        self.assertEqual([result["status"] for result in response.data["results"]], ["invalid", "invalid", "invalid", "approved"])
+        self.assertIn("permission_request_id", response.data["results"][0]["errors"])
+
+    def test_rejected_batches(self):
+        twice = [
+            {"permission_request_id": self.requests[0].pk, "status": "approved"},
+            {"permission_request_id": str(self.requests[0].pk), "status": "denied"},
+        ]
+        self.assertEqual(self.client.put(self.url, {"decisions": twice}, format='json').status_code, 400)
+        self.assertEqual(self.client.put(self.url, {"decisions": []}, format='json').status_code, 400)
+        self.assertEqual(self.client.put(self.url, {"decisions": [{}] * 201}, format='json').status_code, 400)
+        self.assertFalse(PermissionRequest.objects.exclude(status="pending").exists())
+
+
+class ExpirePermissionGrantsTests(MedicalRecordTestCase):
+    def test_expired_grants_are_archived_and_deleted(self):
+        doctor = create_doctor("doctor@example.com")
+        now = timezone.now()
+        permission_requests = {}
+        for name, status, expiration_time in [
+            ("expired", "approved", now - timedelta(minutes=1)),
+            ("also_expired", "approved", now - timedelta(days=3)),
+            ("current", "approved", now + timedelta(days=1)),
+            ("pending", "pending", None),
+        ]:
+            permission_requests[name] = grant(
+                doctor,
+                create_record(create_patient(f"{name}@example.com")),
+                status=status,
+                edit_permission=status == "approved",
+                response_date=now - timedelta(days=7) if status == "approved" else None,
+                expiration_time=expiration_time,
+            )
+
+        self.assertEqual(expire_permission_grants(batch_size=1), 2)
+
+        self.assertQuerySetEqual(
+            PermissionRequest.objects.order_by("id").values_list("id", flat=True),
+            [permission_requests["current"].id, permission_requests["pending"].id],
+        )
+        archived = {archive.original_id: archive for archive in ArchivedPermissionRequest.objects.all()}
+        self.assertEqual(set(archived), {permission_requests["expired"].id, permission_requests["also_expired"].id})
+        expired = permission_requests["expired"]
+        archive = archived[expired.id]
+        self.assertEqual(archive.status, "expired")
+        self.assertEqual(
+            (archive.doctor_id, archive.patient_id, archive.medical_record_id, archive.edit_permission, archive.expiration_time),
+            (doctor.id, expired.patient_id, expired.medical_record_id, True, expired.expiration_time),
+        )
+
+        # A second sweep finds nothing left to do
+        self.assertEqual(expire_permission_grants(), 0)
+
+    def test_sweep_invalidates_cached_grants(self):
+        doctor = create_doctor("doctor@example.com")
+        record = create_record(create_patient("patient@example.com"))
+        permission_request = grant(doctor, record)
+        self.assertTrue(grants.can_edit(doctor.pk, record.pk))
+
+        PermissionRequest.objects.filter(pk=permission_request.pk).update(expiration_time=timezone.now())
+        with self.captureOnCommitCallbacks(execute=True):
+            expire_permission_grants()
+        self.assertFalse(grants.can_edit(doctor.pk, record.pk))
+
+
+class JSONPatchTests(SimpleTestCase):
+    def test_operations(self):
+        document = {"vitals": {"pulse": 60, "readings": [1, 2]}, "notes": "a"}
+        patched = apply_patch(document, [
+            {"op": "add", "path": "/vitals/readings/-", "value": 3},
+            {"op": "remove", "path": "/vitals/readings/0"},
+            {"op": "replace", "path": "/vitals/pulse", "value": 70},
+            {"op": "copy", "from": "/vitals/pulse", "path": "/previous"},
+            {"op": "move", "from": "/notes", "path": "/comment"},
+            {"op": "test", "path": "/comment", "value": "a"},
+        ])
+        self.assertEqual(patched, {"vitals": {"pulse": 70, "readings": [2, 3]}, "previous": 70, "comment": "a"})
+        # The document passed in is left alone
+        self.assertEqual(document, {"vitals": {"pulse": 60, "readings": [1, 2]}, "notes": "a"})
+
+    def test_escaped_pointers(self):
+        patched = apply_patch({"a/b": 1, "m~n": 2}, [
+            {"op": "replace", "path": "/a~1b", "value": 3},
+            {"op": "remove", "path": "/m~0n"},
+        ])
+        self.assertEqual(patched, {"a/b": 3})
+
+    def test_errors(self):
+        document = {"vitals": {"pulse": 60}, "readings": [1]}
+        cases = [
+            ({"op": "add"}, "A JSON Patch must be a list of operations."),
+            ([{"op": "add"}], "Each operation needs an 'op' and a 'path'."),
+            ([{"op": "add", "path": "/x"}], "Operation 'add' needs a 'value'."),
+            ([{"op": "move", "path": "/x"}], "Operation 'move' needs a 'from'."),
+            ([{"op": "remove", "path": "/missing"}], "Path '/missing' does not exist."),
+            ([{"op": "add", "path": "/missing/x", "value": 1}], "Path '/missing/x' does not exist."),
+            ([{"op": "add", "path": "/readings/5", "value": 1}], "Array index out of range in path '/readings/5'."),
+            ([{"op": "remove", "path": "/readings/01"}], "Invalid array index in path '/readings/01'."),
+            ([{"op": "remove", "path": ""}], "The document root cannot be removed."),
+            ([{"op": "replace", "path": "vitals", "value": 1}], "Invalid JSON pointer 'vitals'."),
+            ([{"op": "move", "from": "/vitals", "path": "/vitals/x"}], "Cannot move '/vitals' into one of its children."),
+            ([{"op": "test", "path": "/vitals/pulse", "value": 60.5}], "Test failed for path '/vitals/pulse'."),
+            ([{"op": "test", "path": "/readings/0", "value": True}], "Test failed for path '/readings/0'."),
+            ([{"op": "merge", "path": "/vitals"}], "Unsupported operation 'merge'."),
+        ]
+        for operations, message in cases:
+            with self.subTest(operations=operations):
+                with self.assertRaisesMessage(JSONPatchError, message):
+                    apply_patch(document, operations)
+
+    def test_make_patch_round_trip(self):
+        source = {"vitals": {"pulse": 60, "flag": 1}, "allergies": ["nuts"], "gone": None}
+        target = {"vitals": {"pulse": 60, "flag": True, "bp": "120/80"}, "allergies": [], "new/key": {}}
+        self.assertEqual(apply_patch(source, make_patch(source, target)), target)
+        self.assertEqual(make_patch(source, source), [])
+
+
+class MedicalRecordJSONPatchTests(MedicalRecordTestCase):
+    def setUp(self):
+        super().setUp()
+        self.doctor = create_doctor("doctor@example.com")
+        self.record = create_record(create_patient("patient@example.com"), vitals={"bp": "120/80", "readings": [1, 2]})
+        grant(self.doctor, self.record)
+        self.client = self.client_for(self.doctor)
+
+    def patch(self, operations):
+        return self.client.patch(record_url(self.record), json.dumps(operations), content_type='application/json-patch+json')
+
+    def test_patch_json_fields(self):
+        response = self.patch([
+            {"op": "replace", "path": "/vitals/bp", "value": "130/85"},
+            {"op": "add", "path": "/vitals/readings/-", "value": 3},
+            {"op": "copy", "from": "/vitals/bp", "path": "/treatment_plan/bp"},
+        ])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["changed_fields"], ["vitals", "treatment_plan"])
+        self.record.refresh_from_db()
+        self.assertEqual(self.record.vitals, {"bp": "130/85", "readings": [1, 2, 3]})
+        self.assertEqual(self.record.treatment_plan, {"bp": "130/85"})
+
+        response = self.patch([{"op": "test", "path": "/vitals/bp", "value": "130/85"}])
+        self.assertEqual(response.data["message"], "No changes were made to the medical record.")
+
+    def test_invalid_patches(self):
+        for operations in [
+            [{"op": "replace", "path": "/doctor_name", "value": "Someone"}],
+            [{"op": "remove", "path": "/vitals"}],
+            [{"op": "test", "path": "/vitals/bp", "value": "0/0"}],
+            {"op": "replace"},
+            [{"op": "replace", "path": "/vitals", "value": None}],
+            [{"op": "replace", "path": "/vitals", "value": "str"}],
+            [{"op": "replace", "path": "/referral_info", "value": 42}],
+        ]:
+            with self.subTest(operations=operations):
+                self.assertEqual(self.patch(operations).status_code, 400)
+        self.assertEqual(self.record.history.count(), 1)
+
+    def test_other_patches_are_partial_puts(self):
+        response = self.client.patch(record_url(self.record), {"hospital_name": "New Hospital"}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["changed_fields"], ["hospital_name"])
+        response = self.client.patch(record_url(self.record), {"vitals": "str"}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+
+class OptimisticLockingTests(MedicalRecordTestCase):
+    def setUp(self):
+        super().setUp()
+        self.patient = create_patient("patient@example.com")
+        self.record = create_record(self.patient, vitals={"pulse": 60})
+
+    def test_stale_save_raises(self):
+        first = MedicalRecord.objects.get(pk=self.record.pk)
+        second = MedicalRecord.objects.get(pk=self.record.pk)
+        first.vitals = {"pulse": 70}
+        first.save()
+
+        second.vitals = {"pulse": 80}
+        with self.assertRaises(StaleVersionError):
+            second.save()
+
+        self.assertEqual(first.version, 2)
+        self.assertEqual(second.version, 1)
+        self.assertEqual(MedicalRecord.objects.get(pk=self.record.pk).vitals, {"pulse": 70})
+
+    def test_stale_if_match_is_rejected(self):
+        doctor = create_doctor("doctor@example.com")
+        grant(doctor, self.record)
+        client = self.client_for(doctor)
+        stale_etag = self.record.etag
+
+        self.record.vitals = {"pulse": 70}
+        self.record.save()
+
+        for method in (client.put, client.patch):
+            response = method(record_url(self.record), {"vitals": {"pulse": 80}}, format="json", HTTP_IF_MATCH=stale_etag)
+            self.assertEqual(response.status_code, 412)
+            self.assertEqual(response["ETag"], self.record.etag)
+
+        response = client.put(record_url(self.record), {"vitals": {"pulse": 80}}, format="json", HTTP_IF_MATCH=self.record.etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["ETag"], MedicalRecord.objects.get(pk=self.record.pk).etag)
+        self.assertEqual(MedicalRecord.objects.get(pk=self.record.pk).vitals, {"pulse": 80})
+
+
+@override_settings(MEDICAL_RECORD_CACHE_TIMEOUT=3600)
+class RecordCacheTests(MedicalRecordTestCase):
+    def setUp(self):
+        super().setUp()
+        self.patient = create_patient("patient@example.com")
+        with self.captureOnCommitCallbacks(execute=True):
+            self.record = create_record(self.patient)
+        self.client = self.client_for(self.patient)
+
+    def test_reads_are_cached_until_the_record_changes(self):
+        first = self.client.get(record_url(self.record))
+        # Only the access check reaches the database
+        with self.assertNumQueries(1):
+            response = self.client.get(record_url(self.record))
+        self.assertEqual(response.json(), first.json())
+        with self.assertNumQueries(1):
+            response = self.client.get(record_url(self.record), HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.record.vitals = {"pulse": 60}
+            self.record.save()
+        response = self.client.get(record_url(self.record))
+        self.assertEqual(response.json()["vitals"], {"pulse": 60})
+        self.assertEqual(response['ETag'], f'"{self.record.pk}-2"')
+
+        # A reader that loaded the old version cannot put it back
+        async_to_sync(record_cache.acache_record)(self.record.pk, 1, first.json())
+        self.assertEqual(async_to_sync(record_cache.aget_cached_record)(self.record.pk)[0], 2)
+
+    def test_deleted_record_is_forgotten(self):
+        self.client.get(record_url(self.record))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.record.delete()
+        self.assertEqual(self.client.get(record_url(self.record)).status_code, 404)
+
+    @override_settings(MEDICAL_RECORD_CACHE_TIMEOUT=0)
+    def test_caching_can_be_turned_off(self):
+        cache.clear()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.record.save()
+        self.client.get(record_url(self.record))
+        self.assertEqual(async_to_sync(record_cache.aget_cached_record)(self.record.pk), (None, None))
+        self.assertIsNone(cache.get(record_cache.version_key(self.record.pk)))
+
+
+class HistoricalVersionCacheTests(MedicalRecordTestCase):
+    def setUp(self):
+        super().setUp()
+        self.patient = create_patient("patient@example.com")
+        self.record = create_record(self.patient, vitals={"pulse": 60})
+        self.record.vitals = {"pulse": 72}
+        self.record.save()
+        self.url = record_url(self.record, f'version/{self.record.history.latest().history_id}/')
+        self.client = self.client_for(self.patient)
+
+    def test_versions_are_cached_for_good(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.json()["vitals"], {"pulse": 72})
+        self.assertIn("immutable", response["Cache-Control"])
+        self.assertIn("private", response["Cache-Control"])
+
+        # Only the access check reaches the database
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get(self.url).json(), response.json())
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=response["ETag"]).status_code, 304)
+
+        # The shared cache backs the per-process LRU
+        record_cache._version_payloads.clear()
+        MedicalRecord.history.all().delete()
+        self.assertEqual(self.client.get(self.url).json(), response.json())
+
+
+class LRUCacheTests(SimpleTestCase):
+    def test_least_recently_used_entry_is_evicted(self):
+        lru = LRUCache(2)
+        lru.set("a", 1)
+        lru.set("b", 2)
+        lru.get("a")
+        lru.set("c", 3)
+        self.assertEqual((lru.get("a"), lru.get("b"), lru.get("c")), (1, None, 3))
+
+
+@override_settings(MEDICAL_RECORD_SYNC_SETTLE_SECONDS=0)
+class SyncTests(MedicalRecordTestCase):
+    url = '/api/medical-record/medical-records/changes/'
+
+    def setUp(self):
+        super().setUp()
+        self.doctor = create_doctor("doctor@example.com")
+        self.patients = [create_patient(f"patient{i}@example.com") for i in range(4)]
+        self.records = [create_record(patient) for patient in self.patients]
+        grant(self.doctor, self.records[0])
+        grant(self.doctor, self.records[1])
+        self.client = self.client_for(self.doctor)
+
+    def sync(self, **params):
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_pages_then_changes_since_the_cursor(self):
+        first = self.sync(page_size=1)
+        self.assertEqual(len(first['changes']), 1)
+        self.assertTrue(first['has_more'])
+        second = self.sync(page_size=1, since=first['cursor'])
+        self.assertEqual(
+            {first['changes'][0]['id'], second['changes'][0]['id']}, {self.records[0].pk, self.records[1].pk}
+        )
+        drained = self.sync(since=second['cursor'])
+        self.assertEqual(drained['changes'], [])
+        self.assertFalse(drained['has_more'])
+        cursor = drained['cursor']
+
+        self.records[1].vitals = {"pulse": 60}
+        self.records[1].save()
+        self.records[2].vitals = {"pulse": 60}  # Not visible to the doctor
+        self.records[2].save()
+        # An old record the doctor was just given access to
+        grant(self.doctor, self.records[3])
+        with self.captureOnCommitCallbacks(execute=True):
+            deleted_id = self.records[0].pk
+            self.records[0].delete()
+            create_record(create_patient("stranger@example.com")).delete()  # Never granted: no tombstone
+
+        changes = self.sync(since=cursor)
+        self.assertEqual(sorted(record['id'] for record in changes['changes']), [self.records[1].pk, self.records[3].pk])
+        self.assertEqual(changes['deleted'], [deleted_id])
+
+    def test_updates_and_grants_are_read_with_range_queries(self):
+        cursor = self.sync()['cursor']
+        self.records[1].save()
+        grant(self.doctor, self.records[2])
+        # Updated, then granted again: sent once, in the order of its latest change
+        PermissionRequest.objects.filter(medical_record=self.records[1]).update(response_date=timezone.now())
+
+        with CaptureQueriesContext(connection) as queries:
+            changes = self.sync(since=cursor)
+        self.assertEqual([record['id'] for record in changes['changes']], [self.records[2].pk, self.records[1].pk])
+        self.assertFalse(any('MAX(' in query['sql'] or 'GREATEST(' in query['sql'] for query in queries.captured_queries))
+
+    def test_patient(self):
+        self.client = self.client_for(self.patients[2])
+        changes = self.sync()
+        self.assertEqual([record['id'] for record in changes['changes']], [self.records[2].pk])
+        self.assertEqual(changes['deleted'], [])
+        self.assertEqual(self.client.get(self.url, {'since': 'garbage'}).status_code, 400)
+
+
+class WebhookReceiver(BaseHTTPRequestHandler):
+    """
+    Local hospital endpoint: answers with the queued status codes, then 200.
+    """
+    status_codes = []
+    received = []
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        self.received.append((self.path, dict(self.headers), body))
+        self.send_response(self.status_codes.pop(0) if self.status_codes else 200)
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class OutboxTests(MedicalRecordTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = HTTPServer(("127.0.0.1", 0), WebhookReceiver)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        super().setUp()
+        WebhookReceiver.status_codes.clear()
+        WebhookReceiver.received.clear()
+        self.doctor = create_doctor("doctor@example.com")
+        self.patient = create_patient("patient@example.com")
+        self.patient.patient_profile.doctors.add(self.doctor.doctor_profile)
+        self.other_doctor = create_doctor("other@example.com")
+        self.other_doctor.doctor_profile.hospital = Hospital.objects.create(name="Other Hospital", address="Elsewhere")
+        self.other_doctor.doctor_profile.save()
+
+        base_url = f"http://127.0.0.1:{self.server.server_port}"
+        self.webhook = HospitalWebhook.objects.create(hospital=self.doctor.doctor_profile.hospital, url=f"{base_url}/own")
+        self.other_webhook = HospitalWebhook.objects.create(hospital=self.other_doctor.doctor_profile.hospital, url=f"{base_url}/granted")
+
+    def test_events_are_coalesced_signed_and_retried(self):
+        record = create_record(self.patient)
+        for pulse in (60, 72):
+            record.vitals = {"pulse": pulse}
+            record.save()
+        permission_request = grant(self.other_doctor, record, status="pending", edit_permission=False)
+        response = self.client_for(self.patient).put(
+            '/api/medical-record/medical-record/permission-request/respond/',
+            {"permission_request_id": permission_request.pk, "status": "approved"}, format='json',
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(OutboxEvent.objects.count(), 4)
+
+        with mock.patch.object(deliver_webhooks, "delay") as delay:
+            self.assertEqual(dispatch_outbox_events(), 4)
+        delay.assert_called_once_with()
+        self.assertFalse(OutboxEvent.objects.exists())
+
+        # One delivery per hospital webhook, carrying every event of the record
+        delivery = WebhookDelivery.objects.get(webhook=self.webhook)
+        self.assertEqual(
+            [event["type"] for event in delivery.payload["events"]],
+            ["medical_record.created", "medical_record.updated", "medical_record.updated", "permission_request.approved"],
+        )
+        self.assertEqual(delivery.payload["version"], 3)
+        self.assertTrue(WebhookDelivery.objects.filter(webhook=self.other_webhook).exists())
+
+        WebhookReceiver.status_codes.append(500)
+        self.assertEqual(deliver_webhooks(), 1)
+        self.assertEqual(len(WebhookReceiver.received), 2)
+        for path, headers, body in WebhookReceiver.received:
+            webhook = self.webhook if path == "/own" else self.other_webhook
+            timestamp, signature = [part.split("=", 1)[1] for part in headers[SIGNATURE_HEADER].split(",")]
+            self.assertEqual(sign(webhook.secret, int(timestamp), body), signature)
+            self.assertNotIn("vitals", json.loads(body)["events"][1])
+
+        failed = WebhookDelivery.objects.get(status="pending")
+        self.assertEqual((failed.attempts, failed.last_error), (1, "HTTP 500"))
+        self.assertGreater(failed.next_attempt_at, timezone.now())
+        # Not due yet
+        self.assertEqual(deliver_webhooks(), 0)
+
+        WebhookDelivery.objects.update(next_attempt_at=timezone.now())
+        self.assertEqual(deliver_webhooks(), 1)
+        self.assertEqual(WebhookDelivery.objects.filter(status="delivered").count(), 2)
+
+    @override_settings(WEBHOOK_MAX_ATTEMPTS=2)
+    def test_delivery_fails_after_the_last_attempt(self):
+        create_record(self.patient)
+        with mock.patch.object(deliver_webhooks, "delay"):
+            dispatch_outbox_events()
+        WebhookReceiver.status_codes.extend([500, 500])
+        deliver_webhooks()
+        WebhookDelivery.objects.update(next_attempt_at=timezone.now())
+        deliver_webhooks()
+        delivery = WebhookDelivery.objects.get()
+        self.assertEqual((delivery.status, delivery.attempts), ("failed", 2))
+
+    def test_deletion_is_recorded(self):
+        record = create_record(self.patient)
+        OutboxEvent.objects.all().delete()
+        record.delete()
+        self.assertEqual(OutboxEvent.objects.get().event_type, "medical_record.deleted")
+
+
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+class UserEventsConsumerTests(MedicalRecordTestCase):
+    def setUp(self):
+        super().setUp()
+        self.doctor = create_doctor("doctor@example.com")
+        self.patient = create_patient("patient@example.com")
+        self.record = create_record(self.patient)
+
+    def request_permission(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client_for(self.doctor).post(
+                '/api/medical-record/medical-record/request-permission/',
+                {"patient_email": self.patient.email, "medical_record_id": self.record.pk}, format='json',
+            )
+        self.assertEqual(response.status_code, 201)
+
+    def approve(self):
+        permission_request = PermissionRequest.objects.get()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client_for(self.patient).put(
+                '/api/medical-record/medical-record/permission-request/respond/bulk/',
+                {"decisions": [{"permission_request_id": permission_request.pk, "status": "approved"}]}, format='json',
+            )
+
+    def test_events_reach_the_users_concerned(self):
+        from backend.asgi import application
+
+        patient_token = Token.objects.create(user=self.patient).key
+        doctor_token = Token.objects.create(user=self.doctor).key
+
+        async def run():
+            anonymous = WebsocketCommunicator(application, '/ws/events/')
+            connected, code = await anonymous.connect()
+            self.assertFalse(connected)
+            self.assertEqual(code, 4401)
+
+            patient = WebsocketCommunicator(application, f'/ws/events/?token={patient_token}')
+            doctor = WebsocketCommunicator(
+                application, '/ws/events/', headers=[(b'authorization', f'Token {doctor_token}'.encode())]
+            )
+            self.assertTrue((await patient.connect())[0])
+            self.assertTrue((await doctor.connect())[0])
+
+            await sync_to_async(self.request_permission)()
+            message = await patient.receive_json_from()
+            self.assertEqual(message['event'], 'permission_request.created')
+            self.assertEqual(message['payload']['doctor_id'], self.doctor.pk)
+            self.assertTrue(await doctor.receive_nothing())
+
+            await sync_to_async(self.approve)()
+            message = await doctor.receive_json_from()
+            self.assertEqual(message['event'], 'permission_request.approved')
+            self.assertTrue(message['payload']['expiration_time'])
+            self.assertTrue(await patient.receive_nothing())
+
+            await patient.disconnect()
+            await doctor.disconnect()
+
+        async_to_sync(run)()
+
+
+class AsyncReadViewTests(MedicalRecordTestCase):
+    def setUp(self):
+        super().setUp()
+        self.doctor = create_doctor("doctor@example.com")
+        self.record = create_record(create_patient("patient@example.com"), vitals={"pulse": 60})
+        grant(self.doctor, self.record)
+        self.headers = {"Authorization": f"Token {Token.objects.create(user=self.doctor).key}"}
+
+    def test_reads_run_on_the_event_loop(self):
+        async def run():
+            client = AsyncClient()
+            self.assertEqual((await client.get(record_url(self.record))).status_code, 403)
+            response = await client.get(record_url(self.record), headers={"Authorization": "Token invalid"})
+            self.assertEqual(response.json(), {"detail": "Invalid token."})
+
+            response = await client.get(record_url(self.record), headers=self.headers)
+            self.assertEqual(response.json()["vitals"], {"pulse": 60})
+
+            response = await client.get(record_url(self.record, 'versions/'), headers=self.headers)
+            history_id = response.json()["results"][0]["history_id"]
+            response = await client.get(record_url(self.record, f'version/{history_id}/'), headers=self.headers)
+            self.assertEqual(response.json()["vitals"], {"pulse": 60})
+
+            response = await client.get(record_url(self.record), {"as_of": "bad"}, headers=self.headers)
+            self.assertEqual(response.json(), {"as_of": "Enter a valid ISO 8601 date and time."})
+
+        async_to_sync(run)()
+
+    def test_writes_are_handed_to_the_rest_framework_view(self):
+        response = self.client_for(self.doctor).patch(record_url(self.record), {"vitals": {"pulse": 72}}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(MedicalRecord.objects.get().vitals, {"pulse": 72})
+
+
+class JWTAuthenticationTests(MedicalRecordTestCase):
+    def setUp(self):
+        super().setUp()
+        self.doctor = create_doctor("doctor@example.com", password="password")
+        self.patient = create_patient("patient@example.com", password="password")
+        self.record = create_record(self.patient)
+        grant(self.doctor, self.record)
+
+    def bearer_client(self, user):
+        response = APIClient().post('/api/auth/token/', {'email': user.email, 'password': "password"}, format='json')
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f"Bearer {response.data['access']}")
+        return client
+
+    def test_tokens_carry_role_claims(self):
+        response = APIClient().post('/api/auth/token/', {'email': self.doctor.email, 'password': "password"}, format='json')
+        claims = AccessToken(response.data['access'])
+        self.assertEqual(
+            (claims['is_doctor'], claims['is_patient'], claims['doctor_id'], claims['patient_id'], claims['hospital_id']),
+            (True, False, self.doctor.doctor_profile.id, None, self.doctor.doctor_profile.hospital_id),
+        )
+
+    def test_requests_need_no_auth_or_role_query(self):
+        client = self.bearer_client(self.doctor)
+        with self.assertNumQueries(1):
+            response = client.get(LIST_URL)
+        self.assertEqual(list(response.data['results']), ["patient@example.com"])
+
+        response = client.patch(record_url(self.record), {"vitals": {"pulse": 72}}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(MedicalRecord.history.filter(id=self.record.pk).first().history_user_id, self.doctor.pk)
+
+    def test_claims_grant_no_more_than_the_roles(self):
+        other = create_patient("other@example.com", password="password")
+        self.assertEqual(self.bearer_client(other).get(record_url(self.record, 'versions/')).status_code, 403)
+        self.assertEqual(self.bearer_client(self.patient).get(record_url(self.record, 'versions/')).status_code, 200)
+        # A patient's stateless user has no doctor profile to be mistaken for
+        self.assertEqual(self.bearer_client(self.patient).post(LIST_URL, {'patient_email': other.email}).status_code, 403)
+
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION="Bearer invalid")
+        self.assertEqual(client.get(LIST_URL).status_code, 403)
+
+    def test_async_views_accept_bearer_tokens(self):
+        access = APIClient().post('/api/auth/token/', {'email': self.doctor.email, 'password': "password"}, format='json').data['access']
+
+        async def run():
+            client = AsyncClient()
+            response = await client.get(record_url(self.record, 'versions/'), headers={"Authorization": f"Bearer {access}"})
+            self.assertEqual(len(response.json()["results"]), 1)
+            response = await client.get(record_url(self.record), headers={"Authorization": "Bearer invalid"})
+            self.assertEqual(response.status_code, 403)
+
+        async_to_sync(run)()
+
+
+class RoleContextTests(MedicalRecordTestCase):
+    def setUp(self):
+        super().setUp()
+        self.doctor = create_doctor("doctor@example.com", password="password")
+        self.record = create_record(create_patient("patient@example.com"))
+        grant(self.doctor, self.record)
+
+    def test_roles_are_resolved_once_per_request(self):
+        client = self.client_for(self.doctor)
+        client.get(LIST_URL)
+        # The cached token user carries its roles, leaving the page query alone
+        with self.assertNumQueries(1):
+            response = client.get(LIST_URL)
+        self.assertEqual(list(response.data['results']), ["patient@example.com"])
+
+        client = APIClient()
+        client.login(email=self.doctor.email, password="password")
+        # Session, user, roles and the page
+        with self.assertNumQueries(4):
+            self.assertEqual(client.get(LIST_URL).status_code, 200)
+
+    def test_new_records_use_the_current_hospital(self):
+        client = self.client_for(self.doctor)
+        patient = create_patient("new@example.com")
+        self.assertEqual(client.post(LIST_URL, {'patient_email': patient.email}).status_code, 201)
+        self.assertEqual(MedicalRecord.objects.get(user=patient).hospital_address, "Address")
+
+        hospital = Hospital.objects.get()
+        hospital.address = "New Address"
+        hospital.save()
+        patient = create_patient("newer@example.com")
+        client.post(LIST_URL, {'patient_email': patient.email})
+        self.assertEqual(MedicalRecord.objects.get(user=patient).hospital_address, "New Address")
+
+    def test_lost_roles_take_effect_at_once(self):
+        client = self.client_for(self.doctor)
+        self.assertEqual(client.get(record_url(self.record, 'versions/')).status_code, 200)
+        Doctor.objects.get(user=self.doctor).delete()
+        self.assertEqual(client.get(record_url(self.record, 'versions/')).status_code, 403)
+        patient = create_patient("new@example.com")
+        self.assertEqual(client.post(LIST_URL, {'patient_email': patient.email}).status_code, 403)
@@ -1,23 +1,33 @@
 from django.urls import path
+from .async_views import (
+    AsyncMedicalRecordDetailView,
+    AsyncMedicalRecordVersionsView,
+    AsyncMedicalRecordSpecificVersionView,
+)
 from .views import (
     MedicalRecordListCreateView,
-    MedicalRecordRetrieveUpdateView,
-    MedicalRecordVersionsView,
-    MedicalRecordSpecificVersionView,
+    MedicalRecordChangesView,
+    MedicalRecordVersionDiffView,
     RequestPermissionView,
+    BulkRequestPermissionView,
     RespondToPermissionRequestView,
+    BulkRespondToPermissionRequestView,
     DeletePermissionRequestsToPatientView
     
 )
 
 urlpatterns = [
     path('medical-records/', MedicalRecordListCreateView.as_view(), name='medical-record-list-create'),  # List all latest records or create a new one
-    path('medical-records/<int:pk>/', MedicalRecordRetrieveUpdateView.as_view(), name='medical-record-detail'),  # Retrieve, update (create new version), or delete a record
-    path('medical-records/<int:pk>/versions/', MedicalRecordVersionsView.as_view(), name='medical-record-versions'),  # List all versions of a record
-    path('medical-records/<int:pk>/version/<int:version_number>/', MedicalRecordSpecificVersionView.as_view(), name='medical-record-specific-version'),  # Retrieve a specific version by version number
+    path('medical-records/changes/', MedicalRecordChangesView.as_view(), name='medical-record-changes'),  # Records changed or deleted since a sync cursor
+    path('medical-records/<int:pk>/', AsyncMedicalRecordDetailView.as_view(), name='medical-record-detail'),  # Retrieve (async) or update a record in place (previous versions are kept in its history)
+    path('medical-records/<int:pk>/versions/', AsyncMedicalRecordVersionsView.as_view(), name='medical-record-versions'),  # List all versions of a record
+    path('medical-records/<int:pk>/version/<int:history_id>/', AsyncMedicalRecordSpecificVersionView.as_view(), name='medical-record-specific-version'),  # Retrieve a specific version by history_id
+    path('medical-records/<int:pk>/versions/<int:history_id_a>/diff/<int:history_id_b>/', MedicalRecordVersionDiffView.as_view(), name='medical-record-version-diff'),  # JSON Patch between two versions
     
     path('medical-record/request-permission/', RequestPermissionView.as_view(), name='request_permission'),
+    path('medical-record/request-permission/bulk/', BulkRequestPermissionView.as_view(), name='bulk_request_permission'),
     path('medical-record/permission-request/respond/', RespondToPermissionRequestView.as_view(), name='respond_permission'),
+    path('medical-record/permission-request/respond/bulk/', BulkRespondToPermissionRequestView.as_view(), name='bulk_respond_permission'),
     
      path('medical-record/delete-requests-to-patient/', DeletePermissionRequestsToPatientView.as_view(), name='delete_permission_requests_to_patient',),
 ]
@@ -3,37 +3,68 @@ from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.exceptions import NotFound, PermissionDenied, ValidationError
 from rest_framework.permissions import IsAuthenticated
-from rest_framework.authentication import SessionAuthentication, TokenAuthentication
+from rest_framework.authentication import SessionAuthentication
+from rest_framework_simplejwt.authentication import JWTStatelessUserAuthentication
+from rest_framework.settings import api_settings
+from django.core.cache import cache
+from django.http import StreamingHttpResponse
 from django.utils import timezone
+from django.utils.http import parse_etags
 from collections import defaultdict
-from .models import MedicalRecord, PermissionRequest
-from userauth.models import User, Doctor, Patient
+from itertools import groupby
+from operator import attrgetter
+from .models import MedicalRecord, PermissionRequest, StaleVersionError
+from userauth.authentication import CachedTokenAuthentication
+from userauth.models import User, Patient
+from userauth.roles import user_reference
 from django.db import transaction
+from .pagination import MedicalRecordCursorPagination
+from .renderers import NDJSONRenderer
+from .history import JSON_FIELDS, diff_versions, json_document, materialize_versions
+from .json_patch import JSONPatchError, apply_patch, parse_pointer
+from .parsers import JSONPatchParser
+from .grants import can_edit, invalidate_grants
+from .notifications import notify_users, permission_request_payload
+from .outbox import make_event, record_event, record_events
+from .sync import InvalidSyncCursor, changes_since, decode_cursor
 from .serializers import (
+    BulkPermissionDecisionSerializer,
     MedicalRecordSerializer,
-    MedicalRecordHistorySerializer,
     PermissionRequestSerializer,
     PermissionResponseSerializer,
 )
 
 
+def normalize_value(value):
+    """
+    Strip surrounding whitespace from strings so that only real edits count as changes.
+    """
+    return value.strip() if isinstance(value, str) else value
+
+
 class MedicalRecordListCreateView(generics.ListCreateAPIView):
     """
-    GET: List all medical records for a specific patient.
+    GET: List the medical records visible to the requester, one cursor page at a time.
+         `?stream=1` streams the full grouped dump as one JSON object and
+         `Accept: application/x-ndjson` streams one line per patient instead.
     POST: Create a new version of a medical record if an update is needed.
     """
     queryset = MedicalRecord.objects.all()
     serializer_class = MedicalRecordSerializer
-    authentication_classes = [SessionAuthentication, TokenAuthentication]
+    authentication_classes = [SessionAuthentication, CachedTokenAuthentication, JWTStatelessUserAuthentication]
     permission_classes = [IsAuthenticated]
+    pagination_class = MedicalRecordCursorPagination
+    renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES + [NDJSONRenderer]
+    stream_chunk_size = 2000
+
+    def get_queryset(self):
+        return MedicalRecord.objects.visible_to(self.request.user)
 
     def create(self, request, *args, **kwargs):
         user = request.user  # Should be a User instance
 
         # Ensure the requester is a doctor
-        try:
-            doctor = user.doctor_profile  # Access the Doctor instance
-        except Doctor.DoesNotExist:
+        if not request.roles.is_doctor:
             return Response(
                 {"message": "You don't have permission to create a medical record."},
                 status=status.HTTP_403_FORBIDDEN
@@ -63,8 +94,9 @@ class MedicalRecordListCreateView(generics.ListCreateAPIView):
             )
 
         # Create a new medical record
-        hospital_name = doctor.hospital.name
-        hospital_address = doctor.hospital.address
+        hospital = request.roles.hospital
+        hospital_name = hospital.name
+        hospital_address = hospital.address
         doctor_name = f"{user.first_name} {user.last_name}".strip()
 
         medical_record = MedicalRecord.objects.create(
@@ -82,14 +114,22 @@ class MedicalRecordListCreateView(generics.ListCreateAPIView):
         
     def list(self, request, *args, **kwargs):
         """
-        Group medical records by user email and return as a structured response.
+        Group a page of medical records by user email and return as a structured response.
+        Records are ordered by patient, so a patient's records only continue on the next page
+        when the page boundary falls inside their group.
         """
-        # Query all medical records and prefetch related user data
         queryset = self.get_queryset().select_related('user')
 
+        if isinstance(request.accepted_renderer, NDJSONRenderer):
+            return StreamingHttpResponse(self.stream_ndjson(queryset), content_type=NDJSONRenderer.media_type)
+        if request.query_params.get('stream') in ('1', 'true'):
+            return StreamingHttpResponse(self.stream_json(queryset), content_type='application/json')
+
+        page = self.paginate_queryset(queryset)
+
         # Group records by user email
         grouped_records = defaultdict(list)
-        for record in queryset:
+        for record in page:
             grouped_records[record.user.email].append(record)
 
         # Serialize the grouped data
@@ -98,64 +138,144 @@ class MedicalRecordListCreateView(generics.ListCreateAPIView):
             for user_email, records in grouped_records.items()
         }
 
-        return Response(response_data, status=status.HTTP_200_OK)
+        return self.get_paginated_response(response_data)
+
+    def iter_groups(self, queryset):
+        """
+        Yield (email, serialized records) per patient while reading the queryset in chunks,
+        so only one chunk of model instances is held in memory at a time.
+        """
+        records = queryset.order_by('user_id', 'id').iterator(chunk_size=self.stream_chunk_size)
+        for _, group in groupby(records, key=attrgetter('user_id')):
+            group = list(group)
+            yield group[0].user.email, MedicalRecordSerializer(group, many=True).data
+
+    def stream_ndjson(self, queryset):
+        for user_email, records in self.iter_groups(queryset):
+            yield NDJSONRenderer.render_line({"email": user_email, "records": records})
+
+    def stream_json(self, queryset):
+        """
+        Stream the same `{email: [records]}` object the unpaginated list used to build in memory.
+        """
+        yield b'{'
+        separator = b''
+        for user_email, records in self.iter_groups(queryset):
+            yield separator + NDJSONRenderer.encode(user_email) + b':' + NDJSONRenderer.encode(records)
+            separator = b','
+        yield b'}'
         
     
-class MedicalRecordRetrieveUpdateView(generics.RetrieveUpdateAPIView):
+class MedicalRecordChangesView(APIView):
+    """
+    GET: Incremental sync for offline clients. Returns the visible records that changed and the
+         ids of the records deleted since `?since=<cursor>`, plus the cursor for the next sync.
+         Without `since` every visible record is returned. Call again while `has_more` is true.
+    """
+    authentication_classes = [SessionAuthentication, CachedTokenAuthentication, JWTStatelessUserAuthentication]
+    permission_classes = [IsAuthenticated]
+    page_size = 200
+    max_page_size = 1000
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params['page_size'])
+        except (KeyError, ValueError):
+            return self.page_size
+        if page_size <= 0:
+            return self.page_size
+        return min(page_size, self.max_page_size)
+
+    def get(self, request, *args, **kwargs):
+        since = request.query_params.get('since')
+        try:
+            cursor = decode_cursor(since) if since else None
+        except InvalidSyncCursor as e:
+            raise ValidationError({"since": str(e)})
+
+        records, deleted_ids, next_cursor, has_more = changes_since(
+            request.user, cursor, self.get_page_size(request)
+        )
+        return Response({
+            "changes": MedicalRecordSerializer(records, many=True).data,
+            "deleted": deleted_ids,
+            "cursor": next_cursor,
+            "has_more": has_more,
+        })
+
+
+class MedicalRecordUpdateView(generics.UpdateAPIView):
     """
-    GET: Retrieve a specific medical record.
     PUT: Allow updates only by the doctor who has been granted edit permission.
+    PATCH: Same permission rules; accepts a JSON Patch against the JSON fields.
+    PUT and PATCH with a stale If-Match are rejected with 412.
+    GET is served by AsyncMedicalRecordDetailView, which hands these methods over.
     """
     queryset = MedicalRecord.objects.all()
     serializer_class = MedicalRecordSerializer
-    authentication_classes = [SessionAuthentication, TokenAuthentication]
+    authentication_classes = [SessionAuthentication, CachedTokenAuthentication, JWTStatelessUserAuthentication]
     permission_classes = [IsAuthenticated]
+    parser_classes = api_settings.DEFAULT_PARSER_CLASSES + [JSONPatchParser]
 
-    def update(self, request, *args, **kwargs):
-        user = request.user  # Should be a User instance
-        instance = self.get_object()
-
+    def edit_permission_denied(self, user, instance):
+        """
+        Return a 403 response unless the user is a doctor allowed to edit this medical record.
+        """
         # Ensure the requester is a doctor
-        try:
-            doctor = user.doctor_profile
-        except Doctor.DoesNotExist:
+        if not self.request.roles.is_doctor:
             return Response(
                 {"message": "You don't have permission to update this medical record."},
                 status=status.HTTP_403_FORBIDDEN,
             )
 
         # Check if the doctor has permission to edit this medical record
-        try:
-            permission_request = PermissionRequest.objects.get(
-                medical_record=instance,
-                doctor=user,  # 'doctor' field in PermissionRequest is a ForeignKey to User
-                status="approved",
-                edit_permission=True,
-            )
-        except PermissionRequest.DoesNotExist:
+        if not can_edit(user.id, instance.id):
             return Response(
                 {"message": "You do not have permission to edit this medical record."},
                 status=status.HTTP_403_FORBIDDEN,
             )
+        return None
+
+    def precondition_failed(self, instance):
+        return Response(
+            {"message": "The medical record was changed by someone else. Reload it and try again."},
+            status=status.HTTP_412_PRECONDITION_FAILED,
+            headers={"ETag": instance.etag},
+        )
+
+    def if_match_failed(self, request, instance):
+        """
+        Return a 412 response when an If-Match header names a version other than the current one.
+        """
+        if_match = request.headers.get("If-Match")
+        if if_match is None:
+            return None
+        etags = parse_etags(if_match)
+        if "*" in etags or instance.etag in etags:
+            return None
+        return self.precondition_failed(instance)
+
+    def update(self, request, *args, **kwargs):
+        user = request.user  # Should be a User instance
+        instance = self.get_object()
+
+        denied = self.edit_permission_denied(user, instance) or self.if_match_failed(request, instance)
+        if denied is not None:
+            return denied
 
         # Prepare data for comparison
         data = request.data.copy()
-        excluded_fields = ['id', 'user', 'date', 'previous_version', 'doctor_name']
-        changes_detected = False
+        excluded_fields = ['id', 'user', 'date', 'doctor_name', 'created_at', 'updated_at', 'version']
         changed_fields = []
 
         # Get all field names from the model, excluding read-only fields
         model_fields = [field.name for field in instance._meta.fields if field.name not in excluded_fields]
 
-        # Compare each field to see if changes were made
+        # Compare each field structurally to see if changes were made
         for field in model_fields:
-            new_value = data.get(field, getattr(instance, field))
-            old_value = getattr(instance, field)
-
-            # Normalize None and string values for comparison
-            if str(new_value).strip() != str(old_value).strip():
-                changes_detected = True
+            if field in data and normalize_value(data[field]) != normalize_value(getattr(instance, field)):
                 changed_fields.append(field)
+        changes_detected = bool(changed_fields)
 
         # If no changes, return a response indicating that
         if not changes_detected:
@@ -164,89 +284,155 @@ class MedicalRecordRetrieveUpdateView(generics.RetrieveUpdateAPIView):
                 status=status.HTTP_200_OK,
             )
 
-        # Create a new instance with updated data
-        new_data = {field: getattr(instance, field) for field in model_fields}  # Copy existing data
-        new_data.update(data)  # Apply updates
-        new_data['user'] = instance.user.id  # Assign the primary key of the User instance
-        new_data['doctor_name'] = f"{user.first_name} {user.last_name}".strip()
-        new_data['date'] = timezone.now()
+        # Update the record in place; django-simple-history keeps the previous version
+        serializer = self.get_serializer(
+            instance,
+            data={field: data[field] for field in changed_fields},
+            partial=True,
+        )
+        serializer.is_valid(raise_exception=True)
+        instance._history_user = user_reference(user)
+        try:
+            # Single conditional UPDATE on the version this request started from
+            serializer.save(
+                doctor_name=f"{user.first_name} {user.last_name}".strip(),
+                date=timezone.now(),
+            )
+        except StaleVersionError:
+            instance.refresh_from_db(fields=["version"])
+            return self.precondition_failed(instance)
 
-        # Create the new record
-        serializer = self.get_serializer(data=new_data)
+        return self.updated_response(instance, changed_fields)
+
+    def partial_update(self, request, *args, **kwargs):
+        """
+        PATCH with `Content-Type: application/json-patch+json` applies RFC 6902 operations to the
+        JSON fields (paths start with the field name, e.g. "/vitals/blood_pressure").
+        Any other PATCH is a partial PUT.
+        """
+        if not request.content_type.startswith(JSONPatchParser.media_type):
+            return super().partial_update(request, *args, **kwargs)
+
+        user = request.user
+        instance = self.get_object()
+
+        denied = self.edit_permission_denied(user, instance) or self.if_match_failed(request, instance)
+        if denied is not None:
+            return denied
+
+        operations = request.data
+        document = json_document(instance)
+        try:
+            # Operations may only touch the JSON fields
+            for operation in operations if isinstance(operations, list) else []:
+                for pointer in (operation.get("path"), operation.get("from")) if isinstance(operation, dict) else ():
+                    if pointer is not None and parse_pointer(pointer)[:1] not in [[field] for field in JSON_FIELDS]:
+                        raise JSONPatchError(f"Path '{pointer}' must start with one of: {', '.join(JSON_FIELDS)}.")
+            patched = apply_patch(document, operations)
+        except JSONPatchError as exc:
+            raise ValidationError({"patch": str(exc)})
+
+        missing_fields = [field for field in JSON_FIELDS if field not in patched]
+        if missing_fields:
+            raise ValidationError({"patch": f"Fields cannot be removed: {', '.join(missing_fields)}."})
+
+        changed_fields = [field for field in JSON_FIELDS if patched[field] != document[field]]
+        if not changed_fields:
+            return Response(
+                {"message": "No changes were made to the medical record."},
+                status=status.HTTP_200_OK,
+            )
+
+        # Patched values go through the same validation as a PUT
+        serializer = self.get_serializer(instance, data={field: patched[field] for field in changed_fields}, partial=True)
         serializer.is_valid(raise_exception=True)
-        new_instance = serializer.save()
+        for field, value in serializer.validated_data.items():
+            setattr(instance, field, value)
+        instance.doctor_name = f"{user.first_name} {user.last_name}".strip()
+        instance._history_user = user_reference(user)
+        try:
+            instance.save(update_fields=[*changed_fields, "doctor_name", "date", "updated_at"])
+        except StaleVersionError:
+            instance.refresh_from_db(fields=["version"])
+            return self.precondition_failed(instance)
 
+        return self.updated_response(instance, changed_fields)
+
+    def updated_response(self, instance, changed_fields):
         return Response(
             {
-                "message": "Medical record updated successfully. A new version has been created.",
+                "message": "Medical record updated successfully. The previous version is kept in its history.",
                 "changed_fields": changed_fields,
-                "medical_record_id": new_instance.id,
+                "medical_record_id": instance.id,
+                "history_id": instance.history.latest().history_id,
             },
-            status=status.HTTP_201_CREATED,
+            status=status.HTTP_200_OK,
+            headers={"ETag": instance.etag},
         )
-class MedicalRecordVersionsView(generics.ListAPIView):
-    """
-    GET: List all historical versions of a specific medical record.
-    """
-    serializer_class = MedicalRecordHistorySerializer
-    permission_classes = [IsAuthenticated]
-
-    def get_queryset(self):
-        user = self.request.user
-
-        # Ensure the requester is a doctor
-        if not hasattr(user, 'doctor_profile'):
-            raise PermissionDenied("You don't have permission to view medical record versions.")
-
-        record_id = self.kwargs['pk']
-        try:
-            record = MedicalRecord.objects.get(pk=record_id)
-            return record.history.all()
-        except MedicalRecord.DoesNotExist:
-            raise NotFound(f"MedicalRecord with id {record_id} not found.")
 
 
-class MedicalRecordSpecificVersionView(generics.RetrieveAPIView):
+class MedicalRecordVersionDiffView(APIView):
     """
-    GET: Retrieve a specific historical version of a medical record by history_id.
+    GET: Return the JSON Patch between two historical versions of a medical record.
+    Historical versions never change, so a computed diff is cached for good.
     """
-    serializer_class = MedicalRecordHistorySerializer
+    authentication_classes = [SessionAuthentication, CachedTokenAuthentication, JWTStatelessUserAuthentication]
     permission_classes = [IsAuthenticated]
 
-    def get_object(self):
-        user = self.request.user
+    def get(self, request, *args, **kwargs):
+        record_id = self.kwargs['pk']
 
-        # Ensure the requester is a doctor
-        if not hasattr(user, 'doctor_profile'):
-            raise PermissionDenied("You don't have permission to view this version of the medical record.")
+        # Past versions are readable by whoever may read the record now
+        if not MedicalRecord.objects.visible_to(request.user).filter(pk=record_id).exists():
+            if not MedicalRecord.objects.filter(pk=record_id).exists():
+                raise NotFound(f"MedicalRecord with id {record_id} not found.")
+            raise PermissionDenied("You don't have permission to compare versions of this medical record.")
+        history_id_a = self.kwargs['history_id_a']
+        history_id_b = self.kwargs['history_id_b']
+
+        cache_key = f"medical_record:{record_id}:diff:{history_id_a}:{history_id_b}"
+        response_data = cache.get(cache_key)
+        if response_data is None:
+            versions = {
+                version.history_id: version
+                for version in materialize_versions(
+                    MedicalRecord.history.filter(id=record_id, history_id__in=[history_id_a, history_id_b])
+                )
+            }
+            missing = [history_id for history_id in (history_id_a, history_id_b) if history_id not in versions]
+            if missing:
+                raise NotFound(f"Version with history_id {missing[0]} for MedicalRecord with id {record_id} not found.")
+
+            response_data = {
+                "medical_record_id": record_id,
+                "from_history_id": history_id_a,
+                "to_history_id": history_id_b,
+                "patch": diff_versions(versions[history_id_a], versions[history_id_b]),
+            }
+            cache.set(cache_key, response_data, timeout=None)
 
-        record_id = self.kwargs['pk']
-        history_id = self.kwargs['history_id']
+        return Response(response_data, status=status.HTTP_200_OK)
 
-        try:
-            record = MedicalRecord.objects.get(pk=record_id)
-            return record.history.get(history_id=history_id)
-        except (MedicalRecord.DoesNotExist, MedicalRecord.history.model.DoesNotExist):
-            raise NotFound(f"Version with history_id {history_id} for MedicalRecord with id {record_id} not found.")
 
 class RequestPermissionView(generics.CreateAPIView):
     """
     API View for doctors to request permission from patients to modify a specific medical record.
     """
     serializer_class = PermissionRequestSerializer
+    authentication_classes = [SessionAuthentication, CachedTokenAuthentication, JWTStatelessUserAuthentication]
     permission_classes = [IsAuthenticated]
 
     def create(self, request, *args, **kwargs):
         user = request.user
 
         # Ensure the requester is a doctor
-        if not hasattr(user, 'doctor_profile'):
+        if not request.roles.is_doctor:
             return Response(
                 {"message": "Only doctors can request permission to modify medical records."},
                 status=status.HTTP_403_FORBIDDEN,
             )
 
-        doctor = user  # User instance representing the doctor
+        doctor = user_reference(user)  # User instance representing the doctor
         patient_email = request.data.get("patient_email")
         medical_record_id = request.data.get("medical_record_id")
 
@@ -302,6 +488,9 @@ class RequestPermissionView(generics.CreateAPIView):
             status="pending",
             request_date=timezone.now(),
         )
+        notify_users([(patient.user_id, "permission_request.created", permission_request_payload(
+            permission_request.id, medical_record.id, doctor.id, patient.user_id, permission_request.status,
+        ))])
 
         # Serialize and return the created permission request
         serializer = self.get_serializer(permission_request)
@@ -309,10 +498,122 @@ class RequestPermissionView(generics.CreateAPIView):
 
 
 
+class BulkRequestPermissionView(APIView):
+    """
+    API View for doctors to request permission for many (patient_email, medical_record_id) pairs at once,
+    e.g. when taking over a ward. Returns one result per requested pair; a pair listed again
+    in the same request is reported as "duplicate".
+    """
+    authentication_classes = [SessionAuthentication, CachedTokenAuthentication, JWTStatelessUserAuthentication]
+    permission_classes = [IsAuthenticated]
+    max_batch_size = 200
+
+    def post(self, request, *args, **kwargs):
+        user = request.user
+
+        # Ensure the requester is a doctor
+        if not request.roles.is_doctor:
+            return Response(
+                {"message": "Only doctors can request permission to modify medical records."},
+                status=status.HTTP_403_FORBIDDEN,
+            )
+
+        items = request.data.get("requests")
+        if not isinstance(items, list) or not items:
+            raise ValidationError({"requests": "A non-empty list of {patient_email, medical_record_id} is required."})
+        if len(items) > self.max_batch_size:
+            raise ValidationError({"requests": f"At most {self.max_batch_size} requests can be sent at once."})
+
+        pairs = []
+        for item in items:
+            try:
+                pairs.append((str(item["patient_email"]), int(item["medical_record_id"])))
+            except (KeyError, TypeError, ValueError):
+                pairs.append(None)
+        valid_pairs = [pair for pair in pairs if pair is not None]
+
+        # Resolve every patient and record in one query
+        records = {
+            (record["user__email"], record["id"]): record["user_id"]
+            for record in MedicalRecord.objects.filter(
+                id__in={record_id for _, record_id in valid_pairs},
+                user__email__in={email for email, _ in valid_pairs},
+                user__patient_profile__isnull=False,
+            ).values("id", "user_id", "user__email")
+        }
+        found_record_ids = {record_id for _, record_id in records}
+
+        pending_before = dict(
+            PermissionRequest.objects.filter(
+                doctor_id=user.pk,
+                medical_record_id__in=found_record_ids,
+                status="pending",
+            ).values_list("medical_record_id", "id")
+        )
+
+        now = timezone.now()
+        to_create = {
+            record_id: PermissionRequest(
+                doctor_id=user.pk,
+                patient_id=patient_id,
+                medical_record_id=record_id,
+                status="pending",
+                request_date=now,
+            )
+            for (_, record_id), patient_id in records.items()
+            if record_id not in pending_before
+        }
+        # The partial unique constraint turns concurrent duplicates into no-ops
+        PermissionRequest.objects.bulk_create(to_create.values(), ignore_conflicts=True)
+        pending_after = dict(
+            PermissionRequest.objects.filter(
+                doctor_id=user.pk,
+                medical_record_id__in=to_create.keys(),
+                status="pending",
+            ).values_list("medical_record_id", "id")
+        )
+
+        patient_by_record = {record_id: patient_id for (_, record_id), patient_id in records.items()}
+        notify_users(
+            (patient_by_record[record_id], "permission_request.created", permission_request_payload(
+                permission_request_id, record_id, user.id, patient_by_record[record_id], "pending",
+            ))
+            for record_id, permission_request_id in pending_after.items()
+        )
+
+        results = []
+        seen_pairs = set()
+        for item, pair in zip(items, pairs):
+            if pair is None:
+                results.append({"request": item, "status": "invalid", "message": "patient_email and medical_record_id are required."})
+                continue
+            patient_email, record_id = pair
+            result = {"patient_email": patient_email, "medical_record_id": record_id}
+            if pair in seen_pairs:
+                result.update(status="duplicate", message="This pair is already listed earlier in the request.")
+            elif pair not in records:
+                result.update(status="not_found", message="Medical record not found for this patient.")
+            elif record_id in pending_before:
+                result.update(status="already_pending", permission_request_id=pending_before[record_id])
+            else:
+                result.update(status="created", permission_request_id=pending_after.get(record_id))
+            seen_pairs.add(pair)
+            results.append(result)
+
+        return Response(
+            {
+                "message": f"Created {len(to_create)} permission request(s).",
+                "results": results,
+            },
+            status=status.HTTP_200_OK,
+        )
+
+
 class RespondToPermissionRequestView(APIView):
     """
     API View for patients to approve or deny access requests for a specific doctor.
     """
+    authentication_classes = [SessionAuthentication, CachedTokenAuthentication, JWTStatelessUserAuthentication]
     permission_classes = [IsAuthenticated]
 
     @transaction.atomic  # Ensures atomicity of the operation
@@ -334,14 +635,14 @@ class RespondToPermissionRequestView(APIView):
         user = request.user
 
         # Ensure the requester is a patient
-        if not hasattr(user, 'patient_profile'):
+        if not request.roles.is_patient:
             raise PermissionDenied("You don't have permission to respond to permission requests.")
 
         # Retrieve the specific permission request
         try:
             permission_request = PermissionRequest.objects.select_related('doctor', 'medical_record').get(
                 id=permission_request_id,
-                patient=user  # Ensure the patient matches the current user
+                patient_id=user.pk  # Ensure the patient matches the current user
             )
         except PermissionRequest.DoesNotExist:
             raise NotFound("Permission request not found.")
@@ -352,7 +653,20 @@ class RespondToPermissionRequestView(APIView):
         permission_request.status = status_value
         permission_request.response_date = timezone.now()
         permission_request.edit_permission = (status_value == "approved")
+        permission_request.expiration_time = (
+            PermissionRequest.grant_expiration_time(permission_request.response_date)
+            if status_value == "approved" else None
+        )
         permission_request.save()
+        invalidate_grants([(permission_request.doctor_id, permission_request.medical_record_id)])
+        record_event(
+            permission_request.medical_record_id, user.id, f"permission_request.{status_value}",
+            permission_request_id=permission_request.id, doctor_id=permission_request.doctor_id,
+        )
+        notify_users([(permission_request.doctor_id, f"permission_request.{status_value}", permission_request_payload(
+            permission_request.id, permission_request.medical_record_id, permission_request.doctor_id, user.id,
+            status_value, permission_request.edit_permission, permission_request.expiration_time,
+        ))])
 
         # Serialize and return the updated permission request
         response_data = {
@@ -361,26 +675,126 @@ class RespondToPermissionRequestView(APIView):
             "status": permission_request.status,
             "medical_record_id": permission_request.medical_record.id,
             "edit_permission": permission_request.edit_permission,
+            "expiration_time": permission_request.expiration_time,
         }
         return Response(response_data, status=status.HTTP_200_OK)
     
     
+class BulkRespondToPermissionRequestView(APIView):
+    """
+    API View for patients to approve or deny many permission requests in a single transaction.
+    Returns one result per decision, in order; malformed decisions are reported as "invalid"
+    and a batch deciding the same request twice is rejected.
+    """
+    authentication_classes = [SessionAuthentication, CachedTokenAuthentication, JWTStatelessUserAuthentication]
+    permission_classes = [IsAuthenticated]
+    max_batch_size = 200
+
+    @transaction.atomic
+    def put(self, request, *args, **kwargs):
+        serializer = BulkPermissionDecisionSerializer(data=request.data, context={"max_batch_size": self.max_batch_size})
+        serializer.is_valid(raise_exception=True)
+        entries = serializer.validated_data["decisions"]
+
+        user = request.user
+
+        # Ensure the requester is a patient
+        if not request.roles.is_patient:
+            raise PermissionDenied("You don't have permission to respond to permission requests.")
+
+        status_by_id = {
+            entry.validated_data["permission_request_id"]: entry.validated_data["status"]
+            for entry in entries if not entry.errors
+        }
+
+        # Lock the requests addressed to this patient; anything else is reported as not found
+        owned = {
+            permission_request_id: (doctor_id, medical_record_id)
+            for permission_request_id, doctor_id, medical_record_id in PermissionRequest.objects.select_for_update().filter(
+                id__in=status_by_id.keys(),
+                patient_id=user.pk,  # Ensure the patient matches the current user
+            ).values_list("id", "doctor_id", "medical_record_id")
+        }
+
+        now = timezone.now()
+        for status_value in ["approved", "denied"]:
+            ids = [
+                permission_request_id for permission_request_id, value in status_by_id.items()
+                if value == status_value and permission_request_id in owned
+            ]
+            if ids:
+                PermissionRequest.objects.filter(id__in=ids).update(
+                    status=status_value,
+                    response_date=now,
+                    edit_permission=(status_value == "approved"),
+                    expiration_time=PermissionRequest.grant_expiration_time(now) if status_value == "approved" else None,
+                )
+        invalidate_grants(owned.values())
+        record_events([
+            make_event(
+                owned[permission_request_id][1], user.id, f"permission_request.{status_value}",
+                permission_request_id=permission_request_id, doctor_id=owned[permission_request_id][0],
+            )
+            for permission_request_id, status_value in status_by_id.items()
+            if permission_request_id in owned
+        ])
+        notify_users(
+            (owned[permission_request_id][0], f"permission_request.{status_value}", permission_request_payload(
+                permission_request_id, owned[permission_request_id][1], owned[permission_request_id][0], user.id,
+                status_value, status_value == "approved",
+                PermissionRequest.grant_expiration_time(now) if status_value == "approved" else None,
+            ))
+            for permission_request_id, status_value in status_by_id.items()
+            if permission_request_id in owned
+        )
+
+        # One result per decision sent, in order
+        results = []
+        for entry in entries:
+            if entry.errors:
+                results.append({
+                    "id": entry.initial_data.get("permission_request_id") if isinstance(entry.initial_data, dict) else None,
+                    "status": "invalid",
+                    "errors": entry.errors,
+                })
+                continue
+            permission_request_id = entry.validated_data["permission_request_id"]
+            status_value = entry.validated_data["status"]
+            if permission_request_id not in owned:
+                results.append({"id": permission_request_id, "status": "not_found"})
+                continue
+            doctor_id, medical_record_id = owned[permission_request_id]
+            results.append({
+                "id": permission_request_id,
+                "status": status_value,
+                "medical_record_id": medical_record_id,
+                "edit_permission": status_value == "approved",
+                "expiration_time": PermissionRequest.grant_expiration_time(now) if status_value == "approved" else None,
+            })
+
+        return Response({"results": results}, status=status.HTTP_200_OK)
+
+
 class DeletePermissionRequestsToPatientView(APIView):
     """
     API View to delete all permission requests made to a specific patient.
     """
+    authentication_classes = [SessionAuthentication, CachedTokenAuthentication, JWTStatelessUserAuthentication]
     permission_classes = [IsAuthenticated]
 
     def delete(self, request, *args, **kwargs):
         # Ensure the user is a patient
-        if not hasattr(request.user, 'patient_profile'):
+        if not request.roles.is_patient:
             return Response(
                 {"message": "You do not have permission to perform this action."},
                 status=status.HTTP_403_FORBIDDEN,
             )
 
         # Get all permission requests associated with the patient
-        deleted_count, _ = PermissionRequest.objects.filter(patient=request.user).delete()
+        permission_requests = PermissionRequest.objects.filter(patient_id=request.user.pk)
+        with transaction.atomic():
+            invalidate_grants(permission_requests.values_list('doctor_id', 'medical_record_id').distinct())
+            deleted_count, _ = permission_requests.delete()
 
         # Respond with the number of deleted permission requests
         return Response(
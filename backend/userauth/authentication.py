@@ -0,0 +1,266 @@
+"""
+Token authentication without a database query per request.
+
+Token keys resolve to users through a per-process LRU in front of the shared cache, in two
+steps: token key -> user id, and user id -> the plain field values of the user and of its
+roles, from which a fresh User is built for every request. The password hash is never
+cached. Deleting a token drops the first entry and saving or deleting a user drops the
+second (see signals.py), so deactivation takes effect in every process once its short-lived
+LRU entries expire.
+
+Those drops only reach the shared cache if every process uses the same one, so the shared
+tier is skipped when TOKEN_AUTH_CACHE_TIMEOUT is 0, the default without memcached.
+"""
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user
+from django.core.cache import cache
+from django.db.models.fields.files import FieldFile
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import AuthenticationFailed, NotAuthenticated
+from rest_framework_simplejwt.authentication import JWTStatelessUserAuthentication
+from rest_framework_simplejwt.models import TokenUser
+
+from backend.lru import LRUCache
+
+from .models import Hospital, User
+from .roles import ROLE_RELATED, RoleContext, get_role_context
+
+_local = LRUCache(
+    getattr(settings, 'TOKEN_AUTH_LRU_SIZE', 10000),
+    ttl=getattr(settings, 'TOKEN_AUTH_LRU_TTL', 30),
+)
+
+
+def token_cache_timeout():
+    return getattr(settings, 'TOKEN_AUTH_CACHE_TIMEOUT', 0)
+
+
+def token_cache_key(key):
+    return f"auth:token:{key}"
+
+
+def user_cache_key(user_id):
+    return f"auth:user:{user_id}"
+
+
+def _get(key):
+    value = _local.get(key)
+    if value is None and token_cache_timeout():
+        value = cache.get(key)
+        if value is not None:
+            _local.set(key, value)
+    return value
+
+
+def _set(key, value):
+    _local.set(key, value)
+    if token_cache_timeout():
+        cache.set(key, value, timeout=token_cache_timeout())
+
+
+def token_user_related():
+    # Users are cached with their profiles, so that their roles need no query either
+    return ['user'] + [f'user__{related}' for related in ROLE_RELATED]
+
+
+def _field_values(instance, exclude=()):
+    values = {}
+    for field in instance._meta.concrete_fields:
+        if field.attname not in exclude:
+            value = getattr(instance, field.attname)
+            # A FieldFile refers back to its instance, so only its name is kept
+            values[field.attname] = value.name if isinstance(value, FieldFile) else value
+    return values
+
+
+def _from_values(model, db, values):
+    # Fields missing from `values` are deferred and loaded again if ever read
+    return model.from_db(db, list(values), list(values.values()))
+
+
+def cacheable_user(user):
+    """
+    Plain values from which `build_user` rebuilds `user` and its RoleContext without a query.
+    They hold no model instance, so nothing reachable from them carries the password hash,
+    which has no business in a shared cache. `user` must have its ROLE_RELATED profiles loaded.
+    """
+    roles = get_role_context(user)
+    hospital = roles.hospital
+    return {
+        'db': user._state.db,
+        'user': _field_values(user, exclude=('password',)),
+        'roles': (roles.doctor_id, roles.patient_id, roles.hospital_id),
+        'hospital': _field_values(hospital) if hospital is not None else None,
+    }
+
+
+def build_user(values):
+    """
+    A new User from `cacheable_user` values, so request handlers never share one instance.
+    Its password is deferred: save() leaves it alone and reading it queries the database.
+    """
+    user = _from_values(User, values['db'], values['user'])
+    hospital = values['hospital'] and _from_values(Hospital, values['db'], values['hospital'])
+    user._role_context = RoleContext(*values['roles'], hospital=hospital)
+    return user
+
+
+def get_token_user(key):
+    """
+    Return the user owning the token `key`, raising Token.DoesNotExist for unknown keys.
+    """
+    user_id = _get(token_cache_key(key))
+    values = _get(user_cache_key(user_id)) if user_id is not None else None
+    if values is None:
+        token = Token.objects.select_related(*token_user_related()).get(key=key)
+        values = cacheable_user(token.user)
+        _set(token_cache_key(key), token.user_id)
+        _set(user_cache_key(token.user_id), values)
+    return build_user(values)
+
+
+async def _aget(key):
+    value = _local.get(key)
+    if value is None and token_cache_timeout():
+        value = await cache.aget(key)
+        if value is not None:
+            _local.set(key, value)
+    return value
+
+
+async def _aset(key, value):
+    _local.set(key, value)
+    if token_cache_timeout():
+        await cache.aset(key, value, timeout=token_cache_timeout())
+
+
+async def aget_token_user(key):
+    user_id = await _aget(token_cache_key(key))
+    values = await _aget(user_cache_key(user_id)) if user_id is not None else None
+    if values is None:
+        token = await Token.objects.select_related(*token_user_related()).aget(key=key)
+        values = cacheable_user(token.user)
+        await _aset(token_cache_key(key), token.user_id)
+        await _aset(user_cache_key(token.user_id), values)
+    return build_user(values)
+
+
+def forget_token(key):
+    _local.delete(token_cache_key(key))
+    cache.delete(token_cache_key(key))
+
+
+def forget_user(user_id):
+    _local.delete(user_cache_key(user_id))
+    cache.delete(user_cache_key(user_id))
+
+
+def role_claims(user):
+    """
+    Claims added to JWTs so that role checks need no query.
+    """
+    roles = get_role_context(user)
+    return {
+        'email': user.email,
+        'first_name': user.first_name or '',
+        'last_name': user.last_name or '',
+        'is_staff': user.is_staff,
+        'is_superuser': user.is_superuser,
+        'is_doctor': roles.is_doctor,
+        'is_patient': roles.is_patient,
+        'doctor_id': roles.doctor_id,
+        'patient_id': roles.patient_id,
+        'hospital_id': roles.hospital_id,
+    }
+
+
+class RoleTokenUser(TokenUser):
+    """
+    Stateless user built from the claims of a JWT issued by RoleTokenObtainPairSerializer.
+    Unlike TokenUser, unknown attributes raise AttributeError instead of returning None, so
+    `hasattr(user, 'doctor_profile')` can never be mistaken for a role.
+    """
+
+    def __getattr__(self, attr):
+        raise AttributeError(attr)
+
+    @property
+    def email(self):
+        return self.token.get('email', '')
+
+    @property
+    def first_name(self):
+        return self.token.get('first_name', '')
+
+    @property
+    def last_name(self):
+        return self.token.get('last_name', '')
+
+    @property
+    def is_doctor(self):
+        return bool(self.token.get('is_doctor', False))
+
+    @property
+    def is_patient(self):
+        return bool(self.token.get('is_patient', False))
+
+    @property
+    def doctor_id(self):
+        return self.token.get('doctor_id')
+
+    @property
+    def patient_id(self):
+        return self.token.get('patient_id')
+
+    @property
+    def hospital_id(self):
+        return self.token.get('hospital_id')
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    Drop-in replacement for TokenAuthentication that resolves token keys from the cache.
+    """
+
+    def authenticate_credentials(self, key):
+        try:
+            user = get_token_user(key)
+        except Token.DoesNotExist:
+            raise AuthenticationFailed('Invalid token.')
+
+        if not user.is_active:
+            raise AuthenticationFailed('User inactive or deleted.')
+
+        return (user, key)
+
+
+async def aauthenticate(request):
+    """
+    Async counterpart of CachedTokenAuthentication, JWTStatelessUserAuthentication and
+    SessionAuthentication, for views served natively under ASGI. Returns the active user or
+    raises like DRF would.
+    """
+    keyword, _, key = request.headers.get('Authorization', '').partition(' ')
+    if keyword.lower() == 'token':
+        key = key.strip()
+        if not key or ' ' in key:
+            raise AuthenticationFailed('Invalid token header.')
+        try:
+            user = await aget_token_user(key)
+        except Token.DoesNotExist:
+            raise AuthenticationFailed('Invalid token.')
+        if not user.is_active:
+            raise AuthenticationFailed('User inactive or deleted.')
+        return user
+
+    if keyword.lower() == 'bearer':
+        # Stateless: validating the signature and building the user from claims needs no query
+        authentication = JWTStatelessUserAuthentication()
+        return authentication.get_user(authentication.get_validated_token(key.strip().encode()))
+
+    user = await sync_to_async(get_user)(request)
+    if not user.is_authenticated:
+        raise NotAuthenticated()
+    return user
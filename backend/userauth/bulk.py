@@ -0,0 +1,219 @@
+"""
+Bulk registration, for onboarding the staff or patients of a hospital at once.
+
+Rows are validated like RegistrationAPIView requests, except for uniqueness: emails and
+usernames are checked against the database with one `IN` query per chunk. Passwords are
+hashed, then users, profiles, OTPs and activation emails are inserted with bulk_create, one
+transaction per chunk.
+
+Hashing dominates (about a quarter of a second per password), so it never runs in a web
+request: the API stores each chunk as an encrypted BulkRegistrationChunk, queues one
+`register_users_chunk_task` per chunk with only its id, so no password reaches the broker,
+and reports through a BulkRegistrationJob, each task hashing serially. Only the
+register_users management command hashes across a process pool, which must not be forked
+from threaded web workers.
+"""
+import base64
+import csv
+import io
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from cryptography.fernet import Fernet
+from django.apps import apps
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.db import IntegrityError, transaction
+from django.utils.crypto import salted_hmac
+
+from .emails import activation_email, queue_emails
+from .models import Doctor, Patient, User
+from .otp import get_otp_store
+from .serializers import BulkRegistrationSerializer
+
+
+class BulkRegistrationError(ValueError):
+    pass
+
+
+def parse_csv(text):
+    """
+    Rows of a CSV document whose header names the registration fields.
+    """
+    return [dict(row) for row in csv.DictReader(io.StringIO(text))]
+
+
+def parse_ndjson(text):
+    """
+    Rows of a newline-delimited JSON document, one object per line.
+    """
+    rows = []
+    for number, line in enumerate(text.splitlines(), start=1):
+        if not line.strip():
+            continue
+        try:
+            rows.append(json.loads(line))
+        except ValueError:
+            raise BulkRegistrationError(f"Line {number} is not valid JSON.")
+    return rows
+
+
+def _fernet():
+    key = salted_hmac('userauth.bulk.rows', 'fernet', algorithm='sha256').digest()
+    return Fernet(base64.urlsafe_b64encode(key))
+
+
+def seal_rows(pending):
+    """
+    Encrypt (row index, validated data) pairs, passwords included, with a key derived from
+    SECRET_KEY.
+    """
+    return _fernet().encrypt(json.dumps(pending).encode()).decode()
+
+
+def open_rows(token):
+    return [(index, data) for index, data in json.loads(_fernet().decrypt(token.encode()))]
+
+
+def chunked(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def _init_hasher(settings_module):
+    # Spawned workers start without Django; forked ones inherit it
+    if not apps.ready:
+        os.environ.setdefault('DJANGO_SETTINGS_MODULE', settings_module)
+        django.setup()
+
+
+def hash_passwords(passwords, workers=None):
+    """
+    make_password() for each password, spread over `workers` processes when more than one is
+    given. Small batches are hashed in this process, where starting a pool would cost more
+    than it saves.
+    """
+    if not workers or workers <= 1 or len(passwords) < 2 * workers:
+        return [make_password(password) for password in passwords]
+    with ProcessPoolExecutor(
+        max_workers=workers, initializer=_init_hasher, initargs=(os.environ.get('DJANGO_SETTINGS_MODULE'),),
+    ) as executor:
+        return list(executor.map(make_password, passwords, chunksize=max(1, len(passwords) // (workers * 4))))
+
+
+def existing_values(field, values, chunk_size):
+    existing = set()
+    for chunk in chunked(list(values), chunk_size):
+        existing.update(User.objects.filter(**{f'{field}__in': chunk}).values_list(field, flat=True))
+    return existing
+
+
+def validate_rows(rows):
+    """
+    Validate the rows of an upload without touching the database. Returns one result per
+    row, in order, {"row", "email", "status"} with status "invalid" (with "errors"),
+    "duplicate" when the email or username repeats an earlier row, or "pending", and the
+    (row index, validated data) of the pending rows.
+    """
+    results = []
+    pending = []
+    emails = set()
+    usernames = set()
+    for index, row in enumerate(rows):
+        serializer = BulkRegistrationSerializer(data=row)
+        if not serializer.is_valid():
+            email = row.get("email") if isinstance(row, dict) else None
+            results.append({"row": index, "email": email, "status": "invalid", "errors": serializer.errors})
+            continue
+        data = dict(serializer.validated_data)
+        data.pop('confirm_password', None)
+        data['email'] = User.objects.normalize_email(data['email'])
+        data['username'] = data.get('username') or None  # Blank CSV cells would collide
+        if data['email'] in emails or (data['username'] and data['username'] in usernames):
+            results.append({"row": index, "email": data['email'], "status": "duplicate"})
+            continue
+        emails.add(data['email'])
+        if data['username']:
+            usernames.add(data['username'])
+        results.append({"row": index, "email": data['email'], "status": "pending"})
+        pending.append((index, data))
+    return results, pending
+
+
+def create_users(pending, hospital=None, send_emails=True, chunk_size=None, workers=None):
+    """
+    Register the validated rows of `validate_rows`, giving doctors `hospital`. Returns the
+    status of each row by index: "created", or "duplicate" when the email or username is
+    already taken.
+    """
+    chunk_size = chunk_size or settings.BULK_REGISTRATION_CHUNK_SIZE
+    statuses = {}
+
+    # Uniqueness against the database, with IN queries
+    taken_emails = existing_values('email', {data['email'] for _, data in pending}, chunk_size)
+    taken_usernames = existing_values('username', {data['username'] for _, data in pending} - {None}, chunk_size)
+    to_create = []
+    for index, data in pending:
+        if data['email'] in taken_emails or (data['username'] and data['username'] in taken_usernames):
+            statuses[index] = "duplicate"
+        else:
+            to_create.append((index, data))
+
+    hashes = hash_passwords([data['password'] for _, data in to_create], workers)
+
+    for chunk in chunked(list(zip(to_create, hashes)), chunk_size):
+        users = [
+            User(
+                email=data['email'],
+                username=data['username'],
+                first_name=data.get('first_name'),
+                last_name=data.get('last_name'),
+                is_doctor=data.get('is_doctor', False),
+                is_patient=data.get('is_patient', False),
+                password=password,
+            )
+            for (_, data), password in chunk
+        ]
+        try:
+            created = create_chunk(users, hospital, send_emails)
+        except IntegrityError:
+            # Registered concurrently since the uniqueness check: create the others one by one
+            created = []
+            for user in users:
+                try:
+                    created.extend(create_chunk([user], hospital, send_emails))
+                except IntegrityError:
+                    pass
+        created_emails = {user.email for user in created}
+        for (index, data), _ in chunk:
+            statuses[index] = "created" if data['email'] in created_emails else "duplicate"
+    return statuses
+
+
+def register_users(rows, hospital=None, send_emails=True, chunk_size=None, workers=None):
+    """
+    Validate and register the users described by `rows` in this process. Returns one result
+    per row, in order, as `validate_rows` does, with "created" or "duplicate" in place of
+    "pending".
+    """
+    results, pending = validate_rows(rows)
+    statuses = create_users(pending, hospital, send_emails, chunk_size, workers)
+    for index, row_status in statuses.items():
+        results[index]["status"] = row_status
+    return results
+
+
+def create_chunk(users, hospital, send_emails):
+    with transaction.atomic():
+        users = User.objects.bulk_create(users)
+        # Doctors take precedence, as in RegistrationSerializer
+        Doctor.objects.bulk_create([Doctor(user=user, hospital=hospital) for user in users if user.is_doctor])
+        Patient.objects.bulk_create([
+            Patient(user=user) for user in users if user.is_patient and not user.is_doctor
+        ])
+        if send_emails:
+            otps = get_otp_store().issue_many(users)
+            queue_emails([activation_email(user, otp) for user, otp in zip(users, otps)])
+    return users
@@ -0,0 +1,141 @@
+"""
+Email outbox.
+
+Messages are queued as OutgoingEmail rows and sent by `send_queued_emails_task`, which drains
+them in batches over one SMTP connection per batch. A failed batch is retried as a whole with
+backoff, so a message may exceptionally be sent twice. At most EMAIL_OUTBOX_CONCURRENCY drain
+tasks send at the same time.
+"""
+import logging
+import random
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.utils import timezone
+
+from .models import OutgoingEmail
+
+ACTIVATION_FROM_EMAIL = "your_email@example.com"  # Replace with your actual sender email
+KICK_KEY = "email-outbox:kick"
+
+logger = logging.getLogger(__name__)
+
+
+def make_email(subject, body, to, from_email=None):
+    return OutgoingEmail(
+        subject=subject,
+        body=body,
+        from_email=from_email or settings.DEFAULT_FROM_EMAIL,
+        to=list(to),
+    )
+
+
+def activation_email(user, activation_code):
+    message = f"Hello {user.username},\n\nPlease use the following code to activate your account: {activation_code}"
+    return make_email("Activate your account", message, [user.email], from_email=ACTIVATION_FROM_EMAIL)
+
+
+def queue_emails(emails):
+    """
+    Save the OutgoingEmail instances and have them sent once the transaction commits.
+    """
+    OutgoingEmail.objects.bulk_create(emails)
+    transaction.on_commit(kick_drain)
+
+
+def kick_drain():
+    """
+    Start a drain task unless one is already scheduled and has not started yet, so that
+    queuing thousands of emails queues a handful of tasks.
+    """
+    from .tasks import send_queued_emails
+
+    if cache.add(KICK_KEY, True, timeout=settings.EMAIL_OUTBOX_KICK_TIMEOUT):
+        send_queued_emails.delay()
+
+
+def drain_started():
+    # Emails queued from now on may be missed by the starting drain, so they kick a new one
+    cache.delete(KICK_KEY)
+
+
+def acquire_drain_slot():
+    """
+    Take one of the EMAIL_OUTBOX_CONCURRENCY sending slots, returning its key, or None when
+    all are taken. Slots expire on their own should a worker die while holding one.
+    """
+    for slot in range(settings.EMAIL_OUTBOX_CONCURRENCY):
+        key = f"email-outbox:slot:{slot}"
+        if cache.add(key, True, timeout=settings.EMAIL_OUTBOX_SLOT_TIMEOUT):
+            return key
+    return None
+
+
+def release_drain_slot(key):
+    cache.delete(key)
+
+
+def to_message(email, connection):
+    return EmailMessage(email.subject, email.body, email.from_email, email.to, connection=connection)
+
+
+def retry_delay(attempts):
+    """
+    Exponential backoff with jitter after the given number of failed attempts.
+    """
+    base = settings.EMAIL_OUTBOX_RETRY_BASE_SECONDS * 2 ** (attempts - 1)
+    delay = min(base, settings.EMAIL_OUTBOX_RETRY_MAX_SECONDS)
+    return timedelta(seconds=delay * random.uniform(0.5, 1.0))
+
+
+def send_due_emails(emails, batch_size):
+    """
+    Send the pending emails of the `emails` queryset that are due, in batches, one SMTP
+    connection and one send_messages() call per batch. A failed batch is retried with
+    exponential backoff until EMAIL_OUTBOX_MAX_ATTEMPTS is reached. Each batch is leased by
+    pushing its next attempt back, so concurrent workers never send the same email twice.
+    Returns the number sent.
+    """
+    sent = 0
+    while True:
+        now = timezone.now()
+        with transaction.atomic():
+            batch = list(
+                emails.select_for_update(skip_locked=True)
+                .filter(status="pending", next_attempt_at__lte=now)
+                .order_by("next_attempt_at", "id")[:batch_size]
+            )
+            if not batch:
+                break
+            OutgoingEmail.objects.filter(id__in=[email.id for email in batch]).update(
+                next_attempt_at=now + timedelta(seconds=settings.EMAIL_OUTBOX_SLOT_TIMEOUT)
+            )
+
+        try:
+            with get_connection(fail_silently=False) as connection:
+                connection.send_messages([to_message(email, connection) for email in batch])
+            error = ""
+        except Exception as e:
+            error = str(e) or e.__class__.__name__
+
+        now = timezone.now()
+        for email in batch:
+            email.attempts += 1
+            email.last_error = error[:1000]
+            if not error:
+                email.status = "sent"
+                email.sent_at = now
+            elif email.attempts >= settings.EMAIL_OUTBOX_MAX_ATTEMPTS:
+                email.status = "failed"
+            else:
+                email.next_attempt_at = now + retry_delay(email.attempts)
+        OutgoingEmail.objects.bulk_update(batch, ["status", "attempts", "last_error", "sent_at", "next_attempt_at"])
+
+        if error:
+            logger.warning("Sending a batch of %d email(s) failed: %s", len(batch), error)
+        else:
+            sent += len(batch)
+    return sent
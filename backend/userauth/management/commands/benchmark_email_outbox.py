@@ -0,0 +1,64 @@
+import time
+from uuid import uuid4
+
+from django.conf import settings
+from django.core import mail
+from django.core.mail import send_mail
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+
+from userauth.emails import make_email, send_due_emails
+from userauth.models import OutgoingEmail
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure email throughput in messages per second: sending each message on its own connection "
+        "with send_mail(), as before the outbox, against draining the outbox in batches. Uses Django's "
+        "locmem backend by default; pass --smtp-port to send to a local stub instead, e.g. one started "
+        "with `python -m aiosmtpd -n -l localhost:8025`. Only the messages it queues itself are drained."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=1000)
+        parser.add_argument('--batch-size', type=int, default=settings.EMAIL_OUTBOX_BATCH_SIZE)
+        parser.add_argument('--smtp-host', default='localhost')
+        parser.add_argument('--smtp-port', type=int, help="Port of a local SMTP server; locmem when omitted.")
+
+    def handle(self, *args, **options):
+        if options['smtp_port']:
+            email_settings = {
+                'EMAIL_BACKEND': 'django.core.mail.backends.smtp.EmailBackend',
+                'EMAIL_HOST': options['smtp_host'],
+                'EMAIL_PORT': options['smtp_port'],
+                'EMAIL_HOST_USER': '',
+                'EMAIL_HOST_PASSWORD': '',
+                'EMAIL_USE_TLS': False,
+            }
+        else:
+            email_settings = {'EMAIL_BACKEND': 'django.core.mail.backends.locmem.EmailBackend'}
+
+        count = options['messages']
+        with override_settings(**email_settings):
+            mail.outbox = []
+            started = time.perf_counter()
+            for i in range(count):
+                send_mail("Benchmark", f"Message {i}", settings.DEFAULT_FROM_EMAIL, [f"user{i}@example.com"])
+            self.report("send_mail", count, time.perf_counter() - started)
+
+            # A subject of its own keeps the drain away from the emails the application queued
+            subject = f"Benchmark {uuid4().hex}"
+            OutgoingEmail.objects.bulk_create([
+                make_email(subject, f"Message {i}", [f"user{i}@example.com"]) for i in range(count)
+            ])
+            emails = OutgoingEmail.objects.filter(subject=subject)
+            try:
+                mail.outbox = []
+                started = time.perf_counter()
+                sent = send_due_emails(emails, options['batch_size'])
+                self.report(f"outbox (batches of {options['batch_size']})", sent, time.perf_counter() - started)
+            finally:
+                emails.delete()
+
+    def report(self, name, count, elapsed):
+        self.stdout.write(f"{name:<28} {count:>7} messages {elapsed:>8.2f} s {count / elapsed:>10.1f} msg/s")
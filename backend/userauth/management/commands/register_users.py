@@ -0,0 +1,63 @@
+import sys
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from userauth.bulk import BulkRegistrationError, parse_csv, parse_ndjson, register_users
+from userauth.models import Hospital
+
+
+class Command(BaseCommand):
+    help = (
+        "Register users in bulk from a CSV file with a header row or an NDJSON file, with the fields "
+        "of the registration API (email, username, first_name, last_name, password, is_doctor, is_patient)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="File to read, or '-' for standard input.")
+        parser.add_argument('--format', choices=['csv', 'ndjson'], help="Defaults to the file extension.")
+        parser.add_argument('--hospital-id', type=int, help="Hospital the doctors work at.")
+        parser.add_argument('--no-email', action='store_true', help="Do not queue activation emails.")
+        parser.add_argument('--chunk-size', type=int, help="Rows per IN query and bulk_create transaction.")
+        parser.add_argument('--workers', type=int, help="Processes hashing passwords, BULK_REGISTRATION_HASH_WORKERS by default.")
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format'] or ('ndjson' if path.endswith(('.ndjson', '.jsonl')) else 'csv')
+        try:
+            if path == '-':
+                text = sys.stdin.read()
+            else:
+                with open(path, encoding='utf-8-sig') as source:
+                    text = source.read()
+            rows = parse_ndjson(text) if file_format == 'ndjson' else parse_csv(text)
+        except (OSError, BulkRegistrationError) as e:
+            raise CommandError(str(e))
+
+        hospital = None
+        if options['hospital_id'] is not None:
+            try:
+                hospital = Hospital.objects.get(pk=options['hospital_id'])
+            except Hospital.DoesNotExist:
+                raise CommandError(f"Hospital with id {options['hospital_id']} not found.")
+
+        started = time.perf_counter()
+        results = register_users(
+            rows,
+            hospital=hospital,
+            send_emails=not options['no_email'],
+            chunk_size=options['chunk_size'],
+            workers=options['workers'] or settings.BULK_REGISTRATION_HASH_WORKERS,
+        )
+        elapsed = time.perf_counter() - started
+
+        for result in results:
+            if result['status'] == 'invalid':
+                self.stderr.write(f"Row {result['row'] + 1}: invalid {dict(result['errors'])}")
+            elif result['status'] == 'duplicate':
+                self.stderr.write(f"Row {result['row'] + 1}: {result['email']} is already registered.")
+        created = sum(result['status'] == 'created' for result in results)
+        self.stdout.write(self.style.SUCCESS(
+            f"Registered {created} of {len(results)} user(s) in {elapsed:.1f} s."
+        ))
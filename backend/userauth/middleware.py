@@ -0,0 +1,71 @@
+from urllib.parse import parse_qs
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from channels.middleware import BaseMiddleware
+from django.contrib.auth.models import AnonymousUser
+from django.utils.functional import SimpleLazyObject
+from rest_framework.authtoken.models import Token
+
+from .authentication import aget_token_user
+from .roles import get_role_context
+
+
+async def get_active_token_user(key):
+    try:
+        user = await aget_token_user(key)
+    except Token.DoesNotExist:
+        return AnonymousUser()
+    return user if user.is_active else AnonymousUser()
+
+
+class TokenAuthMiddleware(BaseMiddleware):
+    """
+    Websocket counterpart of DRF's TokenAuthentication. Reads the token from an
+    "Authorization: Token <key>" header or, for browsers that cannot set headers on a
+    websocket, from the `token` query parameter. The scope user is anonymous otherwise.
+    """
+
+    async def __call__(self, scope, receive, send):
+        key = self.get_token_key(scope)
+        user = await get_active_token_user(key) if key else AnonymousUser()
+        return await super().__call__(dict(scope, user=user), receive, send)
+
+    @staticmethod
+    def get_token_key(scope):
+        for name, value in scope.get('headers', []):
+            if name == b'authorization':
+                keyword, _, key = value.decode('latin-1').partition(' ')
+                if keyword.lower() == 'token' and key:
+                    return key.strip()
+        query = parse_qs(scope.get('query_string', b'').decode('latin-1'))
+        return query.get('token', [None])[0]
+
+
+class RoleContextMiddleware:
+    """
+    Sets `request.roles` to the RoleContext of `request.user`, resolved on first use. The
+    REST framework assigns the user it authenticates to the underlying request, so views
+    get the roles of that user. Async views resolve them with `aget_role_context` instead.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        self.attach(request)
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        self.attach(request)
+        return await self.get_response(request)
+
+    @staticmethod
+    def attach(request):
+        request.roles = SimpleLazyObject(lambda: get_role_context(request.user))
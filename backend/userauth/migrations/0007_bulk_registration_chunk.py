@@ -0,0 +1,22 @@
+# Generated by Django 4.2.7 on 2026-10-18 04:52
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('userauth', '0006_bulk_registration_job'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BulkRegistrationChunk',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('rows', models.TextField()),
+                ('job', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chunks', to='userauth.bulkregistrationjob')),
+            ],
+        ),
+    ]
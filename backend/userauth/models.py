@@ -81,5 +81,58 @@ class OTP(models.Model):
     otp = models.CharField(max_length=6, null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True, null=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'otp'], name='otp_user_code_idx'),
+            models.Index(fields=['created_at'], name='otp_created_idx'),  # For purge_expired_otps_task
+        ]
+
     def __str__(self):
         return f"OTP for {self.user.email} - {self.otp}"
+
+
+# Email outbox, drained in batches by send_queued_emails_task
+class OutgoingEmail(models.Model):
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    from_email = models.CharField(max_length=255)
+    to = models.JSONField()  # List of recipient addresses
+    status = models.CharField(max_length=20, choices=[("pending", "Pending"), ("sent", "Sent"), ("failed", "Failed")], default="pending")
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True, default="")
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # Lets the drain task find the emails that are due
+            models.Index(fields=["status", "next_attempt_at"], name="outgoing_email_due_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.subject} to {', '.join(self.to)}"
+
+
+# Bulk registration queued by BulkRegistrationAPIView, one register_users_chunk_task per chunk
+class BulkRegistrationJob(models.Model):
+    created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='bulk_registration_jobs')
+    hospital = models.ForeignKey(Hospital, on_delete=models.SET_NULL, null=True, blank=True)
+    status = models.CharField(max_length=20, choices=[("pending", "Pending"), ("done", "Done")], default="pending")
+    remaining_chunks = models.PositiveIntegerField(default=0)
+    results = models.JSONField(default=list)  # One result per uploaded row, see userauth.bulk
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"Bulk registration {self.pk} ({self.status})"
+
+
+# Validated rows of a BulkRegistrationJob awaiting their register_users_chunk_task. They hold
+# passwords, so they are stored encrypted (see userauth.bulk.seal_rows) and deleted once registered
+class BulkRegistrationChunk(models.Model):
+    job = models.ForeignKey(BulkRegistrationJob, on_delete=models.CASCADE, related_name='chunks')
+    rows = models.TextField()
+
+    def __str__(self):
+        return f"Chunk {self.pk} of bulk registration {self.job_id}"
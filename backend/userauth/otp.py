@@ -0,0 +1,83 @@
+"""
+Storage for the one-time codes sent to activate accounts.
+
+Codes are valid for OTP_TTL_SECONDS. The cache store keeps them as cache entries with that
+timeout, so expiry costs no write; it needs a cache shared by the web and Celery processes.
+The database store keeps OTP rows, checks their age on lookup and relies on
+`purge_expired_otps_task` to delete the expired ones in bulk.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import OTP
+from .utils import token_generator
+
+VALID = "valid"
+EXPIRED = "expired"
+UNKNOWN = "unknown"
+
+
+def otp_ttl():
+    return getattr(settings, 'OTP_TTL_SECONDS', 300)
+
+
+class CacheOTPStore:
+    """
+    Cache entries keyed by user and code. An expired code is gone, so it reads as unknown.
+    """
+
+    @staticmethod
+    def key(user_id, otp):
+        return f"otp:{user_id}:{otp}"
+
+    def issue(self, user):
+        return self.issue_many([user])[0]
+
+    def issue_many(self, users):
+        otps = [token_generator() for _ in users]
+        cache.set_many({self.key(user.pk, otp): True for user, otp in zip(users, otps)}, timeout=otp_ttl())
+        return otps
+
+    def redeem(self, user, otp):
+        # delete() reports whether the entry existed, so of concurrent redeems only one wins
+        if not cache.delete(self.key(user.pk, otp)):
+            return UNKNOWN
+        return VALID
+
+
+class DatabaseOTPStore:
+    """
+    OTP rows, looked up through the (user, otp) index.
+    """
+
+    def issue(self, user):
+        return OTP.objects.create(otp=token_generator(), user=user).otp
+
+    def issue_many(self, users):
+        return [otp.otp for otp in OTP.objects.bulk_create([OTP(otp=token_generator(), user=user) for user in users])]
+
+    def redeem(self, user, otp):
+        otp_instance = OTP.objects.filter(user_id=user.pk, otp=otp).order_by('-created_at').first()
+        # Only the request whose delete removed the row may use it
+        if otp_instance is None or not OTP.objects.filter(pk=otp_instance.pk).delete()[0]:
+            return UNKNOWN
+        cutoff = timezone.now() - timedelta(seconds=otp_ttl())
+        if otp_instance.created_at is None or otp_instance.created_at <= cutoff:
+            return EXPIRED
+        return VALID
+
+    @staticmethod
+    def purge_expired(now=None):
+        cutoff = (now or timezone.now()) - timedelta(seconds=otp_ttl())
+        deleted, _ = OTP.objects.filter(Q(created_at__lte=cutoff) | Q(created_at__isnull=True)).delete()
+        return deleted
+
+
+def get_otp_store():
+    if getattr(settings, 'OTP_STORE', 'database') == 'cache':
+        return CacheOTPStore()
+    return DatabaseOTPStore()
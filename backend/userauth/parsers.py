@@ -0,0 +1,30 @@
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+
+from .bulk import BulkRegistrationError, parse_csv, parse_ndjson
+
+
+class CSVParser(BaseParser):
+    """
+    Parses a CSV document with a header row into a list of dicts.
+    """
+    media_type = 'text/csv'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        try:
+            return parse_csv(stream.read().decode('utf-8-sig'))
+        except UnicodeDecodeError as exc:
+            raise ParseError(f"CSV parse error - {exc}")
+
+
+class NDJSONParser(BaseParser):
+    """
+    Parses newline-delimited JSON into a list of documents.
+    """
+    media_type = 'application/x-ndjson'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        try:
+            return parse_ndjson(stream.read().decode('utf-8'))
+        except (UnicodeDecodeError, BulkRegistrationError) as exc:
+            raise ParseError(f"NDJSON parse error - {exc}")
@@ -0,0 +1,116 @@
+"""
+Role checks that work for database users and for the stateless users built from JWT claims
+(RoleTokenUser).
+
+A user's roles are resolved once into a RoleContext: from the claims for JWT users, from the
+profiles already loaded with the user (token authentication caches users with them), or else
+with one `select_related` query. The context is kept on the user, so every check made while
+handling a request shares it; RoleContextMiddleware exposes it as `request.roles`.
+"""
+from rest_framework_simplejwt.models import TokenUser
+
+from .models import Hospital, User
+
+# Relations to load together with a user so that its roles need no further query
+ROLE_RELATED = ('doctor_profile__hospital', 'patient_profile')
+
+
+class RoleContext:
+    """
+    The roles and profile ids of a user. `hospital` is the doctor's Hospital, or None.
+    """
+
+    def __init__(self, doctor_id=None, patient_id=None, hospital_id=None, hospital=None):
+        self.doctor_id = doctor_id
+        self.patient_id = patient_id
+        self.hospital_id = hospital_id
+        self._hospital = hospital
+
+    @property
+    def is_doctor(self):
+        return self.doctor_id is not None
+
+    @property
+    def is_patient(self):
+        return self.patient_id is not None
+
+    @property
+    def hospital(self):
+        # Claims only carry the hospital id; its name and address are rarely needed
+        if self._hospital is None and self.hospital_id is not None:
+            self._hospital = Hospital.objects.filter(pk=self.hospital_id).first()
+        return self._hospital
+
+    @classmethod
+    def from_claims(cls, user):
+        return cls(user.doctor_id, user.patient_id, user.hospital_id)
+
+    @classmethod
+    def from_user(cls, user):
+        """
+        Build the context of a User whose ROLE_RELATED profiles are loaded.
+        """
+        doctor = getattr(user, 'doctor_profile', None)
+        patient = getattr(user, 'patient_profile', None)
+        return cls(
+            doctor_id=doctor.id if doctor else None,
+            patient_id=patient.id if patient else None,
+            hospital_id=doctor.hospital_id if doctor else None,
+            hospital=doctor.hospital if doctor else None,
+        )
+
+    def __repr__(self):
+        return f"RoleContext(doctor_id={self.doctor_id}, patient_id={self.patient_id}, hospital_id={self.hospital_id})"
+
+
+def profiles_loaded(user):
+    cached = user._state.fields_cache
+    return 'doctor_profile' in cached and 'patient_profile' in cached
+
+
+def get_role_context(user):
+    """
+    The RoleContext of `user`, querying at most once per user instance.
+    """
+    if not user.is_authenticated:
+        return RoleContext()
+    if isinstance(user, TokenUser):
+        return RoleContext.from_claims(user)
+    if getattr(user, '_role_context', None) is None:
+        loaded = user
+        if not profiles_loaded(user):
+            loaded = User.objects.select_related(*ROLE_RELATED).get(pk=user.pk)
+        user._role_context = RoleContext.from_user(loaded)
+    return user._role_context
+
+
+async def aget_role_context(user):
+    if not user.is_authenticated:
+        return RoleContext()
+    if isinstance(user, TokenUser):
+        return RoleContext.from_claims(user)
+    if getattr(user, '_role_context', None) is None:
+        loaded = user
+        if not profiles_loaded(user):
+            loaded = await User.objects.select_related(*ROLE_RELATED).aget(pk=user.pk)
+        user._role_context = RoleContext.from_user(loaded)
+    return user._role_context
+
+
+def is_doctor(user):
+    return get_role_context(user).is_doctor
+
+
+def is_patient(user):
+    return get_role_context(user).is_patient
+
+
+def user_reference(user):
+    """
+    A User instance usable as a foreign key value (e.g. for `history_user`). Claims-based
+    users are turned into an unsaved stand-in that only carries the primary key.
+    """
+    if isinstance(user, TokenUser):
+        return User(pk=user.pk)
+    return user
+
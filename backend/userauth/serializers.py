@@ -1,5 +1,7 @@
 from rest_framework import serializers
-from .models import User, OTP, Doctor, Patient
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
+from .authentication import role_claims
+from .models import BulkRegistrationJob, User, OTP, Doctor, Patient
 
 
 # Registration Serializer
@@ -46,6 +48,51 @@ class RegistrationSerializer(serializers.ModelSerializer):
         return user
 
 
+# Bulk Registration Serializer
+class BulkRegistrationSerializer(RegistrationSerializer):
+    """
+    One row of a bulk registration. Uniqueness is checked for all rows at once by
+    userauth.bulk, so the per-row queries are skipped; `confirm_password` is optional.
+    """
+    confirm_password = serializers.CharField(min_length=8, write_only=True, required=False)
+
+    class Meta(RegistrationSerializer.Meta):
+        extra_kwargs = {
+            'password': {'write_only': True},
+            'email': {'validators': [], 'required': True, 'allow_blank': False},
+            'username': {'validators': []},
+        }
+
+    def validate_username(self, value):
+        return value
+
+    def validate_email(self, value):
+        return value
+
+    def validate(self, data):
+        data.setdefault('confirm_password', data.get('password'))
+        return super().validate(data)
+
+
+class BulkRegistrationJobSerializer(serializers.ModelSerializer):
+    """
+    Progress of a bulk registration: `counts` tallies the row statuses, of which "pending"
+    rows are still being registered.
+    """
+    counts = serializers.SerializerMethodField()
+
+    class Meta:
+        model = BulkRegistrationJob
+        fields = ['id', 'status', 'hospital', 'counts', 'results', 'created_at', 'finished_at']
+        read_only_fields = fields
+
+    def get_counts(self, job):
+        counts = {}
+        for result in job.results:
+            counts[result["status"]] = counts.get(result["status"], 0) + 1
+        return counts
+
+
 # Login Serializer
 class LoginSerializer(serializers.Serializer):
     email = serializers.EmailField()
@@ -82,3 +129,18 @@ class PatientProfileSerializer(serializers.ModelSerializer):
     class Meta:
         model = Patient
         fields = ['medical_history', 'allergies', 'blood_group']
+
+
+# JWT Serializer
+class RoleTokenObtainPairSerializer(TokenObtainPairSerializer):
+    """
+    Issues JWTs whose claims carry the user's roles and profile ids, so that
+    RoleTokenUser can answer role checks without a query.
+    """
+
+    @classmethod
+    def get_token(cls, user):
+        token = super().get_token(user)
+        for claim, value in role_claims(user).items():
+            token[claim] = value
+        return token
@@ -0,0 +1,48 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from .authentication import forget_token, forget_user
+from .models import Doctor, Hospital, Patient, User
+
+
+def forget_user_now_and_on_commit(user_id):
+    forget_user(user_id)
+    # Again after commit, in case a concurrent request cached the old row meanwhile
+    transaction.on_commit(lambda: forget_user(user_id))
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def forget_cached_user(sender, instance, **kwargs):
+    """
+    Any change to a user, `is_active` included, must be seen by token authentication.
+    """
+    forget_user_now_and_on_commit(instance.pk)
+
+
+@receiver(post_save, sender=Doctor)
+@receiver(post_delete, sender=Doctor)
+@receiver(post_save, sender=Patient)
+@receiver(post_delete, sender=Patient)
+def forget_cached_profile_user(sender, instance, **kwargs):
+    """
+    Cached users carry their profiles, from which their roles are resolved.
+    """
+    forget_user_now_and_on_commit(instance.user_id)
+
+
+@receiver(post_save, sender=Hospital)
+@receiver(pre_delete, sender=Hospital)
+def forget_cached_hospital_doctors(sender, instance, **kwargs):
+    for user_id in Doctor.objects.filter(hospital=instance).values_list('user_id', flat=True):
+        forget_user_now_and_on_commit(user_id)
+
+
+@receiver(post_save, sender=Token)
+@receiver(post_delete, sender=Token)
+def forget_cached_token(sender, instance, **kwargs):
+    key = instance.key
+    forget_token(key)
+    transaction.on_commit(lambda: forget_token(key))
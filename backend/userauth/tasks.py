@@ -1,26 +1,89 @@
+import logging
+
 from celery import shared_task
-from django.core.mail import send_mail
-from .models import User, OTP
-from .utils import token_generator
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from .bulk import create_users, open_rows
+from .emails import (
+    acquire_drain_slot,
+    activation_email,
+    drain_started,
+    queue_emails,
+    release_drain_slot,
+    send_due_emails,
+)
+from .models import BulkRegistrationChunk, BulkRegistrationJob, OutgoingEmail, User
+from .otp import DatabaseOTPStore, get_otp_store
+
+logger = logging.getLogger(__name__)
 
 @shared_task(serializer='json', name="send_activation_email_task")
 def send_activation_email(user_id):
     try:
         user = User.objects.get(id=user_id)
-        activation_code = token_generator()
-        otp = OTP.objects.create(otp=activation_code, user=user)
-        
-        message = f"Hello {user.username},\n\nPlease use the following code to activate your account: {activation_code}"
-
-        send_mail(
-            subject="Activate your account",
-            message=message,
-            from_email="your_email@example.com",  # Replace with your actual sender email
-            recipient_list=[user.email],
-            fail_silently=False,
-        )
+        activation_code = get_otp_store().issue(user)
+
+        # Sent in a batch by send_queued_emails_task
+        queue_emails([activation_email(user, activation_code)])
     except User.DoesNotExist:
         # Log an error message or handle the exception as needed
         print("User not found.")
         # Optionally, return something or log the error
         return "User not found."
+
+
+@shared_task(serializer='json', name="purge_expired_otps_task")
+def purge_expired_otps():
+    """
+    Bulk-delete the OTP rows older than OTP_TTL_SECONDS. Returns the number of rows deleted.
+    """
+    return DatabaseOTPStore.purge_expired()
+
+
+@shared_task(serializer='json', name="send_queued_emails_task")
+def send_queued_emails(batch_size=None):
+    """
+    Send the due OutgoingEmails with `send_due_emails`, holding one of the
+    EMAIL_OUTBOX_CONCURRENCY sending slots. Returns the number sent.
+    """
+    drain_started()
+    slot = acquire_drain_slot()
+    if slot is None:
+        logger.info("All %d email outbox slot(s) are busy.", settings.EMAIL_OUTBOX_CONCURRENCY)
+        return 0
+
+    try:
+        sent = send_due_emails(OutgoingEmail.objects.all(), batch_size or settings.EMAIL_OUTBOX_BATCH_SIZE)
+    finally:
+        release_drain_slot(slot)
+
+    logger.info("Sent %d queued email(s).", sent)
+    return sent
+
+
+@shared_task(serializer='json', name="register_users_chunk_task")
+def register_users_chunk(chunk_id):
+    """
+    Register the rows of one BulkRegistrationChunk, hashing their passwords serially; chunks
+    are spread over the workers. The chunk is deleted as its results are recorded, and the job
+    is done once its last chunk has recorded them.
+    """
+    chunk = BulkRegistrationChunk.objects.select_related('job__hospital').filter(pk=chunk_id).first()
+    if chunk is None:
+        # Already registered by an earlier delivery of this task
+        return 0
+    statuses = create_users(open_rows(chunk.rows), hospital=chunk.job.hospital, workers=1)
+
+    with transaction.atomic():
+        job = BulkRegistrationJob.objects.select_for_update().get(pk=chunk.job_id)
+        if not BulkRegistrationChunk.objects.filter(pk=chunk_id).delete()[0]:
+            return 0
+        for index, row_status in statuses.items():
+            job.results[index]["status"] = row_status
+        job.remaining_chunks -= 1
+        if job.remaining_chunks == 0:
+            job.status = "done"
+            job.finished_at = timezone.now()
+        job.save(update_fields=["results", "remaining_chunks", "status", "finished_at"])
+    return len(statuses)
@@ -1,3 +1,333 @@
-from django.test import TestCase
+import pickle
+from io import StringIO
+from smtplib import SMTPException
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.core import mail
+from django.core.cache import cache
+from django.core.mail import get_connection
+from django.core.mail.backends import locmem
+from django.core.management import call_command
+from django.db.models import QuerySet
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from . import authentication
+from .bulk import open_rows, register_users
+from .emails import acquire_drain_slot, make_email, queue_emails, release_drain_slot
+from .models import OTP, BulkRegistrationChunk, Doctor, Hospital, OutgoingEmail, Patient, User
+from .otp import UNKNOWN, VALID, CacheOTPStore, DatabaseOTPStore
+from .tasks import purge_expired_otps, register_users_chunk, send_activation_email, send_queued_emails
+
+
+class UserAuthTestCase(TestCase):
+    """
+    Clears the caches authentication reads through, which outlive a test's transaction.
+    """
+
+    def setUp(self):
+        cache.clear()
+        authentication._local.clear()
+
+    def create_patient(self, email, password=None):
+        user = User.objects.create_user(email=email, username=email, password=password, is_patient=True)
+        Patient.objects.create(user=user)
+        return user
+
+    def create_doctor(self, email, password=None):
+        user = User.objects.create_user(email=email, username=email, password=password, is_doctor=True)
+        Doctor.objects.create(user=user, hospital=Hospital.objects.create(name="Hospital", address="Address"))
+        return user
+
+
+@override_settings(TOKEN_AUTH_CACHE_TIMEOUT=3600)
+class CachedTokenAuthenticationTests(UserAuthTestCase):
+    url = '/api/medical-record/medical-records/changes/'
+
+    def setUp(self):
+        super().setUp()
+        self.user = self.create_patient("patient@example.com", password="password")
+        self.token = Token.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {self.token.key}")
+
+    def test_users_are_resolved_without_queries(self):
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+        # Records and deletions only: no token, user or profile query
+        with self.assertNumQueries(2):
+            self.assertEqual(self.client.get(self.url).status_code, 200)
+        authentication._local.clear()
+        with self.assertNumQueries(2):
+            self.assertEqual(self.client.get(self.url).status_code, 200)
+
+    def test_changes_are_seen_at_once(self):
+        self.client.get(self.url)
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+        self.user.is_active = True
+        self.user.save()
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+        self.token.delete()
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+
+    def test_password_hash_is_not_cached(self):
+        authentication.get_token_user(self.token.key)
+        for entry in (cache.get(authentication.user_cache_key(self.user.pk)),
+                      authentication._local.get(authentication.user_cache_key(self.user.pk))):
+            self.assertNotIn(self.user.password.encode(), pickle.dumps(entry))
+
+        user = authentication.get_token_user(self.token.key)
+        self.assertNotIn('password', user.__dict__)
+        user.first_name = "Changed"
+        user.save()
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.first_name, "Changed")
+        self.assertTrue(self.user.check_password("password"))
+        # Loaded on demand
+        self.assertTrue(user.check_password("password"))
+
+    def test_roles_come_with_the_user(self):
+        doctor = self.create_doctor("doctor@example.com")
+        key = Token.objects.create(user=doctor).key
+        authentication.get_token_user(key)
+        with self.assertNumQueries(0):
+            roles = authentication.get_token_user(key)._role_context
+            self.assertEqual((roles.doctor_id, roles.patient_id), (doctor.doctor_profile.pk, None))
+            self.assertEqual(roles.hospital.name, "Hospital")
+
+
+@override_settings(TOKEN_AUTH_CACHE_TIMEOUT=0)
+class LocalTokenAuthenticationTests(UserAuthTestCase):
+    def test_shared_cache_is_skipped(self):
+        user = self.create_patient("patient@example.com")
+        key = Token.objects.create(user=user).key
+        self.assertEqual(authentication.get_token_user(key), user)
+        self.assertIsNone(cache.get(authentication.token_cache_key(key)))
+        self.assertIsNone(cache.get(authentication.user_cache_key(user.pk)))
+        with self.assertNumQueries(0):
+            authentication.get_token_user(key)
+
+
+class VerifyEmailTests(UserAuthTestCase):
+    url = '/api/auth/user/verify-email/'
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.user = User.objects.create_user(email='user@example.com', username='user', is_active=False)
+
+    def verify(self, otp):
+        return self.client.post(self.url, {'email': self.user.email, 'otp': otp}, format='json')
+
+    def assert_otp_is_used_once(self, store):
+        otp = store.issue(self.user)
+        self.assertEqual(self.verify('ZZZZZZ').status_code, 404)
+
+        self.assertEqual(self.verify(otp).status_code, 200)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.is_active)
+
+        self.assertEqual(self.verify(otp).status_code, 404)
+        self.assertEqual(store.redeem(self.user, otp), UNKNOWN)
+
+    @override_settings(OTP_STORE='database')
+    def test_otp_is_used_once(self):
+        self.assert_otp_is_used_once(DatabaseOTPStore())
+        self.assertFalse(OTP.objects.filter(user=self.user).exists())
+
+    @override_settings(OTP_STORE='cache')
+    def test_otp_is_used_once_with_the_cache_store(self):
+        self.assert_otp_is_used_once(CacheOTPStore())
+        self.assertFalse(OTP.objects.exists())
+
+    @override_settings(OTP_STORE='database')
+    def test_concurrent_redeems_use_the_row_once(self):
+        store = DatabaseOTPStore()
+        otp = store.issue(self.user)
+        row = OTP.objects.get()
+        # Another request deletes the row between this one's lookup and its delete
+        with mock.patch.object(QuerySet, 'first', side_effect=lambda: OTP.objects.filter(pk=row.pk).delete() and row):
+            self.assertEqual(store.redeem(self.user, otp), UNKNOWN)
+
+    @override_settings(OTP_STORE='database', OTP_TTL_SECONDS=300)
+    def test_expired_otp_is_rejected(self):
+        otp = DatabaseOTPStore().issue(self.user)
+        # Older than a day, which the day-blind seconds comparison used to let through
+        OTP.objects.update(created_at=timezone.now() - timedelta(days=1, seconds=10))
+
+        response = self.verify(otp)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data, {'error': 'OTP expired.'})
+        self.user.refresh_from_db()
+        self.assertFalse(self.user.is_active)
+        # The expired code was consumed as well
+        self.assertEqual(self.verify(otp).status_code, 404)
+
+    @override_settings(OTP_STORE='database')
+    def test_otp_of_another_user_is_rejected(self):
+        other = User.objects.create_user(email='other@example.com', username='other')
+        store = DatabaseOTPStore()
+        otp = store.issue(other)
+
+        self.assertEqual(self.verify(otp).status_code, 404)
+        self.assertEqual(store.redeem(other, otp), VALID)
+
+    @override_settings(OTP_TTL_SECONDS=300)
+    def test_expired_rows_are_purged(self):
+        others = [User.objects.create_user(email=f'user{i}@example.com', username=f'user{i}') for i in range(2)]
+        DatabaseOTPStore().issue_many([self.user, *others])
+        OTP.objects.filter(user=others[0]).update(created_at=timezone.now() - timedelta(seconds=301))
+        OTP.objects.filter(user=others[1]).update(created_at=None)
+
+        self.assertEqual(purge_expired_otps(), 2)
+        self.assertQuerySetEqual(OTP.objects.values_list('user', flat=True), [self.user.pk])
+
+
+class EmailOutboxTests(UserAuthTestCase):
+    def queue(self, count):
+        with self.captureOnCommitCallbacks(execute=True):
+            queue_emails([make_email("Subject", f"Message {i}", [f"user{i}@example.com"]) for i in range(count)])
+
+    @override_settings(EMAIL_OUTBOX_BATCH_SIZE=2)
+    def test_emails_are_sent_in_batches(self):
+        with mock.patch.object(send_queued_emails, 'delay'):
+            self.queue(5)
+        with mock.patch('userauth.emails.get_connection', wraps=get_connection) as connections:
+            self.assertEqual(send_queued_emails(), 5)
+        self.assertEqual(connections.call_count, 3)
+        self.assertEqual(sorted(message.to[0] for message in mail.outbox), [f"user{i}@example.com" for i in range(5)])
+        self.assertFalse(OutgoingEmail.objects.exclude(status="sent").exists())
+        # Nothing is sent twice
+        self.assertEqual(send_queued_emails(), 0)
+
+    def test_queuing_kicks_one_drain(self):
+        with mock.patch.object(send_queued_emails, 'delay') as delay:
+            self.queue(1)
+            self.queue(1)
+            self.assertEqual(delay.call_count, 1)
+            send_queued_emails()
+            self.queue(1)
+            self.assertEqual(delay.call_count, 2)
+
+    def test_activation_email_carries_the_code(self):
+        user = User.objects.create_user(email='user@example.com', username='user', is_active=False)
+        with override_settings(OTP_STORE='database'), mock.patch.object(send_queued_emails, 'delay'):
+            with self.captureOnCommitCallbacks(execute=True):
+                send_activation_email(user.pk)
+        send_queued_emails()
+        self.assertEqual(mail.outbox[0].to, ['user@example.com'])
+        self.assertTrue(mail.outbox[0].body.endswith(OTP.objects.get(user=user).otp))
+
+    @override_settings(EMAIL_OUTBOX_MAX_ATTEMPTS=2)
+    def test_failed_batches_are_retried_with_backoff(self):
+        with mock.patch.object(send_queued_emails, 'delay'):
+            self.queue(2)
+        failure = mock.patch.object(locmem.EmailBackend, 'send_messages', side_effect=SMTPException("Unavailable"))
+        with failure, self.assertLogs('userauth.emails', 'WARNING'):
+            self.assertEqual(send_queued_emails(), 0)
+            email = OutgoingEmail.objects.first()
+            self.assertEqual((email.status, email.attempts, email.last_error), ("pending", 1, "Unavailable"))
+            self.assertGreater(email.next_attempt_at, timezone.now())
+
+            OutgoingEmail.objects.update(next_attempt_at=timezone.now())
+            send_queued_emails()
+        self.assertEqual(list(OutgoingEmail.objects.values_list('status', 'attempts')), [("failed", 2)] * 2)
+
+    @override_settings(EMAIL_OUTBOX_CONCURRENCY=1)
+    def test_busy_slots_leave_the_outbox_alone(self):
+        with mock.patch.object(send_queued_emails, 'delay'):
+            self.queue(1)
+        slot = acquire_drain_slot()
+        self.assertEqual(send_queued_emails(), 0)
+        release_drain_slot(slot)
+        self.assertEqual(send_queued_emails(), 1)
+
+    def test_benchmark_leaves_queued_emails_alone(self):
+        with mock.patch.object(send_queued_emails, 'delay'):
+            self.queue(1)
+        output = StringIO()
+        call_command('benchmark_email_outbox', messages=3, batch_size=2, stdout=output)
+        self.assertRegex(output.getvalue(), r"outbox \(batches of 2\) +3 messages")
+        self.assertEqual(list(OutgoingEmail.objects.values_list('status', flat=True)), ["pending"])
+
+
+def registration_row(i, **fields):
+    return {
+        'email': f'user{i}@Example.com', 'username': f'user{i}', 'first_name': "First", 'last_name': "Last",
+        'password': f'password-{i}', 'is_doctor': False, 'is_patient': True, **fields,
+    }
+
+
+@override_settings(
+    PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'], OTP_STORE='database', BULK_REGISTRATION_CHUNK_SIZE=3,
+)
+class BulkRegistrationTests(UserAuthTestCase):
+    url = '/api/auth/user/register/bulk/'
+
+    def setUp(self):
+        super().setUp()
+        self.staff = User.objects.create_user(email='staff@example.com', username='staff', is_staff=True)
+        self.client = APIClient()
+        self.client.force_authenticate(self.staff)
+
+    def test_rows_are_registered(self):
+        User.objects.create_user(email='user3@example.com', username='taken')
+        hospital = Hospital.objects.create(name="Hospital", address="Address")
+        rows = [registration_row(i, is_doctor=i % 2 == 0) for i in range(6)]
+        rows += [registration_row(1, username='other'), {'email': 'invalid'}, registration_row(9, username='user2')]
+
+        results = register_users(rows, hospital=hospital, workers=1)
+
+        self.assertEqual(
+            [result['status'] for result in results],
+            ['created', 'created', 'created', 'duplicate', 'created', 'created', 'duplicate', 'invalid', 'duplicate'],
+        )
+        self.assertEqual(Doctor.objects.filter(hospital=hospital).count(), 3)
+        self.assertEqual(Patient.objects.count(), 2)
+        self.assertTrue(User.objects.get(email='user5@example.com').check_password('password-5'))
+        self.assertEqual(OTP.objects.count(), 5)
+        self.assertEqual(OutgoingEmail.objects.count(), 5)
+
+    def test_passwords_never_reach_the_broker(self):
+        rows = [registration_row(i) for i in range(5)] + [{'email': 'invalid'}]
+        with mock.patch.object(register_users_chunk, 'delay') as delay:
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.post(self.url, {'users': rows}, format='json')
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response['Location'], response.data['status_url'])
+
+        chunk_ids = [call.args[0] for call in delay.call_args_list]
+        self.assertEqual([call.kwargs for call in delay.call_args_list], [{}, {}])
+        self.assertTrue(all(isinstance(chunk_id, int) for chunk_id in chunk_ids))
+        for chunk in BulkRegistrationChunk.objects.all():
+            self.assertNotIn('password-', chunk.rows)
+        self.assertEqual([row['password'] for _, row in open_rows(BulkRegistrationChunk.objects.get(pk=chunk_ids[1]).rows)],
+                         ['password-3', 'password-4'])
+
+        with mock.patch.object(send_queued_emails, 'delay'):
+            self.assertEqual([register_users_chunk(chunk_id) for chunk_id in chunk_ids], [3, 2])
+            # A task delivered twice finds its rows gone
+            self.assertEqual(register_users_chunk(chunk_ids[0]), 0)
+        self.assertFalse(BulkRegistrationChunk.objects.exists())
+
+        job = self.client.get(response.data['status_url']).data
+        self.assertEqual(job['status'], 'done')
+        self.assertEqual(job['counts'], {'created': 5, 'invalid': 1})
+        self.assertTrue(User.objects.get(email='user4@example.com').check_password('password-4'))
+
+    def test_csv_uploads(self):
+        body = 'email,username,password,is_patient\r\nc1@example.com,c1,longpassword,true\r\nbad,,x,1\r\n'
+        with mock.patch.object(register_users_chunk, 'delay'):
+            response = self.client.post(self.url, body, content_type='text/csv')
+        self.assertEqual([result['status'] for result in response.data['results']], ['pending', 'invalid'])
+
+    def test_staff_only(self):
+        client = APIClient()
+        client.force_authenticate(User.objects.create_user(email='user@example.com', username='user'))
+        self.assertEqual(client.post(self.url, {'users': [registration_row(1)]}, format='json').status_code, 403)
+        response = self.client.post(self.url, {'users': [{'email': 'invalid'}]}, format='json')
+        self.assertEqual(client.get(response.data['status_url']).status_code, 403)
@@ -1,23 +1,25 @@
-from rest_framework_simplejwt.views import (
-    TokenObtainPairView,
-    TokenRefreshView,
-)
+from rest_framework_simplejwt.views import TokenRefreshView
 from django.urls import path
 from .views import (
     RegistrationAPIView,
+    BulkRegistrationAPIView,
+    BulkRegistrationJobAPIView,
     VerifyEmailAPIView,
     ResendVerifyEmailAPIView,
     UserAPIView,
     UserLogInAPIView,
     DoctorProfileAPIView,
     PatientProfileAPIView,
+    RoleTokenObtainPairView,
 )
 
 urlpatterns = [
     # Authentication endpoints
-    path('token/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
+    path('token/', RoleTokenObtainPairView.as_view(), name='token_obtain_pair'),
     path('token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
     path('user/register/', RegistrationAPIView.as_view(), name='register'),
+    path('user/register/bulk/', BulkRegistrationAPIView.as_view(), name='bulk_register'),
+    path('user/register/bulk/<int:pk>/', BulkRegistrationJobAPIView.as_view(), name='bulk_register_job'),
     path('user/verify-email/', VerifyEmailAPIView.as_view(), name='verify_email'),
     path('user/resend-verify-email/', ResendVerifyEmailAPIView.as_view(), name='resend_verify_email'),
     path('user/login/', UserLogInAPIView.as_view(), name='login'),
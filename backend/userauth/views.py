@@ -1,12 +1,22 @@
+from django.conf import settings
+from django.db import transaction
+from django.http import Http404
 from django.shortcuts import get_object_or_404
+from django.urls import reverse
+from django.utils import timezone
 from rest_framework import generics, status
 from rest_framework.views import APIView
 from rest_framework.response import Response
-from rest_framework.permissions import IsAuthenticated, AllowAny
+from rest_framework.permissions import IsAuthenticated, AllowAny, IsAdminUser
+from rest_framework.exceptions import ValidationError
+from rest_framework.settings import api_settings
 from rest_framework.authtoken.models import Token
+from rest_framework_simplejwt.views import TokenObtainPairView
 from django.contrib.auth import authenticate
 
-from .models import User, OTP, Doctor, Patient
+from .bulk import chunked, seal_rows, validate_rows
+from .models import BulkRegistrationChunk, BulkRegistrationJob, User, Doctor, Patient, Hospital
+from .otp import EXPIRED, UNKNOWN, get_otp_store
 from .serializers import (
     RegistrationSerializer,
     VerifyEmailSerializer,
@@ -15,7 +25,11 @@ from .serializers import (
     LoginSerializer,
     DoctorProfileSerializer,
     PatientProfileSerializer,
+    RoleTokenObtainPairSerializer,
+    BulkRegistrationJobSerializer,
 )
+from .parsers import CSVParser, NDJSONParser
+from .tasks import register_users_chunk, send_activation_email
 
 
 # Registration API View
@@ -41,6 +55,68 @@ class RegistrationAPIView(generics.CreateAPIView):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
+# Bulk Registration API View
+class BulkRegistrationAPIView(APIView):
+    """
+    Register many users at once (staff only), from a JSON list, CSV with a header row or
+    NDJSON, with the fields of RegistrationAPIView. Doctors join the hospital given by the
+    `hospital_id` query parameter. Rows are validated here and registered by Celery tasks;
+    the 202 response describes the job, whose progress BulkRegistrationJobAPIView reports.
+    """
+    permission_classes = [IsAdminUser]
+    parser_classes = api_settings.DEFAULT_PARSER_CLASSES + [CSVParser, NDJSONParser]
+    max_batch_size = 5000
+
+    def post(self, request):
+        rows = request.data.get("users") if isinstance(request.data, dict) else request.data
+        if not isinstance(rows, list) or not rows:
+            raise ValidationError({"users": "A non-empty list of users is required."})
+        if len(rows) > self.max_batch_size:
+            raise ValidationError({"users": f"At most {self.max_batch_size} users can be registered at once."})
+
+        hospital = None
+        hospital_id = request.query_params.get("hospital_id")
+        if hospital_id:
+            hospital = get_object_or_404(Hospital, pk=hospital_id)
+
+        results, pending = validate_rows(rows)
+        chunks = list(chunked(pending, settings.BULK_REGISTRATION_CHUNK_SIZE))
+        with transaction.atomic():
+            job = BulkRegistrationJob.objects.create(
+                created_by=request.user,
+                hospital=hospital,
+                results=results,
+                remaining_chunks=len(chunks),
+                status="pending" if chunks else "done",
+                finished_at=None if chunks else timezone.now(),
+            )
+            for chunk in chunks:
+                # Tasks only get the id of the encrypted rows, which hold the passwords
+                chunk = BulkRegistrationChunk.objects.create(job=job, rows=seal_rows(chunk))
+                transaction.on_commit(lambda chunk_id=chunk.pk: register_users_chunk.delay(chunk_id))
+
+        status_url = reverse('bulk_register_job', args=[job.pk])
+        return Response(
+            {
+                "message": f"{len(pending)} of {len(results)} users queued for registration.",
+                "job_id": job.pk,
+                "status_url": status_url,
+                **BulkRegistrationJobSerializer(job).data,
+            },
+            status=status.HTTP_202_ACCEPTED,
+            headers={"Location": status_url},
+        )
+
+
+class BulkRegistrationJobAPIView(generics.RetrieveAPIView):
+    """
+    Progress and per-row results of a bulk registration (staff only).
+    """
+    queryset = BulkRegistrationJob.objects.all()
+    serializer_class = BulkRegistrationJobSerializer
+    permission_classes = [IsAdminUser]
+
+
 # Verify Email API View
 class VerifyEmailAPIView(generics.CreateAPIView):
     serializer_class = VerifyEmailSerializer
@@ -54,22 +130,22 @@ class VerifyEmailAPIView(generics.CreateAPIView):
             email = serializer.validated_data.get('email')
 
             user = get_object_or_404(User, email=email)
-            otp_instance = get_object_or_404(OTP, user=user, otp=otp)
 
-            # Check OTP expiration
-            if checkOTPExpiration(otp_instance):
-                user.is_active = True
-                user.save()
-                otp_instance.delete()
-                return Response(
-                    {"message": "Email verified successfully!"},
-                    status=status.HTTP_200_OK,
-                )
-            else:
-                otp_instance.delete()
+            # The store consumes the code and enforces its expiration
+            result = get_otp_store().redeem(user, otp)
+            if result == UNKNOWN:
+                raise Http404("No OTP matches the given query.")
+            if result == EXPIRED:
                 return Response(
                     {"error": "OTP expired."}, status=status.HTTP_400_BAD_REQUEST
                 )
+
+            user.is_active = True
+            user.save()
+            return Response(
+                {"message": "Email verified successfully!"},
+                status=status.HTTP_200_OK,
+            )
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
@@ -100,6 +176,12 @@ class ResendVerifyEmailAPIView(APIView):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
+# JWT Obtain Pair API View
+class RoleTokenObtainPairView(TokenObtainPairView):
+    """Obtain an access/refresh JWT pair carrying the user's role claims."""
+    serializer_class = RoleTokenObtainPairSerializer
+
+
 # Login API View
 class UserLogInAPIView(generics.CreateAPIView):
     serializer_class = LoginSerializer